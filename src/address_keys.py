@@ -0,0 +1,49 @@
+import hashlib
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+
+
+def _base58check(payload):
+    return hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+
+
+def address_key(address):
+    """
+    20-байтовый ключ адреса или None
+
+    EVM: байты hex-адреса; Tron: base58check-адрес без префикса 0x41 и
+    контрольной суммы, то есть тот же 20-байтовый адрес.
+    """
+    address = address.strip()
+    if len(address) == 42 and address[:2].lower() == '0x':
+        try:
+            return bytes.fromhex(address[2:])
+        except ValueError:
+            return None
+    if len(address) == 34 and address[0] == 'T':
+        number = 0
+        for char in address:
+            if char not in BASE58_INDEX:
+                return None
+            number = number * 58 + BASE58_INDEX[char]
+        if number >> 200:
+            return None
+        raw = number.to_bytes(25, 'big')
+        if raw[0] != 0x41 or raw[21:] != _base58check(raw[:21]):
+            return None
+        return raw[1:21]
+    return None
+
+
+def key_to_address(key, chain):
+    """Обратное к address_key: строка адреса по 20 байтам и сети"""
+    if chain != 'tron':
+        return '0x' + key.hex()
+    raw = b'\x41' + key
+    number = int.from_bytes(raw + _base58check(raw), 'big')
+    chars = []
+    while number:
+        number, remainder = divmod(number, 58)
+        chars.append(BASE58_ALPHABET[remainder])
+    return ''.join(reversed(chars))
@@ -0,0 +1,750 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from metrics import PAGE_SECONDS, PAGES, RECORDS
+
+# Прозрачный PNG 1x1 для иконок токенов из фикстур
+PNG_PIXEL = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.json': 'application/json',
+    '.js': 'application/javascript',
+    '.css': 'text/css',
+    '.png': 'image/png',
+    '.svg': 'image/svg+xml'
+}
+
+# Классы Playwright, методы которых ходят в браузер
+PLAYWRIGHT_CLASSES = ('Page', 'Frame', 'Locator', 'ElementHandle', 'JSHandle', 'BrowserContext')
+
+# Сравнение с базовым отчетом: метрика -> True, если больше - лучше
+COMPARED_METRICS = {
+    'rows_per_s': True,
+    'page_p50_ms': False,
+    'page_p95_ms': False,
+    'playwright_calls_per_row': False,
+    'db_per_row': False
+}
+
+
+def fixture_path(directory, path, query):
+    """/tag/exchange?page=2 -> tag/exchange__page-2.html, /ethereum/tx-list -> ethereum/tx-list.html"""
+    relative = path.strip('/') or 'index'
+    page = parse_qs(query).get('page', ['1'])[0]
+    candidates = []
+    if page != '1':
+        candidates.append(f"{relative}__page-{page}.html")
+    candidates += [relative, f"{relative}.html"]
+    for candidate in candidates:
+        full = os.path.normpath(os.path.join(directory, candidate))
+        if full.startswith(os.path.normpath(directory)) and os.path.isfile(full):
+            return full
+    return None
+
+
+def load_har(path):
+    """Ответы из HAR: путь с query -> (status, content-type, body); первый ответ на путь побеждает"""
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)['log']['entries']
+    responses = {}
+    for entry in entries:
+        url = urlparse(entry['request']['url'])
+        key = url.path + (f"?{url.query}" if url.query else '')
+        if key in responses:
+            continue
+        content = entry['response'].get('content', {})
+        text = content.get('text', '')
+        body = base64.b64decode(text) if content.get('encoding') == 'base64' else text.encode('utf-8')
+        responses[key] = (entry['response']['status'], content.get('mimeType', 'text/html'), body)
+    return responses
+
+
+class FixtureServer:
+    """
+    Локальный HTTP-сервер сохраненных страниц с искусственной задержкой
+
+    Ответ ищется сначала среди записанных в HAR (по пути с query), затем в
+    каталоге фикстур (см. fixture_path). Каждый ответ задерживается на
+    latency_ms плюс случайные 0..jitter_ms, чтобы имитировать сеть.
+    """
+    def __init__(self, directory, latency_ms=0, jitter_ms=0, har_path=None, host='127.0.0.1', port=0):
+        self.directory = directory
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.har = load_har(har_path) if har_path else {}
+        self.requests = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_port}"
+
+    def _handler(self):
+        fixtures = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(fixtures.latency + random.uniform(0, fixtures.jitter))
+                status, content_type, body = fixtures.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.getLogger(__name__).debug(format % args)
+
+        return Handler
+
+    def respond(self, raw_path):
+        url = urlparse(raw_path)
+        with self._lock:
+            self.requests += 1
+        key = url.path + (f"?{url.query}" if url.query else '')
+        if key in self.har:
+            return self.har[key]
+        path = fixture_path(self.directory, url.path, url.query)
+        if path:
+            with open(path, 'rb') as f:
+                return 200, CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'), f.read()
+        if url.path.endswith('.png'):
+            return 200, 'image/png', PNG_PIXEL
+        with self._lock:
+            self.misses += 1
+        return 404, 'text/plain', b'not found'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fixture-server', daemon=True).start()
+        logging.info(f"Фикстуры {self.directory} на {self.url}, задержка {self.latency * 1000:.0f}+{self.jitter * 1000:.0f} ms")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Синтетическая страница tx-list: tooltip'ы появляются по mouseenter,
+# как у OKLink, и убираются по mouseleave
+OKLINK_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{chain} tx-list</title></head>
+<body>
+<div class="tx-list">
+{rows}
+</div>
+<script>
+const show = (cls, text) => {{
+    document.querySelectorAll('.bench-tooltip').forEach((el) => el.remove());
+    const el = document.createElement('div');
+    el.className = 'bench-tooltip ' + cls;
+    el.innerText = text;
+    document.body.appendChild(el);
+}};
+const hide = () => document.querySelectorAll('.bench-tooltip').forEach((el) => el.remove());
+document.querySelectorAll('.index_wrapper__ns7tB[data-tooltip]').forEach((row) => {{
+    row.addEventListener('mouseenter', () => setTimeout(() => show('index_title__9lx6D', row.dataset.tooltip), {delay}));
+    row.addEventListener('mouseleave', hide);
+}});
+document.querySelectorAll('.oklink-explore-danger').forEach((icon) => {{
+    icon.addEventListener('mouseenter', () => setTimeout(
+        () => show('okui-popup-layer-content index_conWrapper__PSJYS', icon.dataset.risk), {delay}
+    ));
+    icon.addEventListener('mouseleave', hide);
+}});
+</script>
+</body></html>
+"""
+
+ETHPLORER_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{tag}</title></head>
+<body>
+<table><tbody>
+{rows}
+</tbody></table>
+<ul class="pagination">
+{pages}
+</ul>
+</body></html>
+"""
+
+TYPES = ('Exchange', 'Bridge', 'DeFi', 'Wallet', 'Mining')
+RISKS = ('Phishing', 'Scam', 'Hack', 'Sanctioned')
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def synthetic_address(chain, i):
+    digest = hashlib.sha512(f"{chain}:{i}".encode()).digest()
+    if chain == 'tron':
+        return 'T' + ''.join(BASE58_ALPHABET[byte % 58] for byte in digest[:33])
+    return '0x' + digest[:20].hex()
+
+
+def oklink_rows(chain, rows, risk_share=0.1, named_share=0.4):
+    """HTML строк tx-list: часть с иконкой риска, часть с именем, остальные только с адресом"""
+    result = []
+    for i in range(rows):
+        address = synthetic_address(chain, i)
+        short = f"{address[:6]}...{address[-4:]}"
+        link = f'<a class="index_address__7NLO9" href="/{chain}/address/{address}">{{text}}</a>'
+        bucket = (i * 7919 % 100) / 100
+        if bucket < risk_share:
+            risk = f"This address is reported as {RISKS[i % len(RISKS)]} address"
+            result.append(
+                f'<div class="index_wrapper__ns7tB">{link.format(text=short)}'
+                f'<span class="oklink-explore-danger" data-risk="{risk}">!</span></div>'
+            )
+        elif bucket < risk_share + named_share:
+            name = f"Entity {i}"
+            label_type = TYPES[i % len(TYPES)]
+            tooltip = f"{label_type}: {name}&#10;{address}" if chain == 'tron' else f"{label_type}: {name} {address}"
+            result.append(
+                f'<div class="index_wrapper__ns7tB" data-tooltip="{tooltip}">{link.format(text=name)}</div>'
+            )
+        else:
+            result.append(f'<div class="index_wrapper__ns7tB">{link.format(text=short)}</div>')
+    return '\n'.join(result)
+
+
+def ethplorer_rows(tag, page, rows):
+    result = []
+    for i in range((page - 1) * rows, page * rows):
+        address = synthetic_address(f"ethplorer:{tag}", i)
+        extra = TYPES[i % len(TYPES)].lower()
+        result.append(
+            '<tr>'
+            f'<td class="tags-table-address"><span class="overflow-center-elips">{address}</span></td>'
+            f'<td class="tags-table-token"><img class="tags-table-token-icon" src="/images/tokens/{i % 50}.png">'
+            f'<a href="/address/{address}">Token {i}</a></td>'
+            '<td><span class="tags-list">'
+            f'<a class="tag__public" href="/tag/{tag}"><span class="tag_name">{tag}</span></a>'
+            f'<a class="tag__public" data-tag="{extra}" href="/tag/{extra}"></a>'
+            '</span></td>'
+            '</tr>'
+        )
+    return '\n'.join(result)
+
+
+def ethplorer_pagination(tag, page, pages):
+    items = [
+        f'<li class="page-item"><a class="page-link" href="/tag/{tag}?page={number}">{number}</a></li>'
+        for number in range(1, pages + 1)
+    ]
+    if page < pages:
+        items.append(f'<li class="page-item"><a class="page-link" href="/tag/{tag}?page={page + 1}">»</a></li>')
+    else:
+        items.append('<li class="page-item disabled"><a class="page-link" href="#">»</a></li>')
+    return '\n'.join(items)
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def generate_fixtures(directory, chains=('ethereum',), rows=100, tags=('exchange',), pages=3,
+                      rows_per_page=50, tooltip_delay_ms=20):
+    """
+    Синтетические фикстуры с разметкой OKLink и Ethplorer
+
+    oklink/<chain>/tx-list.html и ethplorer/tag/<tag>[__page-N].html; нужны,
+    пока нет записанных с сайтов снимков (см. record_fixture).
+    """
+    for chain in chains:
+        _write(
+            os.path.join(directory, 'oklink', chain, 'tx-list.html'),
+            OKLINK_PAGE.format(chain=chain, rows=oklink_rows(chain, rows), delay=tooltip_delay_ms)
+        )
+    for tag in tags:
+        for page in range(1, pages + 1):
+            name = f"{tag}.html" if page == 1 else f"{tag}__page-{page}.html"
+            _write(
+                os.path.join(directory, 'ethplorer', 'tag', name),
+                ETHPLORER_PAGE.format(
+                    tag=tag,
+                    rows=ethplorer_rows(tag, page, rows_per_page),
+                    pages=ethplorer_pagination(tag, page, pages)
+                )
+            )
+    _write(
+        os.path.join(directory, 'ethplorer', 'tag.html'),
+        '<html><body>' + ''.join(
+            f'<div class="word-cloud-item"><a href="/tag/{tag}">{tag}</a></div>' for tag in tags
+        ) + '</body></html>'
+    )
+    logging.info(f"Фикстуры сгенерированы в {directory}: сетей {len(chains)}, тегов {len(tags)}")
+
+
+def record_fixture(url, directory, har_path=None, wait_ms=5000):
+    """
+    Сохраняет страницу с сайта: отрисованный DOM в каталог фикстур и,
+    если задан har_path, все ответы в HAR для FixtureServer
+    """
+    from playwright.sync_api import sync_playwright
+    parsed = urlparse(url)
+    path = os.path.join(directory, parsed.path.strip('/') + '.html')
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        context = browser.new_context(record_har_path=har_path) if har_path else browser.new_context()
+        page = context.new_page()
+        page.goto(url, wait_until='domcontentloaded')
+        page.wait_for_timeout(wait_ms)
+        _write(path, page.content())
+        context.close()
+        browser.close()
+    logging.info(f"{url} сохранен в {path}" + (f", ответы в {har_path}" if har_path else ''))
+
+
+def _har_entry(url, mime_type, text, encoding=None):
+    content = {'size': len(text), 'mimeType': mime_type, 'text': text}
+    if encoding:
+        content['encoding'] = encoding
+    return {
+        'request': {'method': 'GET', 'url': url, 'headers': []},
+        'response': {'status': 200, 'headers': [{'name': 'Content-Type', 'value': mime_type}], 'content': content}
+    }
+
+
+def synthetic_har(path, chain='ethereum', rows=20):
+    """
+    HAR с JSON-ответами API вида OKLink для проверки extract_labels
+
+    Метки разложены во всех поддерживаемых формах: fromTag/toTag строкой
+    "Type: Name", список toTags, словарь entityTag и ключ address с tag.
+    Кроме ответов API в HAR есть HTML-страница и ответ без меток, из них
+    записей быть не должно. Возвращает ожидаемые записи type/name/address.
+    """
+    base = f"https://www.oklink.com/api/explorer/v1/{chain}"
+    transactions = []
+    expected = []
+    for i in range(rows):
+        sender = synthetic_address(chain, 2 * i)
+        receiver = synthetic_address(chain, 2 * i + 1)
+        label_type = TYPES[i % len(TYPES)]
+        transaction = {'hash': f"0x{i:064x}", 'from': sender, 'to': receiver, 'value': str(i)}
+        if i % 3 == 0:
+            transaction['fromTag'] = f"{label_type}: Entity {i}"
+            expected.append({'type': label_type, 'name': f"Entity {i}", 'address': sender})
+        if i % 3 == 1:
+            transaction['toTags'] = [f"Router {i}", {'type': label_type, 'name': f"Pool {i}"}]
+            expected.append({'type': 'other', 'name': f"Router {i}", 'address': receiver})
+            expected.append({'type': label_type, 'name': f"Pool {i}", 'address': receiver})
+        if i % 3 == 2:
+            # Метка, совпадающая с адресом, меткой не считается
+            transaction['toTag'] = receiver
+            transaction['fromEntityTag'] = {'category': label_type, 'tag': f"Fund {i}"}
+            expected.append({'type': label_type, 'name': f"Fund {i}", 'address': sender})
+        transactions.append(transaction)
+    holder = synthetic_address(chain, 2 * rows)
+    expected.append({'type': 'Exchange', 'name': 'Hot Wallet', 'address': holder})
+
+    page = json.dumps({'code': 0, 'data': {'hits': transactions[:rows // 2]}})
+    # Вторая страница в base64, как Chromium пишет сжатые ответы
+    second = json.dumps({'code': 0, 'data': {'hits': transactions[rows // 2:]}})
+    info = json.dumps({'data': [{'address': holder, 'tag': 'Exchange: Hot Wallet', 'balance': '1'}]})
+    har = {'log': {'version': '1.2', 'creator': {'name': 'benchmark', 'version': '1'}, 'entries': [
+        _har_entry(f"https://www.oklink.com/{chain}/tx-list", 'text/html', '<html></html>'),
+        _har_entry(f"{base}/transactions?offset=0", 'application/json', page),
+        _har_entry(f"{base}/transactions?offset={rows // 2}", 'application/json; charset=utf-8',
+                   base64.b64encode(second.encode()).decode(), encoding='base64'),
+        _har_entry(f"{base}/address/info", 'application/json', info),
+        _har_entry(f"{base}/stats", 'application/json', json.dumps({'data': {'from': sender}})),
+    ]}}
+    _write(path, json.dumps(har, indent=1))
+    return expected
+
+
+def check_har(har_path, url_pattern, chain, expected):
+    """
+    Прогоняет extract_labels по JSON-ответам HAR и сравнивает с ожидаемым
+
+    Возвращает список расхождений; пустой список - проверка пройдена.
+    """
+    from interception import extract_labels, payloads_from_har
+    found = [
+        record
+        for payload in payloads_from_har(har_path, url_pattern)
+        for record in extract_labels(payload, chain)
+    ]
+    key = lambda record: (record['address'], record['name'], record['type'])
+    found_keys = Counter(map(key, found))
+    expected_keys = Counter(map(key, expected))
+    problems = [f"не найдено: {record}" for record in sorted(expected_keys - found_keys)]
+    problems += [f"лишнее: {record}" for record in sorted(found_keys - expected_keys)]
+    return problems
+
+
+class RecordingRepository:
+    """
+    Подмена AddressRepository без Postgres: считает вызовы и копит записи
+
+    delay_ms имитирует время ответа БД на каждый вызов записи.
+    """
+    def __init__(self, delay_ms=0):
+        self.delay = delay_ms / 1000
+        self.records = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _record(self, method, items=()):
+        with self._lock:
+            self.calls[method] += 1
+            self.records.extend(items)
+
+    @property
+    def db_calls(self):
+        return sum(self.calls.values())
+
+    def save_addresses_bulk(self, items, source='oklink-txs'):
+        time.sleep(self.delay)
+        self._record('save_addresses_bulk', items)
+        return len(items)
+
+    def save_address(self, address_data):
+        time.sleep(self.delay)
+        self._record('save_address', [address_data])
+
+    def save_icons(self, icons, urls, links):
+        self._record('save_icons')
+        return {(chain, address) for chain, address, _ in links}
+
+    def get_icon_urls(self):
+        return {}
+
+    def get_known_addresses(self, tag_names=None):
+        return {}
+
+
+class AsyncRecordingRepository(RecordingRepository):
+    """RecordingRepository для AsyncWriteBehindQueue"""
+
+    async def save_addresses_bulk(self, items, source='oklink-txs'):
+        await asyncio.sleep(self.delay)
+        self._record('save_addresses_bulk', items)
+        return len(items)
+
+    async def get_known_addresses(self, tag_names=None):
+        return {}
+
+
+class CountingCursor:
+    def __init__(self, cursor, database):
+        self._cursor = cursor
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def execute(self, *args, **kwargs):
+        self._database.count()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._database.count()
+        return self._cursor.executemany(*args, **kwargs)
+
+
+class CountingConnection:
+    def __init__(self, conn, database):
+        self._conn = conn
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._conn.cursor(*args, **kwargs), self._database)
+
+
+class CountingDatabase:
+    """Обертка Database (psycopg2), считающая выполненные запросы"""
+    def __init__(self, db):
+        self.db = db
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def count(self):
+        with self._lock:
+            self.statements += 1
+
+    @contextmanager
+    def get_connection(self):
+        with self.db.get_connection() as conn:
+            yield CountingConnection(conn, self)
+
+
+class PlaywrightCallCounter:
+    """
+    Считает вызовы методов Playwright на время блока with
+
+    Учитываются только методы, которые в async API являются корутинами:
+    каждый из них - минимум один round-trip до браузера по CDP.
+    locator(), nth() и подобные строятся локально и не считаются.
+    """
+    def __init__(self):
+        self.calls = Counter()
+        self._patched = []
+
+    def _wrap(self, name, function):
+        calls = self.calls
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                calls[name] += 1
+                return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                calls[name] += 1
+                return function(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        from playwright import async_api, sync_api
+        for class_name in PLAYWRIGHT_CLASSES:
+            async_class = getattr(async_api, class_name)
+            remote = {
+                name for name, attr in vars(async_class).items()
+                if not name.startswith('_') and inspect.iscoroutinefunction(attr)
+            }
+            for module in (async_api, sync_api):
+                cls = getattr(module, class_name)
+                for name in remote:
+                    original = vars(cls).get(name)
+                    if inspect.isfunction(original):
+                        setattr(cls, name, self._wrap(f"{class_name}.{name}", original))
+                        self._patched.append((cls, name, original))
+        return self
+
+    def __exit__(self, *exc):
+        for cls, name, original in self._patched:
+            setattr(cls, name, original)
+        self._patched = []
+        return False
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+
+def _counter_total(counter):
+    return sum(value for _, _, value in counter.samples())
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def build_report(scenario, elapsed, server, calls, repository=None, database=None):
+    """Отчет прогона: скорость, задержки страниц, вызовы Playwright и БД на строку"""
+    pages = _counter_total(PAGES)
+    records = _counter_total(RECORDS)
+    page_ms = [value * 1000 for value in PAGE_SECONDS.recent()]
+    per_row = lambda value: round(value / records, 3) if records else None
+    if database is not None:
+        db_kind, db_total = 'statements', database.statements
+    else:
+        db_kind, db_total = 'repository_calls', repository.db_calls
+    return {
+        'scenario': scenario,
+        'elapsed_s': round(elapsed, 3),
+        'pages': pages,
+        'records': records,
+        'saved': len(repository.records) if repository is not None else None,
+        'rows_per_s': round(records / elapsed, 2) if elapsed else None,
+        'page_p50_ms': percentile(page_ms, 0.5),
+        'page_p95_ms': percentile(page_ms, 0.95),
+        'page_p99_ms': percentile(page_ms, 0.99),
+        'playwright_calls': calls.total,
+        'playwright_calls_per_row': per_row(calls.total),
+        'top_playwright_calls': dict(calls.calls.most_common(10)),
+        'db_kind': db_kind,
+        'db_total': db_total,
+        'db_per_row': per_row(db_total),
+        'http_requests': server.requests,
+        'http_misses': server.misses
+    }
+
+
+def compare(report, baseline, threshold=0.1):
+    """Печатает изменения относительно baseline; возвращает список ухудшившихся метрик"""
+    regressions = []
+    for name, higher_is_better in COMPARED_METRICS.items():
+        old, new = baseline.get(name), report.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change < -threshold if higher_is_better else change > threshold
+        if worse:
+            regressions.append(name)
+        print(f"{name:28} {old:>12.3f} -> {new:>12.3f} {change:+7.1%}{'  РЕГРЕССИЯ' if worse else ''}")
+    return regressions
+
+
+def run_oklink(server, chains, iterations, repository):
+    os.environ['OKLINK_BASE_URL'] = server.url
+    os.environ.setdefault('POLL_INTERVAL', '0')
+    # gpt_parser читает окружение при импорте
+    import gpt_parser
+    asyncio.run(gpt_parser.scrape_tooltips(chains, attempts=1, repository=repository, iterations=iterations))
+
+
+def run_ethplorer(server, tags, repository):
+    os.environ['BASE_URL'] = server.url
+    spec = importlib.util.spec_from_file_location(
+        'parser_ethplorer_tag', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser-ethplorer-tag.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    parser = module.EthplorerParser(repository=repository)
+    try:
+        for tag in tags:
+            parser.get_tag_data(tag)
+    finally:
+        parser.writer.close()
+        parser.icon_fetcher.close()
+        parser.close()
+
+
+def ethplorer_repository(database):
+    """Репозиторий Ethplorer: настоящий Postgres со счетчиком запросов или RecordingRepository"""
+    if not database:
+        return RecordingRepository(delay_ms=float(os.getenv('BENCH_DB_DELAY_MS', '0'))), None
+    from db.models import AddressRepository, TagCache, ThreadedDatabase
+    db = ThreadedDatabase({
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    })
+    db.init_tables()
+    counting = CountingDatabase(db)
+    return AddressRepository(counting, TagCache(counting)), counting
+
+
+def main(argv):
+    logging.basicConfig(
+        level=getattr(logging, os.getenv('BENCH_LOG_LEVEL', 'WARNING')),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    command = argv[1] if len(argv) > 1 else 'oklink'
+    fixtures = os.getenv('BENCH_FIXTURES', 'fixtures')
+    chains = [chain.strip() for chain in os.getenv('BENCH_CHAINS', 'ethereum').split(',') if chain.strip()]
+    tags = [tag.strip() for tag in os.getenv('BENCH_TAGS', 'exchange').split(',') if tag.strip()]
+
+    if command == 'generate':
+        generate_fixtures(
+            fixtures, chains=chains, tags=tags,
+            rows=int(os.getenv('BENCH_ROWS', '100')),
+            pages=int(os.getenv('BENCH_PAGES', '3')),
+            rows_per_page=int(os.getenv('BENCH_ROWS_PER_PAGE', '50'))
+        )
+        return 0
+    if command == 'record':
+        record_fixture(argv[2], os.path.join(fixtures, argv[3]), har_path=argv[4] if len(argv) > 4 else None)
+        return 0
+    if command == 'check-har':
+        # check-har [har url_pattern chain expected.json]; без аргументов - на синтетическом HAR
+        if len(argv) > 5:
+            har_path, url_pattern, chain = argv[2], argv[3], argv[4]
+            with open(argv[5], encoding='utf-8') as f:
+                expected = json.load(f)
+        else:
+            har_path, url_pattern, chain = os.path.join(fixtures, 'har', 'oklink-api.har'), r'/api/', chains[0]
+            expected = synthetic_har(har_path, chain)
+        problems = check_har(har_path, url_pattern, chain, expected)
+        for problem in problems:
+            print(problem)
+        print(f"{har_path}: ожидалось записей {len(expected)}, расхождений {len(problems)}")
+        return 1 if problems else 0
+    if command == 'compare':
+        with open(argv[2], encoding='utf-8') as f:
+            report = json.load(f)
+        with open(argv[3], encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 1 if compare(report, baseline, float(os.getenv('BENCH_THRESHOLD', '0.1'))) else 0
+    if command not in ('oklink', 'ethplorer'):
+        raise SystemExit(f"Неизвестная команда: {command} (oklink | ethplorer | generate | record | compare | check-har)")
+
+    site_dir = os.path.join(fixtures, command)
+    if not os.path.isdir(site_dir):
+        generate_fixtures(fixtures, chains=chains, tags=tags)
+    # Чекпоинты, spill-файл и логи парсеров - во временном каталоге, не в рабочем DATA_DIR
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench-')
+    os.environ['LOG_FILE'] = os.getenv('BENCH_LOG_FILE', 'benchmark.log')
+    os.makedirs('data', exist_ok=True)
+
+    server = FixtureServer(
+        site_dir,
+        latency_ms=float(os.getenv('BENCH_LATENCY_MS', '50')),
+        jitter_ms=float(os.getenv('BENCH_JITTER_MS', '20')),
+        har_path=os.getenv('BENCH_HAR') or None
+    ).start()
+    database = None
+    started = time.monotonic()
+    try:
+        with PlaywrightCallCounter() as calls:
+            if command == 'oklink':
+                repository = AsyncRecordingRepository(delay_ms=float(os.getenv('BENCH_DB_DELAY_MS', '0')))
+                run_oklink(server, chains, int(os.getenv('BENCH_ITERATIONS', '5')), repository)
+            else:
+                repository, database = ethplorer_repository(os.getenv('BENCH_DATABASE', 'false').lower() == 'true')
+                run_ethplorer(server, tags, repository)
+        elapsed = time.monotonic() - started
+    finally:
+        server.stop()
+
+    report = build_report(
+        command, elapsed, server, calls,
+        repository=repository if isinstance(repository, RecordingRepository) else None,
+        database=database
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    report_path = os.getenv('BENCH_REPORT')
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    baseline_path = os.getenv('BENCH_BASELINE')
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            return 1 if compare(report, json.load(f), float(os.getenv('BENCH_THRESHOLD', '0.1'))) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,213 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Флаги Chromium для скрапинга: без GPU, расширений и фоновых сервисов
+LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-dev-shm-usage',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--mute-audio',
+    '--no-first-run',
+]
+
+# Типы ресурсов и домены, которые не нужны для извлечения данных
+BLOCKED_RESOURCE_TYPES = ('image', 'font', 'media')
+BLOCKED_DOMAINS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'hotjar.com',
+    'facebook.net',
+    'clarity.ms',
+    'sentry.io',
+)
+
+# Те же типы в виде масок URL для блокировки через CDP
+BLOCKED_EXTENSIONS = {
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'svg', 'ico', 'avif'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'media': ('mp4', 'webm', 'mp3', 'ogg', 'wav'),
+}
+
+
+class PageTraffic:
+    """Байты и запросы страницы по событиям Network из CDP"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self.requests = 0
+        self.cached = 0
+        self.blocked = 0
+
+    def on_response(self, event):
+        if event['response'].get('fromDiskCache'):
+            self.cached += 1
+
+    def on_finished(self, event):
+        self.requests += 1
+        self.bytes += int(event.get('encodedDataLength', 0))
+
+    def on_failed(self, event):
+        if event.get('blockedReason'):
+            self.blocked += 1
+
+    def take(self):
+        """Счетчики с последнего take() и сброс"""
+        stats = {'bytes': self.bytes, 'requests': self.requests, 'cached': self.cached, 'blocked': self.blocked}
+        self.reset()
+        return stats
+
+    def summary(self):
+        stats = self.take()
+        return (
+            f"{stats['bytes'] / 1024:.0f} KB, запросов {stats['requests']}, "
+            f"из кэша {stats['cached']}, заблокировано {stats['blocked']}"
+        )
+
+
+class BrowserFactory:
+    """
+    Общие настройки Chromium, контекстов и страниц для всех парсеров
+
+    Блокирует ненужные типы ресурсов и домены аналитики и считает трафик
+    каждой страницы через CDP. С cache_dir статика хранится в дисковом
+    кэше между запусками; так как перехват запросов в Playwright отключает
+    HTTP-кэш, в этом режиме блокировка идет масками URL через CDP
+    (Network.setBlockedURLs), а без кэша — через page.route по типу ресурса.
+    """
+    def __init__(self, headless=True, cache_dir=None, cache_size_mb=256, block=True,
+                 block_types=BLOCKED_RESOURCE_TYPES, block_domains=BLOCKED_DOMAINS,
+                 viewport=(1280, 800), js_flags=None):
+        self.headless = headless
+        self.cache_dir = cache_dir
+        self.cache_size_mb = cache_size_mb
+        self.block = block
+        self.block_types = tuple(block_types)
+        self.block_domains = tuple(block_domains)
+        self.viewport = viewport
+        self.js_flags = js_flags
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Настройки из BROWSER_* переменных окружения"""
+        width, height = os.getenv('BROWSER_VIEWPORT', '1280x800').lower().split('x')
+        settings = {
+            'headless': os.getenv('PLAYWRIGHT_HEADLESS', 'true').lower() == 'true',
+            'cache_dir': os.getenv('BROWSER_CACHE_DIR') or None,
+            'cache_size_mb': int(os.getenv('BROWSER_CACHE_SIZE_MB', '256')),
+            'block': os.getenv('BROWSER_BLOCK_RESOURCES', 'true').lower() == 'true',
+            'block_types': [t.strip() for t in os.getenv('BROWSER_BLOCK_TYPES', ','.join(BLOCKED_RESOURCE_TYPES)).split(',') if t.strip()],
+            'viewport': (int(width), int(height)),
+            'js_flags': os.getenv('BROWSER_JS_FLAGS') or None,
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    def launch_options(self):
+        args = list(LAUNCH_ARGS)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            args.append(f'--disk-cache-dir={os.path.abspath(self.cache_dir)}')
+            args.append(f'--disk-cache-size={self.cache_size_mb * 1024 * 1024}')
+        if self.js_flags:
+            args.append(f'--js-flags={self.js_flags}')
+        return {'headless': self.headless, 'args': args}
+
+    def context_options(self):
+        width, height = self.viewport
+        return {
+            'viewport': {'width': width, 'height': height},
+            'device_scale_factor': 1,
+            'reduced_motion': 'reduce',
+            # Service worker отвечает мимо page.route и CDP-блокировки
+            'service_workers': 'block',
+        }
+
+    def blocked_url_patterns(self):
+        patterns = [f'*.{ext}*' for t in self.block_types for ext in BLOCKED_EXTENSIONS.get(t, ())]
+        patterns += [f'*{domain}*' for domain in self.block_domains]
+        return patterns
+
+    def _should_block(self, request):
+        return (request.resource_type in self.block_types
+                or any(domain in request.url for domain in self.block_domains))
+
+    def _route_blocking(self):
+        # Блокировка через перехват, когда дискового кэша нет
+        return self.block and not self.cache_dir
+
+    def _cdp_blocking(self):
+        return self.block and bool(self.cache_dir)
+
+
+class AsyncBrowserFactory(BrowserFactory):
+    """BrowserFactory для playwright.async_api"""
+
+    async def launch(self, playwright):
+        return await playwright.chromium.launch(**self.launch_options())
+
+    async def new_context(self, browser):
+        return await browser.new_context(**self.context_options())
+
+    async def new_page(self, context):
+        """Новая страница с блокировкой ресурсов; возвращает (page, PageTraffic)"""
+        page = await context.new_page()
+        traffic = PageTraffic()
+        session = await context.new_cdp_session(page)
+        session.on('Network.responseReceived', traffic.on_response)
+        session.on('Network.loadingFinished', traffic.on_finished)
+        session.on('Network.loadingFailed', traffic.on_failed)
+        await session.send('Network.enable')
+        if self._cdp_blocking():
+            await session.send('Network.setBlockedURLs', {'urls': self.blocked_url_patterns()})
+        if self._route_blocking():
+            async def handle(route):
+                if self._should_block(route.request):
+                    traffic.blocked += 1
+                    await route.abort()
+                else:
+                    # fallback, а не continue_: дальше могут стоять маршруты контекста (HAR)
+                    await route.fallback()
+            await page.route('**/*', handle)
+        return page, traffic
+
+
+class SyncBrowserFactory(BrowserFactory):
+    """BrowserFactory для playwright.sync_api"""
+
+    def launch(self, playwright):
+        return playwright.chromium.launch(**self.launch_options())
+
+    def new_context(self, browser):
+        return browser.new_context(**self.context_options())
+
+    def new_page(self, context):
+        """Новая страница с блокировкой ресурсов; возвращает (page, PageTraffic)"""
+        page = context.new_page()
+        traffic = PageTraffic()
+        session = context.new_cdp_session(page)
+        session.on('Network.responseReceived', traffic.on_response)
+        session.on('Network.loadingFinished', traffic.on_finished)
+        session.on('Network.loadingFailed', traffic.on_failed)
+        session.send('Network.enable')
+        if self._cdp_blocking():
+            session.send('Network.setBlockedURLs', {'urls': self.blocked_url_patterns()})
+        if self._route_blocking():
+            def handle(route):
+                if self._should_block(route.request):
+                    traffic.blocked += 1
+                    route.abort()
+                else:
+                    route.fallback()
+            page.route('**/*', handle)
+        return page, traffic
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import time
+
+from metrics import BROWSER_RECYCLES, BROWSER_RESTARTS, BROWSER_RSS, PAGE_HEAP
+
+MB = 1024 * 1024
+
+
+def process_tree_rss(pid=None):
+    """
+    RSS в байтах всех процессов-потомков pid (драйвер Playwright и Chromium)
+
+    Читается из /proc; вне Linux возвращает None.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    pid = pid or os.getpid()
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    children = {}
+    resident = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{entry}/statm') as f:
+                pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            # Процесс завершился между listdir и чтением
+            continue
+        # Имя процесса в скобках может содержать пробелы, ppid идет вторым после него
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        resident[int(entry)] = pages * page_size
+    total = 0
+    stack = list(children.get(pid, ()))
+    while stack:
+        child = stack.pop()
+        total += resident.get(child, 0)
+        stack.extend(children.get(child, ()))
+    return total
+
+
+class LifecyclePolicy:
+    """
+    Когда заменять страницу и браузер
+
+    Страница пересоздается после max_navigations переходов или когда куча
+    JS превышает max_heap_mb. Браузер перезапускается раз в restart_seconds,
+    при RSS процессов выше max_rss_mb или после health_failures неудачных
+    проверок подряд. Ноль отключает соответствующий порог.
+    """
+    def __init__(self, max_navigations=200, max_heap_mb=256, max_rss_mb=0, restart_seconds=3600,
+                 health_interval=30, health_timeout=10, health_failures=2, drain_seconds=60):
+        self.max_navigations = max_navigations
+        self.max_heap_mb = max_heap_mb
+        self.max_rss_mb = max_rss_mb
+        self.restart_seconds = restart_seconds
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health_failures = health_failures
+        self.drain_seconds = drain_seconds
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Настройки из BROWSER_* переменных окружения"""
+        settings = {
+            'max_navigations': int(os.getenv('BROWSER_MAX_NAVIGATIONS', '200')),
+            'max_heap_mb': float(os.getenv('BROWSER_MAX_HEAP_MB', '256')),
+            'max_rss_mb': float(os.getenv('BROWSER_MAX_RSS_MB', '0')),
+            'restart_seconds': float(os.getenv('BROWSER_RESTART_MINUTES', '60')) * 60,
+            'health_interval': float(os.getenv('BROWSER_HEALTH_INTERVAL', '30')),
+            'health_timeout': float(os.getenv('BROWSER_HEALTH_TIMEOUT', '10')),
+            'health_failures': int(os.getenv('BROWSER_HEALTH_FAILURES', '2')),
+            'drain_seconds': float(os.getenv('BROWSER_DRAIN_SECONDS', '60')),
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+
+class AsyncBrowserLifecycle:
+    """
+    Общий Chromium для опросчиков с плановой заменой
+
+    Фоновая задача раз в health_interval проверяет браузер и при
+    необходимости запускает замену заранее: новый браузер стартует и
+    прогревается, пока опросчики продолжают работать на старом, и только
+    потом становится текущим (generation увеличивается). Опросчики
+    переходят на него на границе своей итерации через AsyncPageSlot,
+    а старый браузер закрывается, когда в нем не остается контекстов,
+    или через drain_seconds.
+    """
+    def __init__(self, playwright, factory, policy=None):
+        self.playwright = playwright
+        self.factory = factory
+        self.policy = policy or LifecyclePolicy.from_env()
+        self.logger = logging.getLogger(__name__)
+        self.browser = None
+        self.generation = 0
+        self.started_at = 0
+        self._retired = []
+        self._failures = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        await self.get()
+        BROWSER_RSS.set_function(process_tree_rss)
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def get(self):
+        """Текущий браузер и его поколение; отключившийся заменяется сразу"""
+        if not self._connected(self.browser):
+            await self.rotate('start' if self.browser is None else 'disconnected', self.generation)
+        return self.browser, self.generation
+
+    def _connected(self, browser):
+        try:
+            return browser is not None and browser.is_connected()
+        except Exception:
+            return False
+
+    async def _launch_warm(self):
+        """Запуск с прогревом: процесс рендерера и сетевой сервис поднимаются до переключения"""
+        browser = await self.factory.launch(self.playwright)
+        try:
+            context = await self.factory.new_context(browser)
+            page = await context.new_page()
+            await page.goto('about:blank')
+            await context.close()
+        except Exception:
+            await browser.close()
+            raise
+        return browser
+
+    async def rotate(self, reason, generation=None):
+        """
+        Заменяет текущий браузер прогретым новым
+
+        С generation замена пропускается, если браузер уже заменили
+        с тех пор, как вызывающий его получил.
+        """
+        async with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            started = time.monotonic()
+            browser = await self._launch_warm()
+            old = self.browser
+            self.browser = browser
+            self.generation += 1
+            self.started_at = time.monotonic()
+            self._failures = 0
+            if old is not None:
+                self._retired.append((old, self.started_at + self.policy.drain_seconds))
+            BROWSER_RESTARTS.inc(kind='browser')
+            if old is not None:
+                BROWSER_RECYCLES.inc(kind='browser', reason=reason)
+            self.logger.info(
+                f"Браузер #{self.generation} запущен ({reason}) за {self.started_at - started:.1f} с"
+            )
+
+    async def _healthy(self):
+        """Проверка браузера одним запросом по CDP с таймаутом"""
+        async def probe():
+            session = await self.browser.new_browser_cdp_session()
+            try:
+                await session.send('Browser.getVersion')
+            finally:
+                await session.detach()
+        try:
+            await asyncio.wait_for(probe(), self.policy.health_timeout)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"Проверка браузера #{self.generation} не прошла: {e}")
+            return False
+
+    async def _rotation_reason(self):
+        policy = self.policy
+        if not self._connected(self.browser):
+            return 'disconnected'
+        if policy.restart_seconds and time.monotonic() - self.started_at >= policy.restart_seconds:
+            return 'schedule'
+        if await self._healthy():
+            self._failures = 0
+        else:
+            self._failures += 1
+            if self._failures >= policy.health_failures:
+                return 'health'
+        # Пока старый браузер дорабатывает, RSS включает и его
+        if policy.max_rss_mb and not self._retired:
+            rss = await asyncio.to_thread(process_tree_rss)
+            if rss is not None and rss > policy.max_rss_mb * MB:
+                return 'rss'
+        return None
+
+    async def _close_retired(self, force=False):
+        now = time.monotonic()
+        keep = []
+        for browser, deadline in self._retired:
+            try:
+                drained = not browser.is_connected() or not browser.contexts
+            except Exception:
+                drained = True
+            if force or drained or now >= deadline:
+                try:
+                    await browser.close()
+                except Exception as e:
+                    self.logger.debug(f"Ошибка при закрытии старого браузера: {e}")
+            else:
+                keep.append((browser, deadline))
+        self._retired = keep
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.policy.health_interval)
+            try:
+                reason = await self._rotation_reason()
+                if reason:
+                    await self.rotate(reason, self.generation)
+                await self._close_retired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Ошибка обслуживания браузера: {e}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._close_retired(force=True)
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+
+
+class AsyncPageSlot:
+    """
+    Контекст и страница одного опросчика со счетчиком переходов
+
+    recycle_reason() перед итерацией говорит, пора ли заменить страницу:
+    браузер сменил поколение, набралось max_navigations переходов или
+    куча JS (Performance.getMetrics) выросла выше max_heap_mb.
+    """
+    def __init__(self, lifecycle, name):
+        self.lifecycle = lifecycle
+        self.name = name
+        self.context = None
+        self.page = None
+        self.traffic = None
+        self.generation = None
+        self.navigations = 0
+        self._session = None
+
+    def is_open(self):
+        return self.page is not None and not self.page.is_closed()
+
+    async def open(self, setup=None):
+        """Новые контекст и страница в текущем браузере; setup(context) - до создания страницы"""
+        factory = self.lifecycle.factory
+        browser, self.generation = await self.lifecycle.get()
+        self.context = await factory.new_context(browser)
+        if setup:
+            await setup(self.context)
+        self.page, self.traffic = await factory.new_page(self.context)
+        self._session = await self.context.new_cdp_session(self.page)
+        await self._session.send('Performance.enable')
+        self.navigations = 0
+        BROWSER_RESTARTS.inc(kind='page')
+        return self.page
+
+    def navigated(self, count=1):
+        self.navigations += count
+
+    async def heap_bytes(self):
+        result = await self._session.send('Performance.getMetrics')
+        metrics = {metric['name']: metric['value'] for metric in result['metrics']}
+        heap = metrics.get('JSHeapUsedSize', 0)
+        PAGE_HEAP.set(heap, source=self.name)
+        return heap
+
+    async def recycle_reason(self):
+        policy = self.lifecycle.policy
+        if self.generation != self.lifecycle.generation:
+            return 'browser'
+        if policy.max_navigations and self.navigations >= policy.max_navigations:
+            return 'navigations'
+        if policy.max_heap_mb:
+            try:
+                if await self.heap_bytes() > policy.max_heap_mb * MB:
+                    return 'heap'
+            except Exception as e:
+                self.lifecycle.logger.warning(f"[{self.name}] Не удалось получить метрики страницы: {e}")
+                return 'metrics'
+        return None
+
+    async def close(self, reason=None):
+        """Закрывает контекст вместе со страницей; ошибки закрытия не важны"""
+        if reason:
+            BROWSER_RECYCLES.inc(kind='page', reason=reason)
+        try:
+            if self.context:
+                await self.context.close()
+        except Exception:
+            pass
+        self.context = self.page = self.traffic = self._session = None
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+
+
+class CheckpointStore:
+    """
+    Чекпоинты обхода тегов в JSONL-файле
+
+    Каждое изменение дописывается строкой {tag, status, last_page,
+    addresses, updated_at} и сбрасывается на диск через fsync, при загрузке
+    побеждает последняя строка по тегу. Статусы: in_progress, done.
+    Тег со статусом done моложе freshness_hours считается свежим.
+    """
+    def __init__(self, path, freshness_hours=24):
+        self.path = path
+        self.freshness = timedelta(hours=freshness_hours)
+        self.logger = logging.getLogger(__name__)
+        self.checkpoints = {}
+        self._load()
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя строка после падения
+                        self.logger.warning(f"Пропущена битая строка чекпоинта: {line[:80]!r}")
+                        continue
+                    self.checkpoints[entry['tag']] = entry
+        except FileNotFoundError:
+            return
+        self.logger.info(f"Загружено чекпоинтов: {len(self.checkpoints)} из {self.path}")
+        # Журнал растет на строку за страницу, периодически сжимаем его
+        if lines > 2 * len(self.checkpoints) + 100:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.checkpoints.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _write(self, tag, status, last_page, addresses):
+        entry = {
+            'tag': tag,
+            'status': status,
+            'last_page': last_page,
+            'addresses': addresses,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        self.checkpoints[tag] = entry
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get(self, tag):
+        return self.checkpoints.get(tag)
+
+    def is_fresh(self, tag):
+        """Тег полностью обойден в пределах окна свежести"""
+        entry = self.checkpoints.get(tag)
+        if not entry or entry['status'] != 'done':
+            return False
+        updated_at = datetime.fromisoformat(entry['updated_at'])
+        return datetime.now(timezone.utc) - updated_at < self.freshness
+
+    def resume_page(self, tag):
+        """Первая необработанная страница тега"""
+        entry = self.checkpoints.get(tag)
+        if not entry or entry['status'] != 'in_progress':
+            return 1
+        return entry['last_page'] + 1
+
+    def resume_addresses(self, tag):
+        entry = self.checkpoints.get(tag)
+        if not entry or entry['status'] != 'in_progress':
+            return 0
+        return entry['addresses']
+
+    def page_done(self, tag, page, addresses):
+        self._write(tag, 'in_progress', page, addresses)
+
+    def finish(self, tag, page, addresses):
+        self._write(tag, 'done', page, addresses)
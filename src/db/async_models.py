@@ -0,0 +1,233 @@
+import asyncio
+import asyncpg
+import logging
+import time
+from db.migrations import run_migrations
+from db.models import LINK_ONLY_SOURCES, SCHEMA, TAGS_CHANNEL, normalize_address, normalize_records, unified_row
+
+
+def connect_kwargs(config):
+    """Конфиг psycopg2 (dbname, user, ...) в аргументы asyncpg"""
+    return {
+        'database': config.get('dbname'),
+        'user': config.get('user'),
+        'password': config.get('password'),
+        'host': config.get('host'),
+        'port': int(config['port']) if config.get('port') else None
+    }
+
+
+class AsyncDatabase:
+    """Пул соединений asyncpg; та же схема, что у Database"""
+    def __init__(self, config, min_size=1, max_size=10):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            min_size=self.min_size,
+            max_size=self.max_size,
+            **connect_kwargs(self.config)
+        )
+        return self
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def init_tables(self):
+        """Инициализация таблиц при первом запуске"""
+        # Схема и миграции общие с синхронным слоем и выполняются через psycopg2
+        # под одной advisory-блокировкой, см. MigrationRunner
+        await asyncio.to_thread(run_migrations, self.config, SCHEMA)
+        logging.info("Таблицы инициализированы успешно")
+
+
+class AsyncTagCache:
+    """
+    TagCache для asyncpg: tag_oklink -> (id, tag_unified)
+
+    Перечитывается по истечении ttl секунд или по NOTIFY из канала
+    TAGS_CHANNEL, который asyncpg доставляет в callback без опроса.
+    """
+    def __init__(self, db, ttl=300):
+        self.db = db
+        self.ttl = ttl
+        self._tags = {}
+        self._loaded_at = None
+        self._listen_conn = None
+
+    async def listen(self):
+        """Подписывается на изменения tags через отдельное соединение"""
+        self._listen_conn = await asyncpg.connect(**connect_kwargs(self.db.config))
+        await self._listen_conn.add_listener(TAGS_CHANNEL, self._on_notify)
+        logging.info(f"AsyncTagCache подписан на канал {TAGS_CHANNEL}")
+
+    async def close(self):
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.invalidate()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def _load(self, conn):
+        rows = await conn.fetch("SELECT tag_oklink, id, tag_unified FROM tags")
+        self._tags = {row['tag_oklink']: (row['id'], row['tag_unified']) for row in rows}
+        self._loaded_at = time.monotonic()
+        logging.debug(f"AsyncTagCache загружен: {len(self._tags)} тегов")
+
+    async def resolve(self, conn, tag_names):
+        """
+        Возвращает dict tag_oklink -> (id, tag_unified) для tag_names
+
+        Отсутствующие теги вставляются через conn, то есть в транзакции
+        вызывающего. При ее откате нужно вызвать invalidate().
+        """
+        if self._is_stale():
+            await self._load(conn)
+        missing = sorted({tag for tag in tag_names if tag not in self._tags})
+        if missing:
+            await conn.execute("""
+                INSERT INTO tags (tag_oklink)
+                SELECT unnest($1::varchar[])
+                ON CONFLICT (tag_oklink) DO NOTHING
+            """, missing)
+            rows = await conn.fetch("""
+                SELECT tag_oklink, id, tag_unified
+                FROM tags
+                WHERE tag_oklink = ANY($1::varchar[])
+            """, missing)
+            for row in rows:
+                self._tags[row['tag_oklink']] = (row['id'], row['tag_unified'])
+        return {tag: self._tags[tag] for tag in tag_names}
+
+    async def get_unified(self, oklink_tag):
+        """Возвращает tag_unified из кэша, None если тега нет"""
+        if self._is_stale():
+            async with self.db.pool.acquire() as conn:
+                await self._load(conn)
+        entry = self._tags.get(oklink_tag)
+        return entry[1] if entry and entry[1] else None
+
+
+class AsyncAddressRepository:
+    """AddressRepository для asyncpg: те же таблицы и та же семантика upsert"""
+    def __init__(self, db, tag_cache=None):
+        self.db = db
+        self.tag_cache = tag_cache or AsyncTagCache(db)
+
+    async def get_unified_type(self, oklink_tag):
+        return await self.tag_cache.get_unified(oklink_tag)
+
+    async def get_known_addresses(self, tag_names=None):
+        """Известные адреса по тегам: dict tag_oklink -> set(address)"""
+        query = """
+            SELECT t.tag_oklink, a.address
+            FROM address_tags at
+            JOIN tags t ON t.id = at.tag_id
+            JOIN addresses a ON a.id = at.address_id
+        """
+        args = []
+        if tag_names is not None:
+            query += " WHERE t.tag_oklink = ANY($1::varchar[])"
+            args.append(list(tag_names))
+        known = {}
+        async with self.db.pool.acquire() as conn:
+            for row in await conn.fetch(query, *args):
+                known.setdefault(row['tag_oklink'], set()).add(row['address'])
+        logging.info(f"Загружены известные адреса: {sum(len(a) for a in known.values())} по {len(known)} тегам")
+        return known
+
+    async def save_addresses_bulk(self, items, source='oklink-txs'):
+        """
+        Сохраняет пачку адресов одной транзакцией
+
+        Семантика та же, что у AddressRepository.save_addresses_bulk;
+        многострочные вставки передаются массивами через unnest.
+        Возвращает количество сохраненных адресов.
+        """
+        records = normalize_records(items)
+        if not records:
+            return 0
+
+        # Сортировка фиксирует порядок блокировок строк между процессами
+        keys = sorted(records)
+
+        async with self.db.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    rows = await conn.fetch("""
+                        INSERT INTO addresses (chain, address, name, icon_sha256)
+                        SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::char(64)[])
+                        ON CONFLICT (chain, address)
+                        DO UPDATE SET
+                            name = EXCLUDED.name,
+                            icon_sha256 = COALESCE(EXCLUDED.icon_sha256, addresses.icon_sha256)
+                        RETURNING chain, address, id
+                    """,
+                        [chain for chain, _ in keys],
+                        [address for _, address in keys],
+                        [records[key]['name'] for key in keys],
+                        [records[key].get('icon_sha256') for key in keys]
+                    )
+                    address_ids = {(row['chain'], row['address']): row['id'] for row in rows}
+
+                    tags = await self.tag_cache.resolve(
+                        conn, {records[key]['tag'] for key in keys if 'tag' in records[key]}
+                    )
+
+                    link_addresses, link_tags = [], []
+                    unified = []
+                    for chain, address in keys:
+                        address_data = records[(chain, address)]
+                        if 'tag' not in address_data:
+                            continue
+                        tag_id, unified_type = tags[address_data['tag']]
+                        link_addresses.append(address_ids[(chain, address)])
+                        link_tags.append(tag_id)
+                        if source in LINK_ONLY_SOURCES:
+                            continue
+                        if unified_type and normalize_address(address_data['name']) != address:
+                            unified.append((chain, address, *unified_row(address_data, unified_type)))
+
+                    if link_addresses:
+                        await conn.execute("""
+                            INSERT INTO address_tags (address_id, tag_id)
+                            SELECT * FROM unnest($1::int[], $2::int[])
+                            ON CONFLICT (address_id, tag_id) DO NOTHING
+                        """, link_addresses, link_tags)
+
+                    if unified:
+                        await conn.execute("""
+                            INSERT INTO unified_addresses (chain, address, type, address_name, labels, source)
+                            SELECT chain, address, type, address_name, '{}'::json, $5
+                            FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[])
+                                AS v(chain, address, type, address_name)
+                            ON CONFLICT (chain, address)
+                            DO UPDATE SET
+                                type = EXCLUDED.type,
+                                address_name = EXCLUDED.address_name,
+                                labels = EXCLUDED.labels,
+                                source = EXCLUDED.source
+                        """, *(list(column) for column in zip(*unified)), source)
+
+                logging.info(
+                    f"Пачка сохранена: адресов {len(keys)}, "
+                    f"связей с тегами {len(link_addresses)}, в unified_addresses {len(unified)}"
+                )
+                return len(keys)
+
+            except Exception as e:
+                self.tag_cache.invalidate()
+                logging.error(f"Ошибка при пакетном сохранении {len(keys)} адресов: {str(e)}")
+                raise
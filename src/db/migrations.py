@@ -0,0 +1,256 @@
+import logging
+import os
+import time
+import psycopg2
+from psycopg2 import errors
+
+# Ключ pg_advisory_lock: миграции выполняет только один процесс за раз
+MIGRATIONS_LOCK_ID = 7300116
+
+# EVM-адрес в том же виде, что и normalize_address в db.models
+EVM_ADDRESS_SQL = "'^0x[0-9a-fA-F]{40}$'"
+
+
+def create_index(name, table, columns, unique=False):
+    """
+    Шаг миграции: CREATE INDEX CONCURRENTLY без блокировки записи
+
+    Прерванный CONCURRENTLY оставляет невалидный индекс, который
+    IF NOT EXISTS молча пропустил бы, поэтому такой индекс пересоздается.
+    По той же причине при занятой таблице повторяется весь шаг, а не
+    только CREATE INDEX.
+    """
+    def build(cur):
+        cur.execute("""
+            SELECT i.indisvalid
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = %s
+        """, (name,))
+        row = cur.fetchone()
+        if row and row[0]:
+            return
+        if row:
+            logging.warning(f"Индекс {name} невалиден после прерванной попытки, пересоздаем")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {table} ({columns})")
+
+    def step(runner, cur):
+        runner.retry(lambda: build(cur), f"CREATE INDEX {name}")
+    return step
+
+
+def add_unique_constraint(table, name):
+    """Шаг миграции: UNIQUE-ограничение поверх готового индекса (короткая блокировка)"""
+    def step(runner, cur):
+        cur.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (name,))
+        if cur.fetchone():
+            return
+        runner.execute(cur, f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+    return step
+
+
+def merge_case_duplicates(runner, cur):
+    """
+    Схлопывает адреса, различающиеся только регистром, перед приведением к lower
+
+    До 0003 адрес уникален без учета сети, поэтому группируем только по
+    lower(address). Остается строка, уже записанная в нижнем регистре,
+    иначе самая новая; связи с тегами переносятся на нее.
+    """
+    cur.execute(f"""
+        SELECT array_agg(id ORDER BY (address = lower(address)) DESC, id DESC)
+        FROM addresses
+        WHERE address ~ {EVM_ADDRESS_SQL}
+        GROUP BY lower(address)
+        HAVING count(*) > 1
+    """)
+    groups = [row[0] for row in cur.fetchall()]
+    for ids in groups:
+        keep, duplicates = ids[0], ids[1:]
+        cur.execute("BEGIN")
+        cur.execute("""
+            INSERT INTO address_tags (address_id, tag_id)
+            SELECT %s, tag_id FROM address_tags WHERE address_id = ANY(%s)
+            ON CONFLICT (address_id, tag_id) DO NOTHING
+        """, (keep, duplicates))
+        cur.execute("DELETE FROM address_tags WHERE address_id = ANY(%s)", (duplicates,))
+        cur.execute("DELETE FROM addresses WHERE id = ANY(%s)", (duplicates,))
+        cur.execute("COMMIT")
+
+    cur.execute(f"""
+        SELECT array_agg(id ORDER BY (address = lower(address)) DESC, id DESC)
+        FROM unified_addresses
+        WHERE address ~ {EVM_ADDRESS_SQL}
+        GROUP BY lower(address)
+        HAVING count(*) > 1
+    """)
+    unified_groups = [row[0] for row in cur.fetchall()]
+    for ids in unified_groups:
+        cur.execute("DELETE FROM unified_addresses WHERE id = ANY(%s)", (ids[1:],))
+    logging.info(f"Схлопнуто дубликатов по регистру: addresses {len(groups)}, unified_addresses {len(unified_groups)}")
+
+
+def lowercase_addresses(runner, cur):
+    """Приводит EVM-адреса к нижнему регистру пачками, каждая в своей транзакции"""
+    for table in ('addresses', 'unified_addresses'):
+        total = 0
+        while True:
+            cur.execute(f"""
+                UPDATE {table} SET address = lower(address)
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE address ~ {EVM_ADDRESS_SQL} AND address <> lower(address)
+                    LIMIT %s
+                )
+            """, (runner.batch_size,))
+            total += cur.rowcount
+            if cur.rowcount < runner.batch_size:
+                break
+        logging.info(f"{table}: приведено к нижнему регистру адресов {total}")
+
+
+def backfill_unified_chain(runner, cur):
+    """
+    Переносит сеть в unified_addresses из addresses пачками по id
+
+    Колонка добавляется со значением 'ethereum', а до 0003 адрес уникален
+    без учета сети, поэтому сеть берется из строки addresses с тем же
+    адресом (при нескольких - из самой ранней).
+    """
+    cur.execute("SELECT coalesce(max(id), 0) FROM unified_addresses")
+    last_id = cur.fetchone()[0]
+    total = 0
+    for start in range(0, last_id, runner.batch_size):
+        cur.execute("""
+            UPDATE unified_addresses u SET chain = a.chain
+            FROM (
+                SELECT DISTINCT ON (address) address, chain
+                FROM addresses
+                WHERE address IN (SELECT address FROM unified_addresses WHERE id > %s AND id <= %s)
+                ORDER BY address, id
+            ) a
+            WHERE u.id > %s AND u.id <= %s AND u.address = a.address AND u.chain <> a.chain
+        """, (start, start + runner.batch_size, start, start + runner.batch_size))
+        total += cur.rowcount
+    logging.info(f"unified_addresses: сеть перенесена из addresses для {total} строк")
+
+
+# Миграции применяются по порядку поверх базовой схемы db.models.SCHEMA;
+# каждый шаг идемпотентен, так как миграция могла прерваться на середине
+MIGRATIONS = [
+    ('0001_lookup_indexes', [
+        create_index('address_tags_tag_id_idx', 'address_tags', 'tag_id'),
+        create_index('unified_addresses_type_idx', 'unified_addresses', 'type'),
+        create_index('addresses_created_at_idx', 'addresses', 'created_at'),
+        create_index('unified_addresses_created_at_idx', 'unified_addresses', 'created_at'),
+    ]),
+    ('0002_normalize_addresses', [
+        merge_case_duplicates,
+        lowercase_addresses,
+    ]),
+    ('0003_chain_address_key', [
+        # Значение по умолчанию без перезаписи таблицы (PostgreSQL 11+)
+        "ALTER TABLE unified_addresses ADD COLUMN IF NOT EXISTS chain VARCHAR(50) NOT NULL DEFAULT 'ethereum'",
+        # Пока адрес в addresses уникален и проиндексирован сам по себе
+        backfill_unified_chain,
+        # Один и тот же адрес в разных сетях - разные строки
+        create_index('addresses_chain_address_key', 'addresses', 'chain, address', unique=True),
+        add_unique_constraint('addresses', 'addresses_chain_address_key'),
+        "ALTER TABLE addresses DROP CONSTRAINT IF EXISTS addresses_address_key",
+        create_index('unified_addresses_chain_address_key', 'unified_addresses', 'chain, address', unique=True),
+        add_unique_constraint('unified_addresses', 'unified_addresses_chain_address_key'),
+        "ALTER TABLE unified_addresses DROP CONSTRAINT IF EXISTS unified_addresses_unique_address",
+    ]),
+    ('0004_address_tags_created_at', [
+        # Водяной знак инкрементального обновления LabelIndex
+        create_index('address_tags_created_at_idx', 'address_tags', 'created_at'),
+    ]),
+]
+
+
+class MigrationRunner:
+    """
+    Применяет MIGRATIONS, которых еще нет в schema_migrations
+
+    Работает в autocommit-соединении: индексы строятся CONCURRENTLY,
+    данные меняются пачками по batch_size строк, а DDL с блокировкой
+    таблицы ждет не дольше lock_timeout и повторяется до attempts раз,
+    чтобы не выстраивать очередь из запросов парсеров.
+
+    schema (db.models.SCHEMA) применяется одной транзакцией под той же
+    advisory-блокировкой: воркеры супервизора стартуют одновременно, и
+    параллельные CREATE TABLE IF NOT EXISTS / CREATE TRIGGER конфликтуют.
+    """
+    def __init__(self, config, lock_timeout='5s', batch_size=5000, attempts=5, schema=None):
+        self.config = config
+        self.schema = schema or []
+        self.lock_timeout = lock_timeout
+        self.batch_size = batch_size
+        self.attempts = attempts
+
+    def retry(self, action, description):
+        """Повторяет action(), пока таблица занята дольше lock_timeout"""
+        for attempt in range(self.attempts):
+            try:
+                return action()
+            except errors.LockNotAvailable:
+                if attempt + 1 == self.attempts:
+                    raise
+                delay = 2 ** attempt
+                logging.warning(f"Таблица занята, повтор через {delay} с: {description[:80]}")
+                time.sleep(delay)
+
+    def execute(self, cur, statement):
+        self.retry(lambda: cur.execute(statement), statement.strip())
+
+    def run(self):
+        conn = psycopg2.connect(**self.config)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+                if self.schema:
+                    cur.execute("BEGIN")
+                    for statement in self.schema:
+                        cur.execute(statement)
+                    cur.execute("COMMIT")
+                cur.execute(f"SET lock_timeout = '{self.lock_timeout}'")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        id VARCHAR(100) PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("SELECT id FROM schema_migrations")
+                applied = {row[0] for row in cur.fetchall()}
+                for migration_id, steps in MIGRATIONS:
+                    if migration_id in applied:
+                        continue
+                    logging.info(f"Применяем миграцию {migration_id}")
+                    started = time.monotonic()
+                    for step in steps:
+                        if callable(step):
+                            step(self, cur)
+                        else:
+                            self.execute(cur, step)
+                    cur.execute("INSERT INTO schema_migrations (id) VALUES (%s)", (migration_id,))
+                    logging.info(f"Миграция {migration_id} применена за {time.monotonic() - started:.1f} с")
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        finally:
+            conn.close()
+
+
+def run_migrations(config, schema=None):
+    MigrationRunner(config, schema=schema).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_migrations({
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    })
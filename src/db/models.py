@@ -1,12 +1,156 @@
 from datetime import datetime
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 from contextlib import contextmanager
 import logging
 import json
+import re
+import time
+from db.migrations import run_migrations
+
+# Канал LISTEN/NOTIFY, в который пишет триггер на таблице tags
+TAGS_CHANNEL = 'tags_changed'
+
+# EVM-адрес в любом регистре; Tron (base58) регистрозависим и не меняется
+EVM_ADDRESS_RE = re.compile(r'^0x[0-9a-fA-F]{40}$')
+
+def normalize_address(address):
+    """Ключ адреса в БД: EVM-адреса в нижнем регистре, остальные как есть"""
+    address = address.strip()
+    if EVM_ADDRESS_RE.match(address):
+        return address.lower()
+    return address
+
+def normalize_chain(chain):
+    return (chain or 'ethereum').strip().lower()
+
+# Ширина VARCHAR-колонок, в которые пишет save_addresses_bulk: одно
+# слишком длинное значение откатило бы всю пачку
+ADDRESS_WIDTH = 42          # addresses.address
+CHAIN_WIDTH = 50            # addresses.chain, unified_addresses.chain
+NAME_WIDTH = 255            # addresses.name
+TAG_WIDTH = 255             # tags.tag_oklink
+UNIFIED_NAME_WIDTH = 50     # unified_addresses.address_name
+UNIFIED_TYPE_WIDTH = 20     # unified_addresses.type
+
+# Источники, чьи теги только связываются с адресами: теги Ethplorer лежат в
+# той же tags.tag_oklink, и с tag_unified имена токенов перезаписали бы
+# строки unified_addresses, собранные с OKLink
+LINK_ONLY_SOURCES = frozenset({'ethplorer-tags'})
+
+def truncate(value, width):
+    return value[:width] if isinstance(value, str) else value
+
+def normalize_records(items):
+    """
+    Записи пачки по ключу (chain, address) после нормализации
+
+    Дубликаты внутри пачки схлопываются: ON CONFLICT DO UPDATE не может
+    изменить одну и ту же строку дважды в рамках одного запроса.
+    Имя обрезается по ширине колонки, записи с адресом или сетью длиннее
+    колонки пропускаются с предупреждением. Тег не обрезается: два разных
+    длинных тега слились бы в одну строку tags, поэтому на слишком длинном
+    теге поднимается ValueError, и WriteBehindQueue отправляет запись в карантин.
+    """
+    records = {}
+    for item in items:
+        chain = normalize_chain(item.get('chain'))
+        address = normalize_address(item['address'])
+        if not address or len(address) > ADDRESS_WIDTH or len(chain) > CHAIN_WIDTH:
+            logging.warning(f"Пропущена запись с некорректным адресом или сетью: {chain} {address[:80]!r}")
+            continue
+        if isinstance(item.get('tag'), str) and len(item['tag']) > TAG_WIDTH:
+            raise ValueError(f"Тег длиннее {TAG_WIDTH} символов у адреса {address}: {item['tag'][:80]!r}...")
+        records[(chain, address)] = dict(item, name=truncate(item['name'], NAME_WIDTH))
+    return records
+
+def unified_row(address_data, unified_type):
+    """(type, address_name) для unified_addresses, обрезанные по ширине колонок"""
+    return truncate(unified_type, UNIFIED_TYPE_WIDTH), truncate(address_data['name'], UNIFIED_NAME_WIDTH)
+
+# Базовая схема БД; общая для Database.init_tables и AsyncDatabase.init_tables,
+# дальнейшие изменения идут миграциями (db.migrations)
+SCHEMA = [
+    # Таблица тегов
+    """
+    CREATE TABLE IF NOT EXISTS tags (
+        id SERIAL PRIMARY KEY,
+        tag_oklink VARCHAR(255) UNIQUE NOT NULL,
+        tag_unified VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Таблица адресов
+    """
+    CREATE TABLE IF NOT EXISTS addresses (
+        id SERIAL PRIMARY KEY,
+        address VARCHAR(42) UNIQUE NOT NULL,
+        name VARCHAR(255),
+        chain VARCHAR(50) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Таблица связи адресов и тегов
+    """
+    CREATE TABLE IF NOT EXISTS address_tags (
+        address_id INTEGER REFERENCES addresses(id),
+        tag_id INTEGER REFERENCES tags(id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (address_id, tag_id)
+    )
+    """,
+    # Таблица унифицированных адресов
+    """
+    CREATE TABLE IF NOT EXISTS unified_addresses (
+        address VARCHAR(50) NOT NULL,
+        type VARCHAR(20) NOT NULL,
+        address_name VARCHAR(50),
+        labels JSON,
+        source VARCHAR(50),
+        created_at TIMESTAMP DEFAULT timezone('utc'::text, now()) NOT NULL,
+        id SERIAL PRIMARY KEY,
+        CONSTRAINT unified_addresses_unique_address UNIQUE (address)
+    )
+    """,
+    # Иконки хранятся один раз по SHA-256 содержимого
+    """
+    CREATE TABLE IF NOT EXISTS icons (
+        sha256 CHAR(64) PRIMARY KEY,
+        data BYTEA NOT NULL,
+        content_type VARCHAR(100),
+        size INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS icon_urls (
+        url TEXT PRIMARY KEY,
+        sha256 CHAR(64) NOT NULL REFERENCES icons(sha256),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "ALTER TABLE addresses ADD COLUMN IF NOT EXISTS icon_sha256 CHAR(64)",
+    # Оповещаем TagCache об изменениях тегов оператором
+    f"""
+    CREATE OR REPLACE FUNCTION notify_tags_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{TAGS_CHANNEL}', COALESCE(NEW.tag_oklink, OLD.tag_oklink));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tags_changed_notify ON tags",
+    """
+    CREATE TRIGGER tags_changed_notify
+    AFTER UPDATE OR DELETE ON tags
+    FOR EACH ROW EXECUTE PROCEDURE notify_tags_changed()
+    """,
+]
 
 class Database:
     def __init__(self, config):
+        self.config = config
         self.pool = psycopg2.pool.SimpleConnectionPool(
             minconn=1,
             maxconn=10,
@@ -23,59 +167,109 @@ class Database:
 
     def init_tables(self):
         """Инициализация таблиц при первом запуске"""
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                # Создаем таблицу тегов
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS tags (
-                        id SERIAL PRIMARY KEY,
-                        tag_oklink VARCHAR(255) UNIQUE NOT NULL,
-                        tag_unified VARCHAR(255),
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Создаем таблицу адресов
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS addresses (
-                        id SERIAL PRIMARY KEY,
-                        address VARCHAR(42) UNIQUE NOT NULL,
-                        name VARCHAR(255),
-                        chain VARCHAR(50) NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Создаем таблицу связи адресов и тегов
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS address_tags (
-                        address_id INTEGER REFERENCES addresses(id),
-                        tag_id INTEGER REFERENCES tags(id),
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        PRIMARY KEY (address_id, tag_id)
-                    )
-                """)
-                
-                # Создаем таблицу унифицированных адресов
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS unified_addresses (
-                        address VARCHAR(50) NOT NULL,
-                        type VARCHAR(20) NOT NULL,
-                        address_name VARCHAR(50),
-                        labels JSON,
-                        source VARCHAR(50),
-                        created_at TIMESTAMP DEFAULT timezone('utc'::text, now()) NOT NULL,
-                        id SERIAL PRIMARY KEY,
-                        CONSTRAINT unified_addresses_unique_address UNIQUE (address)
-                    )
-                """)
-                
-                conn.commit()
-                logging.info("Таблицы инициализированы успешно")
+        # Схема и миграции под одной advisory-блокировкой, см. MigrationRunner
+        run_migrations(self.config, SCHEMA)
+        logging.info("Таблицы инициализированы успешно")
+
+class ThreadedDatabase(Database):
+    """Database с потокобезопасным пулом для парсеров с фоновыми потоками"""
+    def __init__(self, config, maxconn=10):
+        self.config = config
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=1,
+            maxconn=maxconn,
+            **config
+        )
+
+class TagCache:
+    """
+    Кэш таблицы tags в памяти процесса: tag_oklink -> (id, tag_unified)
+
+    Таблица загружается целиком один раз и перечитывается по истечении ttl
+    секунд или по NOTIFY из канала TAGS_CHANNEL (см. listen).
+    Новые теги вставляются лениво при первом обращении.
+    """
+    def __init__(self, db, ttl=300):
+        self.db = db
+        self.ttl = ttl
+        self._tags = {}
+        self._loaded_at = None
+        self._listen_conn = None
+
+    def listen(self):
+        """Подписывается на изменения tags через отдельное autocommit-соединение"""
+        conn = psycopg2.connect(**self.db.config)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {TAGS_CHANNEL}")
+        self._listen_conn = conn
+        logging.info(f"TagCache подписан на канал {TAGS_CHANNEL}")
+
+    def invalidate(self):
+        """Помечает кэш устаревшим, следующий запрос перечитает таблицу"""
+        self._loaded_at = None
+
+    def _is_stale(self):
+        if self._loaded_at is None:
+            return True
+        if self._listen_conn is not None:
+            try:
+                self._listen_conn.poll()
+            except psycopg2.Error as e:
+                # Без LISTEN продолжаем жить на одном TTL
+                logging.warning(f"TagCache потерял LISTEN-соединение: {e}")
+                self._listen_conn = None
+            else:
+                if self._listen_conn.notifies:
+                    self._listen_conn.notifies.clear()
+                    return True
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def _load(self, cur):
+        cur.execute("SELECT tag_oklink, id, tag_unified FROM tags")
+        self._tags = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        self._loaded_at = time.monotonic()
+        logging.debug(f"TagCache загружен: {len(self._tags)} тегов")
+
+    def resolve(self, cur, tag_names):
+        """
+        Возвращает dict tag_oklink -> (id, tag_unified) для tag_names
+
+        Отсутствующие теги вставляются через cur, то есть в транзакции
+        вызывающего. При ее откате нужно вызвать invalidate().
+        """
+        if self._is_stale():
+            self._load(cur)
+        missing = sorted({tag for tag in tag_names if tag not in self._tags})
+        if missing:
+            execute_values(cur, """
+                INSERT INTO tags (tag_oklink)
+                VALUES %s
+                ON CONFLICT (tag_oklink) DO NOTHING
+            """, [(tag,) for tag in missing], page_size=len(missing))
+            cur.execute("""
+                SELECT tag_oklink, id, tag_unified
+                FROM tags
+                WHERE tag_oklink = ANY(%s)
+            """, (missing,))
+            for row in cur.fetchall():
+                self._tags[row[0]] = (row[1], row[2])
+        return {tag: self._tags[tag] for tag in tag_names}
+
+    def get_unified(self, oklink_tag):
+        """Возвращает tag_unified из кэша, None если тега нет"""
+        if self._is_stale():
+            with self.db.get_connection() as conn:
+                with conn.cursor() as cur:
+                    self._load(cur)
+                conn.rollback()
+        entry = self._tags.get(oklink_tag)
+        return entry[1] if entry and entry[1] else None
 
 class AddressRepository:
-    def __init__(self, db):
+    def __init__(self, db, tag_cache=None):
         self.db = db
+        self.tag_cache = tag_cache or TagCache(db)
 
     def save_tag(self, tag_data):
         """
@@ -102,16 +296,8 @@ class AddressRepository:
                     raise
 
     def get_unified_type(self, oklink_tag):
-        """Получает унифицированный тип из таблицы tags"""
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT tag_unified 
-                    FROM tags 
-                    WHERE tag_oklink = %s
-                """, (oklink_tag,))
-                result = cur.fetchone()
-                return result[0] if result and result[0] else None
+        """Получает унифицированный тип из таблицы tags (через TagCache)"""
+        return self.tag_cache.get_unified(oklink_tag)
 
     def save_address(self, address_data):
         """
@@ -123,51 +309,37 @@ class AddressRepository:
             - tag: str (тег из OKLink)
             - chain: str (блокчейн)
         """
+        address = normalize_address(address_data['address'])
+        chain = normalize_chain(address_data.get('chain'))
         with self.db.get_connection() as conn:
             with conn.cursor() as cur:
                 try:
                     # Логирование перед сохранением
-                    logging.info(f"Начинаем сохранение адреса: {address_data['address']}")
-                    logging.info(f"Данные для сохранения: {address_data}")
+                    logging.debug(f"Начинаем сохранение адреса: {address_data['address']}")
+                    logging.debug(f"Данные для сохранения: {address_data}")
                     
                     # Сохраняем адрес
                     cur.execute("""
                         INSERT INTO addresses (address, name, chain)
                         VALUES (%s, %s, %s)
-                        ON CONFLICT (address) 
+                        ON CONFLICT (chain, address) 
                         DO UPDATE SET 
-                            name = EXCLUDED.name,
-                            chain = EXCLUDED.chain
+                            name = EXCLUDED.name
                         RETURNING id
                     """, (
-                        address_data['address'],
+                        address,
                         address_data['name'],
-                        address_data.get('chain', 'ethereum')
+                        chain
                     ))
                     address_id = cur.fetchone()[0]
-                    logging.info(f"Адрес сохранен в таблицу addresses, id: {address_id}")
+                    logging.debug(f"Адрес сохранен в таблицу addresses, id: {address_id}")
                     
                     # Сохраняем тег, если он есть
+                    unified_type = None
                     if 'tag' in address_data:
-                        logging.info(f"Сохраняем тег: {address_data['tag']}")
-                        cur.execute("""
-                            INSERT INTO tags (tag_oklink)
-                            VALUES (%s)
-                            ON CONFLICT (tag_oklink) DO NOTHING
-                            RETURNING id
-                        """, (address_data['tag'],))
-                        result = cur.fetchone()
-                        
-                        if result:
-                            tag_id = result[0]
-                            logging.info(f"Создан новый тег с id: {tag_id}")
-                        else:
-                            # Если тег уже существует, получаем его id
-                            cur.execute("""
-                                SELECT id FROM tags WHERE tag_oklink = %s
-                            """, (address_data['tag'],))
-                            tag_id = cur.fetchone()[0]
-                            logging.info(f"Найден существующий тег с id: {tag_id}")
+                        logging.debug(f"Сохраняем тег: {address_data['tag']}")
+                        tag_id, unified_type = self.tag_cache.resolve(cur, [address_data['tag']])[address_data['tag']]
+                        logging.debug(f"Тег {address_data['tag']} имеет id: {tag_id}")
                         
                         # Связываем адрес с тегом
                         cur.execute("""
@@ -175,45 +347,224 @@ class AddressRepository:
                             VALUES (%s, %s)
                             ON CONFLICT (address_id, tag_id) DO NOTHING
                         """, (address_id, tag_id))
-                        logging.info(f"Адрес {address_id} связан с тегом {tag_id}")
+                        logging.debug(f"Адрес {address_id} связан с тегом {tag_id}")
                     
                     conn.commit()
-                    logging.info(f"Успешно сохранен адрес {address_data['address']} с тегом {address_data.get('tag')}")
+                    logging.debug(f"Успешно сохранен адрес {address_data['address']} с тегом {address_data.get('tag')}")
                     
                     # Проверяем unified_type и сохраняем в unified_addresses если есть
                     if 'tag' in address_data:
-                        logging.info(f"Проверяем unified_type для тега: {address_data['tag']}")
-                        unified_type = self.get_unified_type(address_data['tag'])
-                        logging.info(f"Получен unified_type: {unified_type}")
+                        logging.debug(f"Получен unified_type: {unified_type}")
                         
                         if unified_type:
                             # Проверяем, не совпадает ли имя с адресом
-                            if address_data['name'] == address_data['address']:
-                                logging.info(f"⏩ Пропускаем сохранение в unified_addresses - имя совпадает с адресом: {address_data['address']}")
+                            if normalize_address(address_data['name']) == address:
+                                logging.debug(f"⏩ Пропускаем сохранение в unified_addresses - имя совпадает с адресом: {address_data['address']}")
                             else:
                                 # Сохраняем в unified_addresses
                                 cur.execute("""
-                                    INSERT INTO unified_addresses (address, type, address_name, labels, source)
-                                    VALUES (%s, %s, %s, %s, %s)
-                                    ON CONFLICT (address) 
+                                    INSERT INTO unified_addresses (chain, address, type, address_name, labels, source)
+                                    VALUES (%s, %s, %s, %s, %s, %s)
+                                    ON CONFLICT (chain, address) 
                                     DO UPDATE SET 
                                         type = EXCLUDED.type,
                                         address_name = EXCLUDED.address_name,
                                         labels = EXCLUDED.labels,
                                         source = EXCLUDED.source
                                 """, (
-                                    address_data['address'],
+                                    chain,
+                                    address,
                                     unified_type,
                                     address_data['name'],
                                     '{}',  # пустой JSON
                                     'oklink-txs'
                                 ))
                                 conn.commit()
-                                logging.info(f"Успешно сохранен адрес {address_data['address']} в unified_addresses")
+                                logging.debug(f"Успешно сохранен адрес {address_data['address']} в unified_addresses")
                         else:
-                            logging.info(f"Пропуск сохранения в unified_addresses - нет tag_unified для тега {address_data['tag']}")
+                            logging.debug(f"Пропуск сохранения в unified_addresses - нет tag_unified для тега {address_data['tag']}")
                     
                 except Exception as e:
                     conn.rollback()
+                    self.tag_cache.invalidate()
                     logging.error(f"Ошибка при сохранении адреса {address_data['address']}: {str(e)}")
-                    raise 
\ No newline at end of file
+                    raise
+
+    def get_icon_urls(self):
+        """Соответствие url -> sha256 уже сохраненных иконок"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT url, sha256 FROM icon_urls")
+                result = dict(cur.fetchall())
+            conn.rollback()
+        return result
+
+    def save_icons(self, icons, urls, links):
+        """
+        Сохраняет иконки и ссылки на них одной транзакцией
+
+        icons: список (sha256, data, content_type, url) нового содержимого
+        urls: список (url, sha256) для содержимого, которое уже есть в icons
+        links: список (chain, address, sha256) для addresses.icon_sha256
+        Возвращает множество (chain, address), которые удалось связать.
+        """
+        linked = set()
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    if icons:
+                        execute_values(cur, """
+                            INSERT INTO icons (sha256, data, content_type, size)
+                            VALUES %s
+                            ON CONFLICT (sha256) DO NOTHING
+                        """, [
+                            (sha256, psycopg2.Binary(data), content_type, len(data))
+                            for sha256, data, content_type, _ in icons
+                        ], page_size=len(icons))
+                    url_rows = urls + [(url, sha256) for sha256, _, _, url in icons]
+                    if url_rows:
+                        execute_values(cur, """
+                            INSERT INTO icon_urls (url, sha256)
+                            VALUES %s
+                            ON CONFLICT (url) DO UPDATE SET sha256 = EXCLUDED.sha256
+                        """, url_rows, page_size=len(url_rows))
+                    if links:
+                        rows = execute_values(cur, """
+                            UPDATE addresses a
+                            SET icon_sha256 = v.sha256
+                            FROM (VALUES %s) AS v(chain, address, chain_key, key, sha256)
+                            WHERE a.chain = v.chain_key AND a.address = v.key
+                            RETURNING v.chain, v.address
+                        """, [
+                            (chain, address, normalize_chain(chain), normalize_address(address), sha256)
+                            for chain, address, sha256 in links
+                        ], page_size=len(links), fetch=True)
+                        linked = {(chain, address) for chain, address in rows}
+                    conn.commit()
+                    logging.debug(f"Иконок сохранено: {len(icons)}, URL: {len(url_rows)}, связей: {len(linked)}")
+                    return linked
+                except Exception as e:
+                    conn.rollback()
+                    logging.error(f"Ошибка при сохранении иконок: {str(e)}")
+                    raise
+
+    def get_known_addresses(self, tag_names=None):
+        """
+        Известные адреса по тегам одним запросом
+
+        Возвращает dict tag_oklink -> set(address); без tag_names по всем тегам.
+        """
+        query = """
+            SELECT t.tag_oklink, a.address
+            FROM address_tags at
+            JOIN tags t ON t.id = at.tag_id
+            JOIN addresses a ON a.id = at.address_id
+        """
+        params = None
+        if tag_names is not None:
+            query += " WHERE t.tag_oklink = ANY(%s)"
+            params = (list(tag_names),)
+        known = {}
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                for tag, address in cur:
+                    known.setdefault(tag, set()).add(address)
+            conn.rollback()
+        logging.info(f"Загружены известные адреса: {sum(len(a) for a in known.values())} по {len(known)} тегам")
+        return known
+
+    def save_addresses_bulk(self, items, source='oklink-txs'):
+        """
+        Сохраняет пачку адресов одной транзакцией
+
+        items: список dict с теми же полями, что и у save_address.
+        Семантика та же, но вместо O(items) запросов выполняется
+        постоянное число многострочных INSERT/UPSERT.
+        Возвращает количество сохраненных адресов.
+        """
+        records = normalize_records(items)
+        if not records:
+            return 0
+
+        # Сортировка фиксирует порядок блокировок строк между процессами
+        keys = sorted(records)
+
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    rows = execute_values(cur, """
+                        INSERT INTO addresses (chain, address, name, icon_sha256)
+                        VALUES %s
+                        ON CONFLICT (chain, address)
+                        DO UPDATE SET
+                            name = EXCLUDED.name,
+                            icon_sha256 = COALESCE(EXCLUDED.icon_sha256, addresses.icon_sha256)
+                        RETURNING chain, address, id
+                    """, [
+                        (
+                            chain,
+                            address,
+                            records[(chain, address)]['name'],
+                            records[(chain, address)].get('icon_sha256')
+                        )
+                        for chain, address in keys
+                    ], page_size=len(keys), fetch=True)
+                    address_ids = {(chain, address): address_id for chain, address, address_id in rows}
+
+                    tags = self.tag_cache.resolve(
+                        cur, {records[key]['tag'] for key in keys if 'tag' in records[key]}
+                    )
+
+                    links = []
+                    unified = []
+                    for chain, address in keys:
+                        address_data = records[(chain, address)]
+                        if 'tag' not in address_data:
+                            continue
+                        tag_id, unified_type = tags[address_data['tag']]
+                        links.append((address_ids[(chain, address)], tag_id))
+                        # Как и в save_address: без tag_unified и для имени,
+                        # совпадающего с адресом, unified_addresses не трогаем
+                        if source in LINK_ONLY_SOURCES:
+                            continue
+                        if unified_type and normalize_address(address_data['name']) != address:
+                            unified.append((
+                                chain,
+                                address,
+                                *unified_row(address_data, unified_type),
+                                '{}',  # пустой JSON
+                                source
+                            ))
+
+                    if links:
+                        execute_values(cur, """
+                            INSERT INTO address_tags (address_id, tag_id)
+                            VALUES %s
+                            ON CONFLICT (address_id, tag_id) DO NOTHING
+                        """, links, page_size=len(links))
+
+                    if unified:
+                        execute_values(cur, """
+                            INSERT INTO unified_addresses (chain, address, type, address_name, labels, source)
+                            VALUES %s
+                            ON CONFLICT (chain, address)
+                            DO UPDATE SET
+                                type = EXCLUDED.type,
+                                address_name = EXCLUDED.address_name,
+                                labels = EXCLUDED.labels,
+                                source = EXCLUDED.source
+                        """, unified, page_size=len(unified))
+
+                    conn.commit()
+                    logging.info(
+                        f"Пачка сохранена: адресов {len(keys)}, "
+                        f"связей с тегами {len(links)}, в unified_addresses {len(unified)}"
+                    )
+                    return len(keys)
+
+                except Exception as e:
+                    conn.rollback()
+                    self.tag_cache.invalidate()
+                    logging.error(f"Ошибка при пакетном сохранении {len(keys)} адресов: {str(e)}")
+                    raise
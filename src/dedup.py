@@ -0,0 +1,163 @@
+from collections import OrderedDict
+import hashlib
+import math
+from metrics import DEDUP, ROWS
+
+
+def record_digest(record):
+    """16-байтовый отпечаток записи по (chain, address, name, tag)"""
+    key = '\x1f'.join((
+        record.get('chain', 'ethereum'),
+        record['address'],
+        record.get('name') or '',
+        record.get('tag') or ''
+    ))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter:
+    """Bloom-фильтр на bytearray, работает с готовыми 16-байтовыми отпечатками"""
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Двойное хеширование: k позиций из двух половин отпечатка
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+
+
+class SeenFilter:
+    """
+    Ограниченный набор недавно сохраненных записей
+
+    LRU на OrderedDict хранит только 16-байтовые отпечатки записей.
+    Опциональный Bloom-фильтр перед ним отсекает заведомо новые записи
+    без обращения к LRU. Так как из Bloom нельзя удалять, он
+    перестраивается из LRU после capacity вытеснений.
+    """
+    def __init__(self, capacity=100_000, use_bloom=False, bloom_error_rate=0.01):
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._bloom = BloomFilter(capacity, bloom_error_rate) if use_bloom else None
+        self._evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _seen(self, digest):
+        if self._bloom is not None and digest not in self._bloom:
+            return False
+        if digest in self._lru:
+            self._lru.move_to_end(digest)
+            return True
+        return False
+
+    def filter_new(self, records):
+        """Возвращает записи, которых нет среди недавно сохраненных"""
+        new_records = []
+        for record in records:
+            if not self._seen(record_digest(record)):
+                new_records.append(record)
+        hits = len(records) - len(new_records)
+        self.hits += hits
+        self.misses += len(new_records)
+        DEDUP.inc(hits, result='hit')
+        DEDUP.inc(len(new_records), result='miss')
+        return new_records
+
+    def mark(self, records):
+        """Запоминает успешно сохраненные записи"""
+        for record in records:
+            digest = record_digest(record)
+            self._lru[digest] = None
+            self._lru.move_to_end(digest)
+            if self._bloom is not None:
+                self._bloom.add(digest)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+            self._evictions += 1
+        if self._bloom is not None and self._evictions >= self.capacity:
+            self._rebuild_bloom()
+
+    def _rebuild_bloom(self):
+        self._bloom.clear()
+        for digest in self._lru:
+            self._bloom.add(digest)
+        self._evictions = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self._lru),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate
+        }
+
+
+class RowTracker:
+    """
+    Ключи уже обработанных строк tx-list: хеш транзакции и адрес
+
+    Между опросами в таблице появляется лишь несколько строк сверху,
+    поэтому наводить и разбирать нужно только строки с новыми ключами.
+    Обработанные строки сначала откладываются через stage() и попадают
+    в LRU на capacity ключей только после commit(), когда их записи
+    уже в очереди записи; discard() после ошибки оставляет их новыми.
+    """
+    def __init__(self, capacity=10_000):
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._staged = []
+        self.head = None
+
+    def __len__(self):
+        return len(self._lru)
+
+    def new_rows(self, rows, source):
+        """Строки снимка, ключей которых еще не было; запоминает ключ первой строки"""
+        new_rows = []
+        for row in rows:
+            if row['key'] in self._lru:
+                self._lru.move_to_end(row['key'])
+            else:
+                new_rows.append(row)
+        if rows:
+            self.head = rows[0]['key']
+        ROWS.inc(len(rows) - len(new_rows), result='known', source=source)
+        ROWS.inc(len(new_rows), result='new', source=source)
+        return new_rows
+
+    def stage(self, keys):
+        self._staged.extend(keys)
+
+    def commit(self):
+        for key in self._staged:
+            self._lru[key] = None
+            self._lru.move_to_end(key)
+        self._staged = []
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def discard(self):
+        self._staged = []
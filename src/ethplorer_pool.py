@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import time
+from functools import partial
+from playwright.async_api import async_playwright
+from wait_policy import AsyncWaitPolicy
+from interception import ResponseCapture, extract_labels
+from browser_factory import AsyncBrowserFactory
+from db.models import normalize_address
+from metrics import BROWSER_RESTARTS, ITERATIONS, PAGE_SECONDS, PAGES, RECORDS, STEP_SECONDS
+
+# Первый адрес в таблице тега, по его смене определяем загрузку страницы
+ADDRESS_SELECTOR = 'tbody tr .tags-table-address .overflow-center-elips'
+NEXT_PAGE_SELECTOR = 'li.page-item:not(.disabled) a.page-link:has-text("»")'
+
+# Все строки таблицы тега за один evaluate; логика выбора тега та же,
+# что в EthplorerParser.get_tag_data: .tag_name, затем data-tag, затем href
+TAG_ROWS_SCRIPT = """
+() => Array.from(document.querySelectorAll('tbody tr')).map((row) => {
+    const addressEl = row.querySelector('.tags-table-address .overflow-center-elips');
+    const tagsContainer = row.querySelector('span.tags-list');
+    let tags = null;
+    if (tagsContainer) {
+        tags = Array.from(tagsContainer.querySelectorAll('.tag__public')).map((t) => {
+            const textEl = t.querySelector('.tag_name');
+            let text = textEl ? textEl.innerText.trim() : '';
+            if (!text) text = (t.getAttribute('data-tag') || '').trim();
+            if (!text) {
+                const href = t.getAttribute('href');
+                if (href && href.includes('/tag/')) text = href.split('/tag/').pop().split('?')[0].trim();
+            }
+            return text;
+        }).filter(Boolean);
+    }
+    const nameEl = row.querySelector('.tags-table-token a');
+    const iconEl = row.querySelector('.tags-table-token-icon');
+    return {
+        address: addressEl ? addressEl.innerText.trim() : '',
+        tags: tags,
+        name: nameEl ? nameEl.innerText.trim() : '',
+        icon_url: iconEl ? iconEl.getAttribute('src') : null
+    };
+})
+"""
+
+# Номера страниц из пагинации, чтобы разбить тег на диапазоны
+PAGE_NUMBERS_SCRIPT = """
+() => Array.from(document.querySelectorAll('li.page-item a.page-link'))
+    .map((a) => parseInt(a.innerText.trim(), 10))
+    .filter((n) => !isNaN(n))
+"""
+
+
+class TagCrawlPool:
+    """
+    Параллельный обход тегов Ethplorer пулом из concurrency контекстов
+
+    Теги кладутся в общую очередь, каждый воркер держит свой контекст и
+    страницу одного браузера. Если задан page_param (query-параметр номера
+    страницы) и pages_per_chunk, длинный тег после первой страницы
+    дробится на диапазоны страниц, которые разбирают свободные воркеры.
+
+    С checkpoints (CheckpointStore) свежие теги пропускаются, а целые теги
+    продолжаются с последней сохраненной страницы. Раздробленный тег
+    помечается завершенным, когда обработаны все его диапазоны.
+
+    С known_addresses (dict тег -> set адресов) целый тег обходится
+    инкрементально: известные адреса не сохраняются, а после
+    incremental_stop_pages страниц подряд без новых адресов обход тега
+    останавливается.
+
+    С response_url_pattern строки берутся из перехваченных JSON-ответов
+    таблицы, а DOM разбирается, только если ответов не было.
+    Браузер, контексты и страницы создает browser_factory (AsyncBrowserFactory).
+    """
+    def __init__(self, base_url, writer, concurrency=4, browser_factory=None,
+                 page_param=None, pages_per_chunk=0, checkpoints=None,
+                 known_addresses=None, incremental_stop_pages=1, icon_fetcher=None,
+                 response_url_pattern=None, sink=None):
+        self.base_url = base_url
+        self.writer = writer
+        self.sink = sink
+        self.concurrency = concurrency
+        self.browser_factory = browser_factory or AsyncBrowserFactory()
+        self.page_param = page_param
+        self.pages_per_chunk = pages_per_chunk
+        self.checkpoints = checkpoints
+        self.known_addresses = known_addresses
+        self.incremental_stop_pages = incremental_stop_pages
+        self.icon_fetcher = icon_fetcher
+        self.response_url_pattern = response_url_pattern
+        # Незавершенные диапазоны и число адресов по раздробленным тегам
+        self._pending_chunks = {}
+        self._chunk_addresses = {}
+        self._last_page = {}
+        self.waits = AsyncWaitPolicy(defaults={'tag_rows': 10000})
+        self.progress = {}
+        self.logger = logging.getLogger(__name__)
+
+    def _tag_url(self, tag, page_number):
+        url = f"{self.base_url}/tag/{tag}"
+        if self.page_param and page_number > 1:
+            url += f"?{self.page_param}={page_number}"
+        return url
+
+    async def run(self, tags):
+        """Обходит теги и возвращает прогресс по воркерам"""
+        if self.checkpoints:
+            tags = [tag for tag in tags if not self.checkpoints.is_fresh(tag)]
+        queue = asyncio.Queue()
+        for tag in tags:
+            queue.put_nowait((tag, 1, None))
+
+        async with async_playwright() as p:
+            browser = await self.browser_factory.launch(p)
+            BROWSER_RESTARTS.inc(kind='browser')
+            workers = [
+                asyncio.create_task(self._worker(worker_id, browser, queue))
+                for worker_id in range(self.concurrency)
+            ]
+            try:
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                await browser.close()
+
+        total_pages = sum(progress['pages'] for progress in self.progress.values())
+        total_addresses = sum(progress['addresses'] for progress in self.progress.values())
+        total_failed = sum(progress['failed'] for progress in self.progress.values())
+        self.logger.info(f"Пул завершен: страниц {total_pages}, адресов {total_addresses}, ошибок {total_failed}")
+        return self.progress
+
+    async def _open(self, browser):
+        """Новые контекст и страница воркера"""
+        context = await self.browser_factory.new_context(browser)
+        try:
+            page, traffic = await self.browser_factory.new_page(context)
+        except Exception:
+            await context.close()
+            raise
+        capture = ResponseCapture(page, self.response_url_pattern) if self.response_url_pattern else None
+        BROWSER_RESTARTS.inc(kind='page')
+        return context, page, traffic, capture
+
+    async def _close_context(self, worker_id, context):
+        try:
+            await context.close()
+        except Exception as e:
+            self.logger.debug(f"[worker {worker_id}] Ошибка при закрытии контекста: {e}")
+
+    async def _worker(self, worker_id, browser, queue):
+        """
+        Разбирает очередь до отмены
+
+        Каждая задача отмечается task_done, даже если не удалось создать
+        страницу, иначе queue.join() в run() не дождется конца. После
+        ошибки контекст пересоздается: страница могла упасть или закрыться.
+        """
+        progress = self.progress[worker_id] = {'current': None, 'tags': 0, 'pages': 0, 'addresses': 0, 'failed': 0}
+        context = None
+        try:
+            while True:
+                tag, start_page, end_page = await queue.get()
+                progress['current'] = tag
+                try:
+                    if context is None:
+                        context, page, traffic, capture = await self._open(browser)
+                    await self._crawl(worker_id, page, queue, tag, start_page, end_page, capture, traffic)
+                    if start_page == 1:
+                        progress['tags'] += 1
+                    if tag in self._pending_chunks:
+                        await self._chunk_done(tag)
+                except Exception as e:
+                    progress['failed'] += 1
+                    self.logger.error(f"[worker {worker_id}] Ошибка обработки тега {tag} со страницы {start_page}: {e}")
+                    if context is not None:
+                        await self._close_context(worker_id, context)
+                        context = None
+                finally:
+                    progress['current'] = None
+                    queue.task_done()
+        finally:
+            if context is not None:
+                await self._close_context(worker_id, context)
+
+    async def _finish(self, tag, last_page, addresses):
+        """Тег завершен, когда записаны все его страницы, поставленные в очередь записи"""
+        await self.writer.put_async([], on_done=partial(self.checkpoints.finish, tag, last_page, addresses))
+
+    async def _chunk_done(self, tag):
+        self._pending_chunks[tag] -= 1
+        if self._pending_chunks[tag] == 0 and self.checkpoints:
+            await self._finish(tag, self._last_page[tag], self._chunk_addresses[tag])
+
+    async def _split(self, page, queue, tag):
+        """Ставит в очередь диапазоны страниц тега, возвращает конец первого"""
+        numbers = await page.evaluate(PAGE_NUMBERS_SCRIPT)
+        last_page = max(numbers) if numbers else 1
+        chunk = self.pages_per_chunk
+        self._pending_chunks[tag] = 1
+        self._chunk_addresses[tag] = 0
+        self._last_page[tag] = last_page
+        for start in range(1 + chunk, last_page + 1, chunk):
+            queue.put_nowait((tag, start, min(start + chunk - 1, last_page)))
+            self._pending_chunks[tag] += 1
+        if last_page > chunk:
+            self.logger.info(f"Тег {tag}: {last_page} страниц разбиты на диапазоны по {chunk}")
+        return chunk
+
+    async def _next_page(self, page):
+        """Переход на следующую страницу тега; False, если это последняя"""
+        next_button = await page.query_selector(NEXT_PAGE_SELECTOR)
+        if not next_button:
+            return False
+        first_address = await page.query_selector(ADDRESS_SELECTOR)
+        before = (await first_address.inner_text()).strip() if first_address else ''
+        await next_button.click()
+        await self.waits.content_change(page, 'pagination', ADDRESS_SELECTOR, before)
+        return True
+
+    async def _rows(self, page, capture):
+        """Строки текущей страницы: из JSON-ответов, если они были, иначе из DOM"""
+        if capture:
+            payloads = await capture.drain()
+            records = [record for payload in payloads for record in extract_labels(payload, 'ethereum')]
+            if records:
+                rows = {}
+                for record in records:
+                    row = rows.setdefault(record['address'], {
+                        'address': record['address'],
+                        'tags': [],
+                        'name': record['name'],
+                        'icon_url': None
+                    })
+                    if record['type'] != 'other':
+                        row['tags'].append(record['type'])
+                return list(rows.values())
+        return await page.evaluate(TAG_ROWS_SCRIPT)
+
+    async def _crawl(self, worker_id, page, queue, tag, start_page, end_page, capture=None, traffic=None):
+        progress = self.progress[worker_id]
+        processed_addresses = set()
+        splitting = bool(self.page_param and self.pages_per_chunk)
+        # Чекпоинты по страницам ведем только для целых тегов
+        track = self.checkpoints is not None and not splitting
+        saved_addresses = 0
+        incremental = self.known_addresses is not None and not splitting
+        known = self.known_addresses.get(tag, set()) if incremental else set()
+        known_pages = 0
+        target_page = start_page
+        if track:
+            target_page = self.checkpoints.resume_page(tag)
+            saved_addresses = self.checkpoints.resume_addresses(tag)
+
+        if capture:
+            capture.clear()
+        page_started = time.monotonic()
+        with STEP_SECONDS.time(step='goto'):
+            await page.goto(self._tag_url(tag, target_page), wait_until='domcontentloaded')
+        await self.waits.selector(page, 'tag_rows', 'tbody tr')
+        current_page = target_page if self.page_param else 1
+        while current_page < target_page and await self._next_page(page):
+            current_page += 1
+
+        if start_page == 1 and splitting:
+            end_page = await self._split(page, queue, tag)
+
+        while True:
+            rows = await self._rows(page, capture)
+            page_batch = []
+            page_addresses = 0
+            page_known = 0
+            for row in rows:
+                address = row['address']
+                if not address or address in processed_addresses or row['tags'] is None:
+                    continue
+                processed_addresses.add(address)
+                page_addresses += 1
+                if normalize_address(address) in known:
+                    page_known += 1
+                    continue
+                icon_url = row['icon_url']
+                icon_sha256 = None
+                if icon_url and icon_url.startswith('/'):
+                    icon_url = f"{self.base_url}{icon_url}"
+                if icon_url and self.icon_fetcher:
+                    icon_sha256 = self.icon_fetcher.known_hash(icon_url)
+                    if not icon_sha256:
+                        self.icon_fetcher.submit(address, icon_url)
+                page_batch.append({
+                    'address': address,
+                    'name': row['name'],
+                    'icon_url': icon_url,
+                    'icon_sha256': icon_sha256,
+                    'tags': row['tags'],
+                    'tag': tag  # Тег, по странице которого найден адрес
+                })
+
+            saved_addresses += len(page_batch)
+            # Чекпоинт сдвигается, только когда страница записана в БД или в spill
+            on_done = partial(self.checkpoints.page_done, tag, current_page, saved_addresses) if track else None
+            if page_batch or on_done:
+                await self.writer.put_async(page_batch, source='ethplorer-tags', on_done=on_done)
+            if page_batch and self.sink:
+                self.sink.write_batch(page_batch)
+            progress['pages'] += 1
+            progress['addresses'] += len(page_batch)
+            PAGES.inc(source='ethplorer')
+            ITERATIONS.inc(source='ethplorer')
+            RECORDS.inc(len(page_batch), source='ethplorer')
+            PAGE_SECONDS.observe(time.monotonic() - page_started, source='ethplorer')
+            if not track and tag in self._chunk_addresses:
+                self._chunk_addresses[tag] += len(page_batch)
+            self.logger.info(
+                f"[worker {worker_id}] {tag} стр. {current_page}: адресов {len(page_batch)} "
+                f"(всего у воркера: {progress['addresses']})" + (f", трафик {traffic.summary()}" if traffic else '')
+            )
+
+            if incremental:
+                known_pages = known_pages + 1 if page_addresses and page_known == page_addresses else 0
+                if known_pages >= self.incremental_stop_pages:
+                    self.logger.info(f"[worker {worker_id}] {tag}: {known_pages} стр. подряд без новых адресов, остановка")
+                    if track:
+                        await self._finish(tag, current_page, saved_addresses)
+                    break
+
+            if end_page is not None and current_page >= end_page:
+                break
+            page_started = time.monotonic()
+            if not await self._next_page(page):
+                if track:
+                    await self._finish(tag, current_page, saved_addresses)
+                break
+            current_page += 1
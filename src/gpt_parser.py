@@ -1,18 +1,263 @@
 import asyncio
-import re
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import logging
-from db.models import Database, AddressRepository
+from db.async_models import AsyncDatabase, AsyncAddressRepository, AsyncTagCache
+from dedup import RowTracker, SeenFilter
+from wait_policy import AsyncWaitPolicy
+from interception import ResponseCapture, extract_labels, replay_har
+from browser_factory import AsyncBrowserFactory
+from browser_lifecycle import AsyncBrowserLifecycle, AsyncPageSlot
+from write_behind import AsyncWriteBehindQueue
+from jsonl_sink import JsonlSink, sink_from_env
+from tooltip_parser import parse_risk_name, parse_tooltips
+from metrics import ITERATIONS, PAGE_SECONDS, PAGES, RECORDS, STEP_SECONDS, TOOLTIPS_FOUND, TOOLTIPS_HOVERED, start_from_env
 import os
 from dotenv import load_dotenv
+import signal
 import time
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Получаем настройки из переменных окружения
-blockchain = os.getenv('BLOCKCHAIN', 'ethereum')
-url = f"https://www.oklink.com/{blockchain}/tx-list"
+# Получаем настройки из переменных окружения: список сетей через запятую
+# в BLOCKCHAINS, иначе одна сеть из BLOCKCHAIN. Вместо сети можно указать
+# сеть/путь списка OKLink (ethereum/token-list); по умолчанию tx-list
+blockchains = [
+    chain.strip().lower()
+    for chain in os.getenv('BLOCKCHAINS', os.getenv('BLOCKCHAIN', 'ethereum')).split(',')
+    if chain.strip()
+]
+
+# Режим извлечения: evaluate (один evaluate на страницу), observer
+# (синтетические события + MutationObserver), response (JSON-ответы
+# страницы без наведения) или legacy
+extract_mode = os.getenv('EXTRACT_MODE', 'evaluate').lower()
+
+# Настройки режима response: какие ответы перехватывать и сколько их ждать
+RESPONSE_URL_PATTERN = os.getenv('RESPONSE_URL_PATTERN', r'/api/')
+RESPONSE_WAIT_MS = int(os.getenv('RESPONSE_WAIT_MS', '5000'))
+RESPONSE_QUIET_MS = int(os.getenv('RESPONSE_QUIET_MS', '300'))
+
+# Инкрементальный опрос (режимы evaluate и observer): наводятся только строки,
+# которых не было в прошлых опросах. INCREMENTAL_REFRESH задает, как
+# получать новые строки: reload - goto на каждой итерации, live - страница
+# остается открытой и обновляет таблицу сама, click - клик по
+# INCREMENTAL_REFRESH_SELECTOR перезапрашивает таблицу без перезагрузки.
+# В live и click страница все равно перезагружается раз в INCREMENTAL_RELOAD_SECONDS
+POLL_INCREMENTAL = os.getenv('POLL_INCREMENTAL', 'false').lower() == 'true'
+INCREMENTAL_REFRESH = os.getenv('INCREMENTAL_REFRESH', 'reload').lower()
+INCREMENTAL_REFRESH_SELECTOR = os.getenv('INCREMENTAL_REFRESH_SELECTOR')
+INCREMENTAL_RELOAD_SECONDS = float(os.getenv('INCREMENTAL_RELOAD_SECONDS', '300'))
+ROW_TRACKER_SIZE = int(os.getenv('ROW_TRACKER_SIZE', '10000'))
+if POLL_INCREMENTAL and INCREMENTAL_REFRESH == 'click' and not INCREMENTAL_REFRESH_SELECTOR:
+    raise ValueError("Для INCREMENTAL_REFRESH=click нужен INCREMENTAL_REFRESH_SELECTOR")
+
+# Адрес OKLink; benchmark.py подставляет сюда локальный сервер фикстур
+OKLINK_BASE_URL = os.getenv('OKLINK_BASE_URL', 'https://www.oklink.com').rstrip('/')
+
+# Облегченный Chromium (см. BROWSER_* в .env); HAR_FILE подменяет сеть записью
+browser_factory = AsyncBrowserFactory.from_env()
+HAR_FILE = os.getenv('HAR_FILE')
+
+# Сырые тексты tooltip'ов для корпуса микро-бенчмарка tooltip_parser.py
+TOOLTIP_CORPUS_DIR = os.getenv('TOOLTIP_CORPUS_DIR')
+tooltip_corpus = JsonlSink(TOOLTIP_CORPUS_DIR, 'tooltips') if TOOLTIP_CORPUS_DIR else None
+
+# Настройки режима observer
+OBSERVER_BATCH_SIZE = int(os.getenv('OBSERVER_BATCH_SIZE', '10'))
+OBSERVER_SETTLE_MS = int(os.getenv('OBSERVER_SETTLE_MS', '50'))
+OBSERVER_MAX_WAIT_MS = int(os.getenv('OBSERVER_MAX_WAIT_MS', '1000'))
+
+# Селекторы страницы tx-list
+WRAPPER_SELECTOR = ".index_wrapper__ns7tB"
+RISK_ICON_SELECTOR = ".oklink-explore-danger"
+RISK_TOOLTIP_SELECTOR = ".okui-popup-layer-content.index_conWrapper__PSJYS"
+NAME_TOOLTIP_SELECTOR = ".index_title__9lx6D"
+
+# Ожидания конкретных сигналов вместо фиксированных пауз; таймауты
+# подстраиваются под наблюдаемые длительности
+waits = AsyncWaitPolicy(defaults={
+    'rows': 30000,
+    'risk_tooltip': 1000,
+    'risk_tooltip_hidden': 1000,
+    'name_tooltip': 1000
+})
+
+# Ключ строки для инкрементального опроса: ссылка на транзакцию и адрес,
+# без ссылки на транзакцию - адрес и видимый текст
+ROW_KEY_FUNCTION = """
+(el) => {
+    const link = el.querySelector('.index_address__7NLO9') || el.querySelector('a[href*="/address/"]');
+    const href = link ? link.getAttribute('href') : '';
+    const row = el.closest('tr');
+    const tx = row && row.querySelector('a[href*="/tx/"]');
+    return tx ? tx.getAttribute('href') + '|' + href : href + '|' + el.innerText.trim();
+}
+"""
+
+# Все строки таблицы за один CDP-вызов: индекс, href, видимый текст, иконка риска и ключ
+EXTRACT_ROWS_SCRIPT = """
+([wrapperSelector, riskSelector]) => {
+    const rowKey = """ + ROW_KEY_FUNCTION.strip() + """;
+    const riskIconSelector = riskSelector + ', .' + CSS.escape('index_riskIcon__u0+KY');
+    return Array.from(document.querySelectorAll(wrapperSelector)).map((el, index) => {
+        const link = el.querySelector('.index_address__7NLO9') || el.querySelector('a[href*="/address/"]');
+        return {
+            index: index,
+            href: link ? link.getAttribute('href') : null,
+            text: el.innerText.trim(),
+            hasRisk: !!el.querySelector(riskIconSelector),
+            key: rowKey(el)
+        };
+    });
+}
+"""
+
+# Первая строка таблицы сменилась: пришли новые транзакции
+WAIT_ROWS_CHANGED_SCRIPT = """
+([wrapperSelector, head]) => {
+    const rowKey = """ + ROW_KEY_FUNCTION.strip() + """;
+    const el = document.querySelector(wrapperSelector);
+    return !!el && rowKey(el) !== head;
+}
+"""
+
+# Сбор tooltip'ов через MutationObserver (вырос из прототипа в test_parser.py).
+# Строкам рассылаются синтетические события наведения пачками, после каждой
+# пачки ждем, пока DOM успокоится, и сразу закрываем tooltip'ы.
+# Тултип риска не содержит адреса, поэтому такие строки идут пачками по одной
+# и результат привязывается к индексу строки. Именной tooltip содержит адрес,
+# и их можно наводить параллельно.
+HARVEST_TOOLTIPS_SCRIPT = """
+async (opts) => {
+    const riskIconSelector = opts.riskSelector + ', .' + CSS.escape('index_riskIcon__u0+KY');
+    const tooltipSelector = opts.riskTooltipSelector + ', ' + opts.nameTooltipSelector;
+    const rows = document.querySelectorAll(opts.wrapperSelector);
+    const harvested = [];
+    const seen = new Set();
+    // Тултипы, тронутые мутациями во время текущего наведения
+    let touched = new Set();
+    let currentIndex = null;
+    let lastMutation = performance.now();
+
+    const visible = (el) => {
+        if (!el.isConnected || !el.getClientRects().length) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.display !== 'none' && style.opacity !== '0';
+    };
+
+    const record = (el) => {
+        const text = el.innerText.trim();
+        if (!text) return;
+        const kind = el.matches(opts.riskTooltipSelector) ? 'risk' : 'name';
+        const key = kind + '|' + currentIndex + '|' + text;
+        if (seen.has(key)) return;
+        seen.add(key);
+        harvested.push({ kind: kind, index: kind === 'risk' ? currentIndex : null, text: text });
+    };
+    const inspect = (node) => {
+        const el = node.nodeType === 1 ? node : node.parentElement;
+        if (!el) return;
+        const tooltip = el.closest(tooltipSelector);
+        if (tooltip) {
+            touched.add(tooltip);
+        } else if (node.nodeType === 1) {
+            el.querySelectorAll(tooltipSelector).forEach((found) => touched.add(found));
+        }
+    };
+
+    const observer = new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            if (mutation.type === 'childList') {
+                mutation.addedNodes.forEach(inspect);
+            } else {
+                inspect(mutation.target);
+            }
+        }
+        lastMutation = performance.now();
+    });
+    observer.observe(document.body, {
+        childList: true, subtree: true, characterData: true,
+        attributes: true, attributeFilter: ['class', 'style']
+    });
+
+    const fire = (el, types) => {
+        for (const type of types) {
+            const bubbles = !type.endsWith('enter') && !type.endsWith('leave');
+            const Ctor = type.startsWith('pointer') ? PointerEvent : MouseEvent;
+            el.dispatchEvent(new Ctor(type, { bubbles: bubbles, cancelable: true, view: window }));
+        }
+    };
+    const settle = () => new Promise((resolve) => {
+        const start = performance.now();
+        const tick = () => {
+            const now = performance.now();
+            const quiet = now - lastMutation >= opts.settleMs && now - start >= opts.settleMs;
+            if (quiet || now - start >= opts.maxWaitMs) {
+                resolve();
+            } else {
+                setTimeout(tick, 10);
+            }
+        };
+        setTimeout(tick, 10);
+    });
+    const hoverBatch = async (targets) => {
+        // Видимые до наведения тултипы остались от прошлых строк и не относятся к этой,
+        // если только их не перерисовали во время наведения
+        const before = new Set(Array.from(document.querySelectorAll(tooltipSelector)).filter(visible));
+        touched = new Set();
+        targets.forEach((el) => fire(el, ['pointerover', 'pointerenter', 'mouseover', 'mouseenter']));
+        await settle();
+        // Забираем и то, что стало видно без мутаций внутри тултипа (например, через стили предка)
+        document.querySelectorAll(tooltipSelector).forEach((el) => {
+            if (!before.has(el)) touched.add(el);
+        });
+        touched.forEach((el) => {
+            if (visible(el)) record(el);
+        });
+        targets.forEach((el) => fire(el, ['pointerout', 'pointerleave', 'mouseout', 'mouseleave']));
+    };
+
+    try {
+        for (const index of opts.riskIndices) {
+            const icon = rows[index] && rows[index].querySelector(riskIconSelector);
+            if (!icon) continue;
+            currentIndex = index;
+            await hoverBatch([icon]);
+        }
+        currentIndex = null;
+        for (let i = 0; i < opts.nameIndices.length; i += opts.batchSize) {
+            const batch = opts.nameIndices.slice(i, i + opts.batchSize)
+                .map((index) => rows[index])
+                .filter(Boolean);
+            await hoverBatch(batch);
+        }
+    } finally {
+        observer.disconnect();
+    }
+    return harvested;
+}
+"""
+
+# Ждет tooltip с нужным адресом, чтобы не прочитать оставшийся от предыдущей строки
+WAIT_NAME_TOOLTIP_SCRIPT = """
+([selector, address]) => {
+    const el = document.querySelector(selector);
+    if (!el) return null;
+    const text = el.innerText.trim();
+    return text.toLowerCase().includes(address.toLowerCase()) ? text : null;
+}
+"""
+
+# Ни одного видимого тултипа риска: тултип риска не содержит адреса, и
+# оставшийся от прошлой строки был бы прочитан как тултип текущей
+NO_VISIBLE_TOOLTIP_SCRIPT = """
+(selector) => Array.from(document.querySelectorAll(selector)).every((el) => {
+    if (!el.getClientRects().length) return true;
+    const style = getComputedStyle(el);
+    return style.visibility === 'hidden' || style.opacity === '0';
+})
+"""
 
 def is_valid_address(address: str, chain: str) -> bool:
     """Проверка валидности адреса в зависимости от блокчейна"""
@@ -43,258 +288,585 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT')
 }
 
-async def scrape_tooltips(url: str, attempts: int = 5):
-    # Инициализация базы данных
-    db = Database(DB_CONFIG)
-    db.init_tables()
-    address_repo = AddressRepository(db)
-    
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = None  # Будем пересоздавать страницу при необходимости
-        
-        while True:  # Бесконечный цикл
-            try:
-                logger.info("🔄 Начинаем новую итерацию сбора данных")
-                
-                # Создаем новую страницу, если нужно
-                if page is None or page.is_closed():
-                    logger.info("🌟 Создаем новую страницу браузера")
-                    page = await browser.new_page()
-                    
-                # Устанавливаем таймаут для операций
-                page.set_default_timeout(30000)  # 30 секунд на операции (вместо 60)
-                    
-                # Переходим на страницу с таймаутом
-                await page.goto(url, wait_until='networkidle', timeout=30000)
-                logger.info("✅ Страница загружена успешно")
-                
-                # Дополнительная пауза для полной загрузки
-                await page.wait_for_timeout(1000)  # 1 секунда для полной загрузки
-
-                # Инициализируем список результатов
-                parsed_results = []
-                tooltips = set()  # Множество для уникальных tooltips
-
-                # Поиск всех иконок риска на странице
-                risk_icons = await page.query_selector_all(".oklink-explore-danger")
-                logger.info(f"🔍 Найдено иконок риска на странице: {len(risk_icons)}")
-                
-                # Сначала наводим на все иконки
-                for i, risk_icon in enumerate(risk_icons):
-                    try:
-                        logger.info(f"ℹ️ Наведение на иконку риска #{i+1}")
-                        await risk_icon.hover()
-                        await page.wait_for_timeout(300)
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка при наведении на иконку #{i+1}: {e}")
-
-                # Теперь собираем все тултипы
-                risk_tooltips = await page.query_selector_all(".okui-popup-layer-content.index_conWrapper__PSJYS")
-                logger.info(f"🔍 Найдено тултипов риска: {len(risk_tooltips)}")
-                
-                for i, tooltip in enumerate(risk_tooltips):
-                    try:
-                        risk_text = await tooltip.inner_text()
-                        logger.info(f"🔴 Тултип риска #{i+1}: {risk_text}")
-                        
-                        # Извлекаем имя из текста после "reported as"
-                        if "reported as" in risk_text:
-                            # Получаем имя и убираем слово "address" в конце
-                            name = risk_text.split("reported as")[1].strip()
-                            if name.endswith(" address"):
-                                name = name[:-8]  # убираем " address" в конце
-                            
-                            # Получаем адрес из того же блока
-                            address_element = await page.query_selector(f".index_wrapper__ns7tB:nth-child({i+1}) .index_address__7NLO9")
-                            if address_element:
-                                logger.info(f"🔍 Найден элемент адреса #{i+1}")
-                                # Получаем адрес из href
-                                href = await address_element.get_attribute("href")
-                                if href:
-                                    # Извлекаем адрес из href (формат: /tron/address/TVmowKrNepsDeEwzvtMr1cfg1eJE5G2ux9)
-                                    address = href.split('/')[-1]
-                                    logger.info(f"📝 Найден адрес для риска: {address}")
-                                    
-                                    # Добавляем в parsed_results
-                                    parsed_results.append({
-                                        "type": name,  # Используем имя как тип
-                                        "name": name,  # И как имя
-                                        "address": address
-                                    })
-                                    logger.info(f"✅ Добавлен риск: {name} для адреса {address}")
-                                else:
-                                    logger.error(f"❌ Не найден href для элемента {i+1}")
-                                    continue
-                        
-                        tooltips.add(risk_text)
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка при получении текста тултипа #{i+1}: {e}")
-
-                # Продолжаем с основным циклом
-                for attempt in range(1, attempts + 1):
-                    logger.info(f"🔁 Попытка {attempt} из {attempts}")
-                    try:
-                        address_elements = await page.query_selector_all(".index_wrapper__ns7tB")
-                        logger.info(f"🔍 Найдено {len(address_elements)} адресов")
-
-                        for i in range(len(address_elements)):
-                            try:
-                                fresh_elements = await page.query_selector_all(".index_wrapper__ns7tB")
-                                if i >= len(fresh_elements):
-                                    continue
-
-                                element = fresh_elements[i]
-                                
-                                # Сначала проверяем наличие иконки риска
-                                risk_icon = await element.query_selector(".index_riskIcon__u0+KY")
-                                if not risk_icon:
-                                    # Если не нашли внутри элемента, ищем в родительском блоке
-                                    parent = await element.evaluate('el => el.closest(".index_wrapper__ns7tB")')
-                                    if parent:
-                                        # Создаем новый элемент из родительского
-                                        parent_element = await page.query_selector(f".index_wrapper__ns7tB:nth-child({i+1})")
-                                        if parent_element:
-                                            risk_icon = await parent_element.query_selector(".index_riskIcon__u0+KY")
-                                
-                                if risk_icon:
-                                    logger.info("⚠️ Найдена иконка риска")
-                                    await risk_icon.hover()
-                                    await page.wait_for_timeout(300)
-                                    
-                                    # Ждем появления тултипа риска
-                                    try:
-                                        risk_tooltip = await page.wait_for_selector(".okui-popup-layer-content.index_conWrapper__PSJYS", timeout=1000)
-                                        if risk_tooltip:
-                                            risk_text = await risk_tooltip.inner_text()
-                                            logger.info(f"🔴 Тултип риска: {risk_text}")
-                                            # Используем текст риска как имя
-                                            tooltips.add(risk_text)
-                                            continue
-                                    except Exception as e:
-                                        logger.error(f"❌ Ошибка при получении тултипа риска: {e}")
-                                else:
-                                    logger.debug("ℹ️ Иконка риска не найдена")
-                                
-                                # Если иконки риска нет, проверяем содержимое элемента
-                                text = await element.inner_text()
-                                text = text.strip()
-                                
-                                # Проверяем, является ли текст адресом для текущего блокчейна
-                                if is_valid_address(text, blockchain):
-                                    logger.debug(f"⏩ Пропускаем элемент только с адресом: {text}")
-                                    continue
-
-                                # Если есть дополнительный текст (имя) - делаем наведение
-                                logger.info(f"🔄 Наведение на элемент с именем: {text}")
-                                await element.hover()
-                                await page.wait_for_timeout(300)
-
-                                # Получаем основной тултип
-                                tooltip_el = await page.query_selector(".index_title__9lx6D")
-                                if tooltip_el:
-                                    text = await tooltip_el.inner_text()
-                                    tooltip_text = text.strip()
-                                    logger.info(f"🟡 Tooltip: {tooltip_text}")
-                                    tooltips.add(tooltip_text)
-
-                            except Exception as e:
-                                logger.error(f"⚠️ Ошибка при обработке элемента: {e}")
-
-                        logger.info(f"✅ Всего уникальных tooltip'ов: {len(tooltips)}")
-                        break
-
-                    except Exception as e:
-                        logger.error(f"⚠️ Ошибка при попытке {attempt}: {e}")
-                        if attempt == attempts:
-                            logger.error("❌ Не удалось собрать все tooltips после нескольких попыток")
-                        
+async def collect_tooltips_legacy(page, context, url: str, chain: str, attempts: int):
+    """
+    Исходный сбор tooltip'ов: отдельные handle и hover на каждый элемент
+
+    Возвращает (parsed_results, tooltips, page): страница может быть
+    пересоздана, если перезагрузка не удалась.
+    """
+    # Инициализируем список результатов
+    parsed_results = []
+    tooltips = set()  # Множество для уникальных tooltips
+
+    # Поиск всех иконок риска на странице
+    risk_icons = await page.query_selector_all(".oklink-explore-danger")
+    logger.info(f"🔍 Найдено иконок риска на странице: {len(risk_icons)}")
+
+    # Сначала наводим на все иконки
+    for i, risk_icon in enumerate(risk_icons):
+        try:
+            logger.debug(f"ℹ️ Наведение на иконку риска #{i+1}")
+            TOOLTIPS_HOVERED.inc(source=chain)
+            with STEP_SECONDS.time(step='hover'):
+                await risk_icon.hover()
+            await waits.selector(page, 'risk_tooltip', RISK_TOOLTIP_SELECTOR)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при наведении на иконку #{i+1}: {e}")
+
+    # Теперь собираем все тултипы
+    risk_tooltips = await page.query_selector_all(".okui-popup-layer-content.index_conWrapper__PSJYS")
+    logger.info(f"🔍 Найдено тултипов риска: {len(risk_tooltips)}")
+    TOOLTIPS_FOUND.inc(len(risk_tooltips), source=chain)
+
+    for i, tooltip in enumerate(risk_tooltips):
+        try:
+            risk_text = await tooltip.inner_text()
+            logger.debug(f"🔴 Тултип риска #{i+1}: {risk_text}")
+
+            # Имя из текста после "reported as"
+            name = parse_risk_name(risk_text)
+            if name is not None:
+                # Получаем адрес из того же блока
+                address_element = await page.query_selector(f".index_wrapper__ns7tB:nth-child({i+1}) .index_address__7NLO9")
+                if address_element:
+                    logger.debug(f"🔍 Найден элемент адреса #{i+1}")
+                    # Получаем адрес из href
+                    href = await address_element.get_attribute("href")
+                    if href:
+                        # Извлекаем адрес из href (формат: /tron/address/TVmowKrNepsDeEwzvtMr1cfg1eJE5G2ux9)
+                        address = href.split('/')[-1]
+                        logger.debug(f"📝 Найден адрес для риска: {address}")
+
+                        # Добавляем в parsed_results
+                        parsed_results.append({
+                            "type": name,  # Используем имя как тип
+                            "name": name,  # И как имя
+                            "address": address
+                        })
+                        logger.debug(f"✅ Добавлен риск: {name} для адреса {address}")
+                    else:
+                        logger.error(f"❌ Не найден href для элемента {i+1}")
+                        continue
+
+            tooltips.add(risk_text)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении текста тултипа #{i+1}: {e}")
+
+    # Продолжаем с основным циклом
+    for attempt in range(1, attempts + 1):
+        logger.info(f"🔁 Попытка {attempt} из {attempts}")
+        try:
+            address_elements = await page.query_selector_all(".index_wrapper__ns7tB")
+            logger.info(f"🔍 Найдено {len(address_elements)} адресов")
+
+            for i in range(len(address_elements)):
+                try:
+                    fresh_elements = await page.query_selector_all(".index_wrapper__ns7tB")
+                    if i >= len(fresh_elements):
+                        continue
+
+                    element = fresh_elements[i]
+
+                    # Сначала проверяем наличие иконки риска
+                    risk_icon = await element.query_selector(".index_riskIcon__u0+KY")
+                    if not risk_icon:
+                        # Если не нашли внутри элемента, ищем в родительском блоке
+                        parent = await element.evaluate('el => el.closest(".index_wrapper__ns7tB")')
+                        if parent:
+                            # Создаем новый элемент из родительского
+                            parent_element = await page.query_selector(f".index_wrapper__ns7tB:nth-child({i+1})")
+                            if parent_element:
+                                risk_icon = await parent_element.query_selector(".index_riskIcon__u0+KY")
+
+                    if risk_icon:
+                        logger.debug("⚠️ Найдена иконка риска")
+                        TOOLTIPS_HOVERED.inc(source=chain)
+                        with STEP_SECONDS.time(step='hover'):
+                            await risk_icon.hover()
+
+                        # Ждем появления тултипа риска
                         try:
-                            await page.reload(wait_until='networkidle', timeout=30000)
-                            await page.wait_for_timeout(2000)  # 2 секунды вместо 3
-                        except Exception as reload_error:
-                            logger.error(f"⚠️ Ошибка при перезагрузке страницы: {reload_error}")
-                            # Создаем новую страницу, так как текущая может быть сломана
-                            await page.close()
-                            page = await browser.new_page()
-                            await page.goto(url, wait_until='networkidle', timeout=30000)
-
-                # Обработка и сохранение tooltip'ов
-                for tooltip in tooltips:
-                    # Для Tron формат: "Type: Name\nAddress"
-                    if blockchain.lower() == 'tron':
-                        lines = tooltip.split('\n')
-                        if len(lines) == 2:
-                            type_name = lines[0].split(': ', 1)
-                            if len(type_name) == 2:
-                                result = {
-                                    "type": type_name[0],
-                                    "name": type_name[1],
-                                    "address": lines[1].strip()
-                                }
-                                parsed_results.append(result)
+                            risk_tooltip = await waits.selector(page, 'risk_tooltip', RISK_TOOLTIP_SELECTOR)
+                            if risk_tooltip:
+                                risk_text = await risk_tooltip.inner_text()
+                                logger.debug(f"🔴 Тултип риска: {risk_text}")
+                                TOOLTIPS_FOUND.inc(source=chain)
+                                # Используем текст риска как имя
+                                tooltips.add(risk_text)
+                                continue
+                        except Exception as e:
+                            logger.error(f"❌ Ошибка при получении тултипа риска: {e}")
                     else:
-                        # Для EVM формат: "Type: Name 0x..." или просто "Name 0x..."
-                        match = re.match(r"(?:(?P<type>\w+):\s+)?(?P<name>.+?)\s+(?P<address>0x[a-fA-F0-9]{40})", tooltip)
-                        if match:
-                            result = {
-                                "type": match.group("type") or "other",  # если тип не найден, используем "other"
-                                "name": match.group("name"),
-                                "address": match.group("address")
-                            }
-                            parsed_results.append(result)
-
-                logger.info(f"\n🔎 Распознано адресов с именами: {len(parsed_results)}")
-                for item in parsed_results:
-                    logger.info(f"🔹 Type: {item['type']}, Name: {item['name']}, Address: {item['address']}")
-                    # Сохраняем в базу данных
+                        logger.debug("ℹ️ Иконка риска не найдена")
+
+                    # Если иконки риска нет, проверяем содержимое элемента
+                    text = await element.inner_text()
+                    text = text.strip()
+
+                    # Проверяем, является ли текст адресом для текущего блокчейна
+                    if is_valid_address(text, chain):
+                        logger.debug(f"⏩ Пропускаем элемент только с адресом: {text}")
+                        continue
+
+                    # Если есть дополнительный текст (имя) - делаем наведение
+                    logger.debug(f"🔄 Наведение на элемент с именем: {text}")
+                    TOOLTIPS_HOVERED.inc(source=chain)
+                    with STEP_SECONDS.time(step='hover'):
+                        await element.hover()
                     try:
-                        address_data = {
-                            'address': item['address'],
-                            'name': item['name'],
-                            'tag': item['type'],
-                            'chain': blockchain
-                        }
-                        address_repo.save_address(address_data)
-                        logger.info(f"✅ Сохранен адрес: {item['address']} с именем: {item['name']} и тегом: {item['type']}")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка при сохранении адреса {item['address']}: {e}")
-
-                # Пауза между итерациями (1 секунда)
-                logger.info("💤 Пауза 1 секунда перед следующей итерацией...")
-                await asyncio.sleep(1)
-
-            except Exception as e:
-                logger.error(f"❌ Критическая ошибка в основном цикле: {e}")
-                
-                # Пытаемся закрыть страницу, если она еще существует
-                try:
-                    if page and not page.is_closed():
-                        await page.close()
-                except:
-                    pass
-                    
-                # Сбрасываем страницу, чтобы создать новую в следующей итерации
-                page = None
-                
-                logger.info("💤 Пауза 10 секунд перед повторной попыткой...")
-                await asyncio.sleep(10)
-                
-                # Проверяем, не закрылся ли браузер
-                try:
-                    # Если браузер закрылся, создаем новый
-                    if browser.is_connected() == False:
-                        logger.info("🔄 Браузер отключен, запускаем новый")
-                        browser = await p.chromium.launch(headless=True)
-                except Exception as browser_error:
-                    logger.error(f"⚠️ Ошибка при проверке браузера: {browser_error}")
-                    browser = await p.chromium.launch(headless=True)
+                        await waits.selector(page, 'name_tooltip', NAME_TOOLTIP_SELECTOR)
+                    except Exception:
+                        logger.debug("ℹ️ Tooltip не появился")
+
+                    # Получаем основной тултип
+                    tooltip_el = await page.query_selector(".index_title__9lx6D")
+                    if tooltip_el:
+                        text = await tooltip_el.inner_text()
+                        tooltip_text = text.strip()
+                        logger.debug(f"🟡 Tooltip: {tooltip_text}")
+                        TOOLTIPS_FOUND.inc(source=chain)
+                        tooltips.add(tooltip_text)
+
+                except Exception as e:
+                    logger.error(f"⚠️ Ошибка при обработке элемента: {e}")
+
+            logger.info(f"✅ Всего уникальных tooltip'ов: {len(tooltips)}")
+            break
+
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка при попытке {attempt}: {e}")
+            if attempt == attempts:
+                logger.error("❌ Не удалось собрать все tooltips после нескольких попыток")
+
+            try:
+                await page.reload(wait_until='domcontentloaded', timeout=30000)
+                await waits.selector(page, 'rows', WRAPPER_SELECTOR)
+            except Exception as reload_error:
+                logger.error(f"⚠️ Ошибка при перезагрузке страницы: {reload_error}")
+                # Создаем новую страницу, так как текущая может быть сломана
+                await page.close()
+                page, _ = await browser_factory.new_page(context)
+                await page.goto(url, wait_until='domcontentloaded', timeout=30000)
+                await waits.selector(page, 'rows', WRAPPER_SELECTOR)
+
+    return parsed_results, tooltips, page
+
+async def collect_tooltips_evaluate(page, chain: str, tracker=None):
+    """
+    Сбор tooltip'ов по снимку строк, полученному одним page.evaluate
+
+    Наведение выполняется только для строк с иконкой риска или с именем,
+    поэтому число CDP-вызовов пропорционально числу именованных строк.
+    С tracker разбираются только новые строки, обработанные откладываются
+    в tracker.stage(). Возвращает (parsed_results, tooltips).
+    """
+    parsed_results = []
+    tooltips = set()
+
+    rows = await page.evaluate(EXTRACT_ROWS_SCRIPT, [WRAPPER_SELECTOR, RISK_ICON_SELECTOR])
+    if tracker is not None:
+        total = len(rows)
+        rows = tracker.new_rows(rows, chain)
+        logger.info(f"🔍 Новых строк {len(rows)} из {total}, с риском: {sum(1 for row in rows if row['hasRisk'])}")
+    else:
+        logger.info(f"🔍 Найдено {len(rows)} строк, с риском: {sum(1 for row in rows if row['hasRisk'])}")
+    wrappers = page.locator(WRAPPER_SELECTOR)
+    done = []
+
+    for row in rows:
+        address = row['href'].split('/')[-1] if row['href'] else None
+        try:
+            if row['hasRisk']:
+                risk_icon = wrappers.nth(row['index']).locator(RISK_ICON_SELECTOR).first
+                # Уводим мышь и ждем, пока закроется тултип прошлой строки
+                await page.mouse.move(0, 0)
+                await waits.function(page, 'risk_tooltip_hidden', NO_VISIBLE_TOOLTIP_SCRIPT, RISK_TOOLTIP_SELECTOR)
+                TOOLTIPS_HOVERED.inc(source=chain)
+                with STEP_SECONDS.time(step='hover'):
+                    await risk_icon.hover()
+                # Скрытые тултипы прошлых строк могут остаться в DOM раньше нового
+                risk_tooltip = await waits.selector(page, 'risk_tooltip', f"{RISK_TOOLTIP_SELECTOR} >> visible=true")
+                risk_text = await risk_tooltip.inner_text()
+                TOOLTIPS_FOUND.inc(source=chain)
+                logger.debug(f"🔴 Тултип риска #{row['index'] + 1}: {risk_text}")
+                name = parse_risk_name(risk_text)
+                if name and address:
+                    parsed_results.append({
+                        "type": name,  # Используем имя как тип
+                        "name": name,  # И как имя
+                        "address": address
+                    })
+                    logger.debug(f"✅ Добавлен риск: {name} для адреса {address}")
+                done.append(row['key'])
+                continue
+
+            # Строки только с адресом не наводим
+            if not address or is_valid_address(row['text'], chain):
+                done.append(row['key'])
+                continue
+
+            logger.debug(f"🔄 Наведение на элемент с именем: {row['text']}")
+            TOOLTIPS_HOVERED.inc(source=chain)
+            with STEP_SECONDS.time(step='hover'):
+                await wrappers.nth(row['index']).hover()
+            handle = await waits.function(
+                page, 'name_tooltip', WAIT_NAME_TOOLTIP_SCRIPT, [NAME_TOOLTIP_SELECTOR, address]
+            )
+            tooltip_text = await handle.json_value()
+            TOOLTIPS_FOUND.inc(source=chain)
+            logger.debug(f"🟡 Tooltip: {tooltip_text}")
+            tooltips.add(tooltip_text)
+            done.append(row['key'])
+
+        except Exception as e:
+            # Строка с ошибкой остается новой и разбирается в следующем опросе
+            logger.error(f"⚠️ Ошибка при обработке строки #{row['index'] + 1}: {e}")
+
+    if tracker is not None:
+        tracker.stage(done)
+    logger.info(f"✅ Всего уникальных tooltip'ов: {len(tooltips)}")
+    return parsed_results, tooltips
+
+async def collect_tooltips_observer(page, chain: str, tracker=None):
+    """
+    Сбор tooltip'ов синтетическими событиями и MutationObserver
+
+    Один evaluate снимает строки, второй наводит и возвращает все
+    tooltip'ы разом, без реального движения мыши и фиксированных пауз.
+    С tracker наводятся только новые строки, а обработанными считаются
+    строки без наведения и те, чей tooltip собран: риск привязан к индексу
+    строки, именной tooltip содержит адрес. Остальные наводятся в следующем
+    опросе. Возвращает (parsed_results, tooltips).
+    """
+    parsed_results = []
+    tooltips = set()
+
+    rows = await page.evaluate(EXTRACT_ROWS_SCRIPT, [WRAPPER_SELECTOR, RISK_ICON_SELECTOR])
+    pending = tracker.new_rows(rows, chain) if tracker is not None else rows
+    risk_indices = [row['index'] for row in pending if row['hasRisk']]
+    name_indices = [
+        row['index'] for row in pending
+        if not row['hasRisk'] and row['href'] and not is_valid_address(row['text'], chain)
+    ]
+    logger.info(f"🔍 Найдено {len(rows)} строк, с риском: {len(risk_indices)}, с именем: {len(name_indices)}")
+
+    harvested = await page.evaluate(HARVEST_TOOLTIPS_SCRIPT, {
+        'wrapperSelector': WRAPPER_SELECTOR,
+        'riskSelector': RISK_ICON_SELECTOR,
+        'riskTooltipSelector': RISK_TOOLTIP_SELECTOR,
+        'nameTooltipSelector': NAME_TOOLTIP_SELECTOR,
+        'riskIndices': risk_indices,
+        'nameIndices': name_indices,
+        'batchSize': OBSERVER_BATCH_SIZE,
+        'settleMs': OBSERVER_SETTLE_MS,
+        'maxWaitMs': OBSERVER_MAX_WAIT_MS
+    })
+    TOOLTIPS_HOVERED.inc(len(risk_indices) + len(name_indices), source=chain)
+    TOOLTIPS_FOUND.inc(len(harvested), source=chain)
+
+    for item in harvested:
+        if item['kind'] == 'risk':
+            logger.debug(f"🔴 Тултип риска #{item['index'] + 1}: {item['text']}")
+            href = rows[item['index']]['href']
+            name = parse_risk_name(item['text'])
+            if name and href:
+                address = href.split('/')[-1]
+                parsed_results.append({
+                    "type": name,  # Используем имя как тип
+                    "name": name,  # И как имя
+                    "address": address
+                })
+                logger.debug(f"✅ Добавлен риск: {name} для адреса {address}")
+        else:
+            logger.debug(f"🟡 Tooltip: {item['text']}")
+            tooltips.add(item['text'])
+
+    if tracker is not None:
+        hovered = set(risk_indices) | set(name_indices)
+        done = {row['index'] for row in pending if row['index'] not in hovered}
+        done.update(item['index'] for item in harvested if item['kind'] == 'risk')
+        texts = [text.lower() for text in tooltips]
+        for index in name_indices:
+            address = rows[index]['href'].split('/')[-1].lower()
+            if any(address in text for text in texts):
+                done.add(index)
+        tracker.stage(rows[index]['key'] for index in done)
+
+    logger.info(f"✅ Всего уникальных tooltip'ов: {len(tooltips)}")
+    return parsed_results, tooltips
+
+async def collect_records_response(page, chain: str, capture):
+    """
+    Записи из перехваченных JSON-ответов страницы, без DOM и наведения
+
+    Под шаблон попадают и другие запросы API, поэтому ответы собираются,
+    пока среди них нет записей с метками (до RESPONSE_WAIT_MS), а после
+    первых записей - пока ответы идут чаще RESPONSE_QUIET_MS. Если записей
+    так и не нашлось, откатываемся на режим evaluate.
+    Возвращает (parsed_results, tooltips).
+    """
+    deadline = time.monotonic() + RESPONSE_WAIT_MS / 1000
+    payloads = 0
+    parsed_results = []
+    while True:
+        remaining = deadline - time.monotonic()
+        timeout = min(remaining, RESPONSE_QUIET_MS / 1000) if parsed_results else remaining
+        if timeout <= 0 or not await capture.wait(timeout):
+            break
+        for payload in await capture.drain():
+            payloads += 1
+            parsed_results.extend(extract_labels(payload, chain))
+
+    if not parsed_results:
+        logger.warning(f"⚠️ В {payloads} перехваченных ответах нет меток, используем режим evaluate")
+        await waits.selector(page, 'rows', WRAPPER_SELECTOR)
+        return await collect_tooltips_evaluate(page, chain)
+    logger.info(f"📡 Перехвачено ответов: {payloads}, записей с метками: {len(parsed_results)}")
+    return parsed_results, set()
+
+def chain_settings(spec: str):
+    """Настройки опроса сети или сеть/путь: адрес страницы и свой интервал опроса"""
+    chain, _, path = spec.partition('/')
+    return {
+        'chain': chain,
+        'url': f"{OKLINK_BASE_URL}/{chain}/{path or 'tx-list'}",
+        'poll_interval': float(os.getenv(f"POLL_INTERVAL_{chain.upper()}", os.getenv('POLL_INTERVAL', '1')))
+    }
+
+def needs_reload(tracker, loaded_at):
+    """Нужен ли goto: без инкрементального режима - на каждой итерации"""
+    if tracker is None or loaded_at is None or INCREMENTAL_REFRESH == 'reload':
+        return True
+    return time.monotonic() - loaded_at >= INCREMENTAL_RELOAD_SECONDS
+
+async def refresh_rows(page, head, timeout):
+    """
+    Ждет новые строки без перезагрузки страницы: в режиме click сначала
+    кликает INCREMENTAL_REFRESH_SELECTOR, чтобы страница перезапросила таблицу.
+    Возвращает False, если первая строка за timeout секунд не сменилась.
+    """
+    if INCREMENTAL_REFRESH == 'click':
+        await page.click(INCREMENTAL_REFRESH_SELECTOR)
+    try:
+        await page.wait_for_function(WAIT_ROWS_CHANGED_SCRIPT, arg=[WRAPPER_SELECTOR, head], timeout=timeout * 1000)
+    except PlaywrightTimeoutError:
+        return False
+    return True
+
+async def poll_chain(lifecycle, settings, writer, seen_filter, attempts: int, sink=None, iterations=None):
+    """Опрос tx-list одной сети в своем контексте браузера: бесконечно или iterations итераций"""
+    chain = settings['chain']
+    url = settings['url']
+    # Страница пересоздается после ошибок и по политике lifecycle
+    slot = AsyncPageSlot(lifecycle, chain)
+    capture = None
+    iteration = 0
+    # Обработанные строки между итерациями и время последнего goto
+    tracker = RowTracker(ROW_TRACKER_SIZE) if POLL_INCREMENTAL and extract_mode in ('evaluate', 'observer') else None
+    loaded_at = None
+
+    async def setup(context):
+        if HAR_FILE:
+            await replay_har(context, HAR_FILE)
+
+    while iterations is None or iteration < iterations:
+        iteration += 1
+        try:
+            logger.info(f"🔄 [{chain}] Начинаем новую итерацию сбора данных")
+            page_started = time.monotonic()
+
+            # Плановая замена: браузер сменился, много переходов или разрослась куча
+            if slot.is_open():
+                reason = await slot.recycle_reason()
+                if reason:
+                    logger.info(f"♻️ [{chain}] Пересоздаем страницу ({reason}) после {slot.navigations} переходов")
+                    await slot.close(reason)
+
+            # Создаем новый контекст и страницу, если нужно
+            if not slot.is_open():
+                logger.info(f"🌟 [{chain}] Создаем новую страницу браузера")
+                await slot.close()
+                page = await slot.open(setup)
+                context, traffic = slot.context, slot.traffic
+                capture = ResponseCapture(page, RESPONSE_URL_PATTERN) if extract_mode == 'response' else None
+                loaded_at = None
+
+            # Устанавливаем таймаут для операций
+            page.set_default_timeout(30000)  # 30 секунд на операции (вместо 60)
+
+            if needs_reload(tracker, loaded_at):
+                # Переходим на страницу и ждем появления строк таблицы,
+                # а не тишины в сети
+                if capture:
+                    capture.clear()
+                with STEP_SECONDS.time(step='goto'):
+                    await page.goto(url, wait_until='domcontentloaded', timeout=30000)
+                slot.navigated()
+                loaded_at = time.monotonic()
+                if extract_mode != 'response':
+                    await waits.selector(page, 'rows', WRAPPER_SELECTOR)
+                logger.info(f"✅ [{chain}] Страница загружена успешно")
+            else:
+                # Страница остается открытой: ждем новых строк вместо паузы
+                if not await refresh_rows(page, tracker.head, settings['poll_interval']):
+                    logger.debug(f"[{chain}] Новых транзакций нет")
+                    ITERATIONS.inc(source=chain)
+                    continue
+                page_started = time.monotonic()
+
+            if extract_mode == 'response':
+                parsed_results, tooltips = await collect_records_response(page, chain, capture)
+            elif extract_mode == 'legacy':
+                parsed_results, tooltips, page = await collect_tooltips_legacy(page, context, url, chain, attempts)
+                slot.page = page
+            elif extract_mode == 'observer':
+                parsed_results, tooltips = await collect_tooltips_observer(page, chain, tracker)
+            else:
+                parsed_results, tooltips = await collect_tooltips_evaluate(page, chain, tracker)
+            if tooltip_corpus:
+                tooltip_corpus.write_batch([{'chain': chain, 'kind': 'name', 'text': text} for text in tooltips])
+            parsed_results.extend(parse_tooltips(tooltips, chain))
+            PAGES.inc(source=chain)
+            ITERATIONS.inc(source=chain)
+            RECORDS.inc(len(parsed_results), source=chain)
+            PAGE_SECONDS.observe(time.monotonic() - page_started, source=chain)
+
+            logger.info(f"\n🔎 [{chain}] Распознано адресов с именами: {len(parsed_results)}")
+            batch = []
+            for item in parsed_results:
+                logger.debug(f"🔹 Type: {item['type']}, Name: {item['name']}, Address: {item['address']}")
+                batch.append({
+                    'address': item['address'],
+                    'name': item['name'],
+                    'tag': item['type'],
+                    'chain': chain
+                })
+
+            # Неизменившиеся записи в базу не пишем
+            new_batch = seen_filter.filter_new(batch)
+            stats = seen_filter.stats()
+            logger.info(
+                f"🧮 [{chain}] Новых записей: {len(new_batch)} из {len(batch)} "
+                f"(hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.1%})"
+            )
+
+            # Отдаем итерацию фоновой записи и сразу идем дальше; при падении
+            # БД записи уходят в spill-файл, поэтому помечаем их сразу
+            if new_batch:
+                await writer.put_async(new_batch)
+                seen_filter.mark(new_batch)
+                if sink:
+                    sink.write_batch(new_batch)
+                logger.info(f"✅ [{chain}] В очередь записи: {len(new_batch)}, ожидает: {writer.pending()}")
+
+            # Записи строк уже в очереди, теперь строки можно считать обработанными
+            if tracker is not None:
+                tracker.commit()
+
+            logger.info(f"⏱️ Ожидания: {waits.summary()}")
+            logger.info(f"📶 [{chain}] Трафик за итерацию: {traffic.summary()}")
+
+            # Пауза между итерациями; в режиме live паузой служит ожидание новых строк
+            if tracker is None or INCREMENTAL_REFRESH != 'live':
+                logger.info(f"💤 [{chain}] Пауза {settings['poll_interval']} с перед следующей итерацией...")
+                await asyncio.sleep(settings['poll_interval'])
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ [{chain}] Критическая ошибка в основном цикле: {e}")
+
+            # Закрываем контекст вместе со страницей, чтобы создать новые в следующей итерации
+            await slot.close()
+            capture = None
+            if tracker is not None:
+                tracker.discard()
+
+            logger.info(f"💤 [{chain}] Пауза 10 секунд перед повторной попыткой...")
+            await asyncio.sleep(10)
+
+    await slot.close()
+
+async def scrape_tooltips(chains, attempts: int = 5, repository=None, iterations=None):
+    """
+    Опрашивает несколько сетей из одного процесса: задача на сеть, общий браузер и пул БД
+
+    repository подменяет AsyncAddressRepository (Postgres не нужен),
+    iterations ограничивает число итераций на сеть; оба нужны benchmark.py.
+    """
+    db = None
+    if repository is None:
+        # Инициализация базы данных: asyncpg, чтобы запросы не блокировали event loop
+        db = await AsyncDatabase(DB_CONFIG).connect()
+        await db.init_tables()
+        tag_cache = AsyncTagCache(db, ttl=int(os.getenv('TAG_CACHE_TTL', '300')))
+        try:
+            await tag_cache.listen()
+        except Exception as e:
+            logger.warning(f"⚠️ LISTEN недоступен, TagCache обновляется только по TTL: {e}")
+        repository = AsyncAddressRepository(db, tag_cache)
+    # Запись идет отдельной задачей пачками, опрос страниц ее не ждет
+    writer = AsyncWriteBehindQueue(
+        repository,
+        os.path.join(os.getenv('DATA_DIR', 'data'), os.getenv('SPILL_FILE', 'write_spill.jsonl')),
+        max_size=int(os.getenv('WRITE_QUEUE_SIZE', '10000')),
+        batch_size=int(os.getenv('WRITE_BATCH_SIZE', '500')),
+        flush_interval=float(os.getenv('WRITE_FLUSH_INTERVAL', '1')),
+        retry_interval=float(os.getenv('WRITE_RETRY_INTERVAL', '30'))
+    ).start()
+    # Копия новых записей в JSONL, если задан JSONL_DIR
+    sink = sink_from_env('oklink')
+    
+    # Недавно сохраненные записи живут между итерациями; сеть входит в ключ,
+    # поэтому фильтр общий для всех сетей
+    seen_filter = SeenFilter(
+        capacity=int(os.getenv('SEEN_CACHE_SIZE', '100000')),
+        use_bloom=os.getenv('SEEN_BLOOM', 'false').lower() == 'true'
+    )
+    
+    try:
+        async with async_playwright() as p:
+            # Общий браузер с плановой заменой страниц и самого браузера
+            lifecycle = await AsyncBrowserLifecycle(p, browser_factory).start()
+            try:
+                logger.info(f"🌐 Опрашиваем сети: {', '.join(chains)}")
+                await asyncio.gather(*(
+                    poll_chain(lifecycle, chain_settings(chain), writer, seen_filter, attempts, sink, iterations)
+                    for chain in chains
+                ))
+            finally:
+                await lifecycle.close()
+    finally:
+        # Дописываем очередь перед выходом или перезапуском
+        await writer.close()
+        if sink:
+            sink.close()
+        if tooltip_corpus:
+            tooltip_corpus.close()
+        if db is not None:
+            await tag_cache.close()
+            await db.close()
+
+async def scrape_until_terminated(chains, attempts: int = 5):
+    """scrape_tooltips, который по SIGTERM (остановка супервизором) отменяется и дописывает очередь записи"""
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        await scrape_tooltips(chains, attempts)
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
 
 # Запуск скрипта
 if __name__ == "__main__":
+    # /metrics и сводка в логе живут дольше перезапусков scrape_tooltips
+    start_from_env()
     while True:
         try:
-            asyncio.run(scrape_tooltips(url, attempts=3))
+            asyncio.run(scrape_until_terminated(blockchains, attempts=3))
+        except asyncio.CancelledError:
+            logger.info("🛑 Получен SIGTERM, очередь записи дописана, завершаем работу")
+            break
         except Exception as e:
             logger.critical(f"🔥 Критическая ошибка вне основного цикла: {e}")
             logger.info("💤 Перезапуск скрипта через 30 секунд...")
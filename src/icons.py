@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import aiohttp
+
+
+class IconFetcher:
+    """
+    Фоновая загрузка иконок с дедупликацией и контентной адресацией
+
+    Работает в собственном потоке со своим event loop и общим пулом
+    соединений aiohttp, поэтому submit() можно вызывать и из синхронного
+    парсера, и из async-пула, не блокируя обход страниц. Один URL качается
+    один раз, одинаковое содержимое хранится один раз в таблице icons по
+    SHA-256, адрес ссылается на него через addresses.icon_sha256.
+    Запись в БД идет пачками раз в flush_interval секунд.
+    """
+    def __init__(self, repository, concurrency=8, max_pending=1000, max_size=1_000_000,
+                 timeout=15, flush_interval=1.0, link_attempts=30):
+        self.repository = repository
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_size = max_size
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.link_attempts = link_attempts
+        self.logger = logging.getLogger(__name__)
+
+        self._url_hashes = {}     # url -> sha256 уже сохраненных иконок
+        self._known_hashes = set()
+        self._waiters = {}        # url -> (chain, address), ждущие загрузки
+        self._new_icons = []      # (sha256, data, content_type, url) к записи
+        self._new_urls = []       # (url, sha256) для уже известного содержимого
+        self._links = []          # (chain, address, sha256, попытка)
+        self.stats = {'downloaded': 0, 'url_hits': 0, 'content_hits': 0, 'dropped': 0, 'failed': 0}
+
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._stopping = None
+
+    def start(self):
+        self._url_hashes = self.repository.get_icon_urls()
+        self._known_hashes = set(self._url_hashes.values())
+        self.logger.info(f"Известных иконок: {len(self._known_hashes)}, URL: {len(self._url_hashes)}")
+        self._thread = threading.Thread(target=self._run, name='icon-fetcher', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def known_hash(self, url):
+        """SHA-256 уже сохраненной иконки по URL или None"""
+        return self._url_hashes.get(url)
+
+    def submit(self, address, url, chain=None):
+        """Ставит иконку адреса в очередь загрузки; не блокирует вызывающего"""
+        self.loop.call_soon_threadsafe(self._enqueue, (chain, address), url)
+
+    def close(self, timeout=60):
+        """Дожидается начатых загрузок, записывает остаток и останавливает поток"""
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join(timeout)
+        self._thread = None
+        self.logger.info(f"Загрузчик иконок остановлен: {self.stats}")
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as session:
+            self.session = session
+            self._ready.set()
+            while not self._stopping.is_set():
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._flush()
+
+    def _enqueue(self, key, url):
+        sha256 = self._url_hashes.get(url)
+        if sha256:
+            self.stats['url_hits'] += 1
+            self._links.append((*key, sha256, 0))
+            return
+        if url in self._waiters:
+            self._waiters[url].append(key)
+            self.stats['url_hits'] += 1
+            return
+        if len(self._waiters) >= self.max_pending:
+            # Иконка подтянется при следующем обходе
+            self.stats['dropped'] += 1
+            return
+        self._waiters[url] = [key]
+        task = asyncio.ensure_future(self._download(url))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _download(self, url):
+        try:
+            async with self._semaphore:
+                async with self.session.get(url) as response:
+                    if response.status != 200:
+                        raise ValueError(f"HTTP {response.status}")
+                    if response.content_length and response.content_length > self.max_size:
+                        raise ValueError(f"Иконка слишком большая: {response.content_length} bytes")
+                    chunks = []
+                    size = 0
+                    async for chunk in response.content.iter_chunked(65536):
+                        size += len(chunk)
+                        if size > self.max_size:
+                            raise ValueError(f"Иконка слишком большая: больше {self.max_size} bytes")
+                        chunks.append(chunk)
+                    data = b''.join(chunks)
+                    content_type = response.headers.get('Content-Type')
+        except Exception as e:
+            self.stats['failed'] += 1
+            self.logger.warning(f"Ошибка при получении иконки {url}: {e}")
+            self._waiters.pop(url, None)
+            return
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.stats['downloaded'] += 1
+        if sha256 in self._known_hashes:
+            self.stats['content_hits'] += 1
+            self._new_urls.append((url, sha256))
+        else:
+            self._known_hashes.add(sha256)
+            self._new_icons.append((sha256, data, content_type, url))
+        self._url_hashes[url] = sha256
+        for key in self._waiters.pop(url, []):
+            self._links.append((*key, sha256, 0))
+
+    def _flush(self):
+        if not (self._new_icons or self._new_urls or self._links):
+            return
+        icons, self._new_icons = self._new_icons, []
+        urls, self._new_urls = self._new_urls, []
+        links, self._links = self._links, []
+        try:
+            linked = self.repository.save_icons(icons, urls, [link[:3] for link in links])
+        except Exception as e:
+            self.logger.error(f"Ошибка сохранения иконок: {e}")
+            self._new_icons = icons + self._new_icons
+            self._new_urls = urls + self._new_urls
+            self._links = links + self._links
+            return
+        # Адрес мог еще не попасть в addresses: страница сохраняется после
+        # разбора всех строк, поэтому несвязанные ссылки повторяем позже
+        for chain, address, sha256, attempt in links:
+            if (chain, address) not in linked and attempt + 1 < self.link_attempts:
+                self._links.append((chain, address, sha256, attempt + 1))
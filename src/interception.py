@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Ключи, под которыми в JSON лежат адреса, и суффиксы соседних ключей с метками:
+# {"from": "0x..", "fromTag": "Exchange: Binance 14"}
+ADDRESS_KEYS = ('address', 'from', 'to', 'fromAddress', 'toAddress', 'contractAddress')
+LABEL_SUFFIXES = ('Tag', 'Label', 'Name', 'EntityTag', 'Tags')
+# Для ключа address метки лежат в ключах без префикса
+PLAIN_LABEL_KEYS = ('tag', 'label', 'name', 'entityTag', 'tags')
+
+EVM_ADDRESS_RE = re.compile(r'^0x[a-fA-F0-9]{40}$')
+TRON_ADDRESS_RE = re.compile(r'^T[1-9A-HJ-NP-Za-km-z]{33}$')
+
+
+def is_full_address(value, chain):
+    if not isinstance(value, str):
+        return False
+    if chain.lower() == 'tron':
+        return bool(TRON_ADDRESS_RE.match(value))
+    return bool(EVM_ADDRESS_RE.match(value))
+
+
+def _label_values(value):
+    """Метки из строки, списка строк или словаря {tag/name/type}"""
+    if isinstance(value, str):
+        if value.strip():
+            yield None, value.strip()
+    elif isinstance(value, list):
+        for item in value:
+            yield from _label_values(item)
+    elif isinstance(value, dict):
+        name = value.get('name') or value.get('tag') or value.get('label')
+        if isinstance(name, str) and name.strip():
+            label_type = value.get('type') or value.get('category')
+            yield label_type if isinstance(label_type, str) else None, name.strip()
+
+
+def _to_record(address, label_type, label):
+    # Формат меток тот же, что у tooltip'ов: "Type: Name" или просто "Name"
+    if label_type is None and ': ' in label:
+        label_type, label = label.split(': ', 1)
+    return {
+        "type": label_type or "other",
+        "name": label,
+        "address": address
+    }
+
+
+def extract_labels(payload, chain):
+    """
+    Записи type/name/address из произвольного JSON-ответа
+
+    Обходит структуру целиком и для каждого ключа с адресом ищет метку в
+    соседних ключах (fromTag, toLabel, ...). Адреса без меток пропускаются.
+    """
+    records = {}
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+        for key in ADDRESS_KEYS:
+            address = node.get(key)
+            if not is_full_address(address, chain):
+                continue
+            label_keys = PLAIN_LABEL_KEYS if key == 'address' else [key + suffix for suffix in LABEL_SUFFIXES]
+            for label_key in label_keys:
+                for label_type, label in _label_values(node.get(label_key)):
+                    if label != address:
+                        records[(address, label)] = _to_record(address, label_type, label)
+    return list(records.values())
+
+
+def payloads_from_har(path, url_pattern):
+    """JSON-ответы из записанного HAR-файла для офлайн-разбора и проверки"""
+    pattern = re.compile(url_pattern)
+    with open(path, 'r', encoding='utf-8') as f:
+        har = json.load(f)
+    payloads = []
+    for entry in har['log']['entries']:
+        if not pattern.search(entry['request']['url']):
+            continue
+        content = entry['response'].get('content', {})
+        if 'json' not in (content.get('mimeType') or ''):
+            continue
+        text = content.get('text')
+        if not text:
+            continue
+        if content.get('encoding') == 'base64':
+            text = base64.b64decode(text).decode('utf-8')
+        try:
+            payloads.append(json.loads(text))
+        except json.JSONDecodeError:
+            continue
+    return payloads
+
+
+async def replay_har(context, har_path, url_pattern=None):
+    """Подменяет сеть контекста записанным HAR (офлайн-прогон на фикстурах)"""
+    await context.route_from_har(har_path, url=url_pattern, not_found='abort')
+
+
+class ResponseCapture:
+    """Собирает JSON-ответы страницы, чьи URL подходят под url_pattern"""
+    def __init__(self, page, url_pattern):
+        self.pattern = re.compile(url_pattern)
+        self._responses = []
+        self._event = asyncio.Event()
+        page.on('response', self._on_response)
+
+    def _on_response(self, response):
+        if not self.pattern.search(response.url):
+            return
+        if 'json' not in (response.headers.get('content-type') or ''):
+            return
+        self._responses.append(response)
+        self._event.set()
+
+    def clear(self):
+        self._responses = []
+        self._event.clear()
+
+    async def wait(self, timeout):
+        """Ждет хотя бы один подходящий ответ; False по таймауту"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def drain(self):
+        """Разобранные JSON-ответы, накопленные с последнего drain"""
+        responses, self._responses = self._responses, []
+        self._event.clear()
+        payloads = []
+        for response in responses:
+            try:
+                payloads.append(await response.json())
+            except Exception as e:
+                logger.debug(f"Не удалось разобрать ответ {response.url}: {e}")
+        return payloads
@@ -0,0 +1,165 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+READ_CHUNK = 64 * 1024
+# Так обрывается недописанный (незакрытый или оборванный) поток сжатия
+TRUNCATED_ERRORS = (EOFError, OSError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class JsonlSink:
+    """
+    Append-only JSONL-выход парсеров с ротацией
+
+    Пачка дописывается строками в текущий файл, поэтому стоимость записи
+    пропорциональна пачке, а не всему файлу. Файлы называются
+    {prefix}-{время открытия}{расширение}, новый открывается по достижении
+    rotate_bytes (сжатых) или rotate_seconds. fsync не чаще раза в
+    fsync_interval секунд и при закрытии файла.
+    """
+    def __init__(self, directory, prefix, compress=None, fsync_interval=5.0,
+                 rotate_bytes=100 * 1024 * 1024, rotate_seconds=3600):
+        if compress not in EXTENSIONS:
+            raise ValueError(f"Неизвестное сжатие: {compress}")
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError("Для сжатия zstd нужен пакет zstandard")
+        self.directory = directory
+        self.prefix = prefix
+        self.compress = compress
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.logger = logging.getLogger(__name__)
+        self.path = None
+        self._raw = None
+        self._stream = None
+        self._opened_at = 0
+        self._synced_at = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(self.directory, f"{self.prefix}-{stamp}{EXTENSIONS[self.compress]}")
+        self._raw = open(self.path, 'ab')
+        if self.compress == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        elif self.compress == 'zstd':
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._opened_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        if self._stream is not self._raw:
+            # Сбрасываем блок компрессора, чтобы уже записанное читалось после падения
+            if self.compress == 'zstd':
+                self._stream.flush(zstandard.FLUSH_BLOCK)
+            else:
+                self._stream.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._synced_at = time.monotonic()
+
+    def _close_file(self):
+        if self._raw is None:
+            return
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = self._stream = None
+
+    def write_batch(self, records):
+        if not records:
+            return
+        now = time.monotonic()
+        if self._raw is not None and (
+            self._raw.tell() >= self.rotate_bytes or now - self._opened_at >= self.rotate_seconds
+        ):
+            self._close_file()
+            self.logger.info(f"JSONL-файл закрыт: {self.path}")
+        if self._raw is None:
+            self._open()
+        data = ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records)
+        self._stream.write(data.encode('utf-8'))
+        if time.monotonic() - self._synced_at >= self.fsync_interval:
+            self._sync()
+
+    def close(self):
+        self._close_file()
+
+
+def _read_lines(path, stream):
+    """
+    Полные строки файла до места обрыва
+
+    Читаем кусками и режем на строки сами: TextIOWrapper при обрыве сжатого
+    потока теряет весь уже распакованный буфер, а не только хвост.
+    """
+    tail = b''
+    while True:
+        try:
+            chunk = stream.read1(READ_CHUNK) if hasattr(stream, 'read1') else stream.read(READ_CHUNK)
+        except TRUNCATED_ERRORS as e:
+            logging.warning(f"{path} обрывается: {e}")
+            break
+        if not chunk:
+            break
+        *lines, tail = (tail + chunk).split(b'\n')
+        yield from lines
+    if tail:
+        logging.warning(f"Пропущена недописанная строка в {path}: {tail[:80]!r}")
+
+
+def read_records(directory, prefix):
+    """
+    Лениво отдает записи из всех файлов prefix-* в directory по порядку
+
+    Оборванная последняя строка (падение до fsync) пропускается, записи до
+    нее отдаются и из незакрытых сжатых файлов.
+    """
+    paths = sorted(
+        path for extension in EXTENSIONS.values()
+        for path in glob.glob(os.path.join(directory, f"{prefix}-*{extension}"))
+    )
+    for path in paths:
+        if path.endswith('.gz'):
+            stream = gzip.open(path, 'rb')
+        elif path.endswith('.zst'):
+            if zstandard is None:
+                raise ValueError(f"Для чтения {path} нужен пакет zstandard")
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        else:
+            stream = open(path, 'rb')
+        with stream:
+            for line in _read_lines(path, stream):
+                try:
+                    yield json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logging.warning(f"Пропущена битая строка в {path}: {line[:80]!r}")
+
+
+def sink_from_env(prefix):
+    """JsonlSink по JSONL_* переменным окружения или None, если JSONL_DIR не задан"""
+    directory = os.getenv('JSONL_DIR')
+    if not directory:
+        return None
+    return JsonlSink(
+        directory,
+        prefix,
+        compress=os.getenv('JSONL_COMPRESS') or None,
+        fsync_interval=float(os.getenv('JSONL_FSYNC_INTERVAL', '5')),
+        rotate_bytes=int(float(os.getenv('JSONL_ROTATE_MB', '100')) * 1024 * 1024),
+        rotate_seconds=float(os.getenv('JSONL_ROTATE_MINUTES', '60')) * 60
+    )
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from db.models import Database
+from address_keys import address_key
+
+# Адреса с тегами: новые строки addresses по id и адреса с новыми связями по created_at
+ADDRESSES_QUERY = """
+    SELECT a.id, a.chain, a.address, a.name,
+           COALESCE(array_agg(t.tag_oklink) FILTER (WHERE t.id IS NOT NULL), '{}')
+    FROM addresses a
+    LEFT JOIN address_tags at ON at.address_id = a.id
+    LEFT JOIN tags t ON t.id = at.tag_id
+    WHERE a.id > %s OR a.id IN (SELECT address_id FROM address_tags WHERE created_at >= %s)
+    GROUP BY a.id
+"""
+UNIFIED_QUERY = """
+    SELECT id, chain, address, type, address_name
+    FROM unified_addresses
+    WHERE id > %s
+"""
+
+
+class LabelIndex:
+    """
+    Метки адресов в памяти: 20-байтовый ключ -> кортеж записей по сетям
+
+    Запись - кортеж (chain, name, type, tags), строки интернированы, чтобы
+    повторяющиеся сети, типы и теги хранились в одном экземпляре.
+
+    id и created_at выдаются до коммита, поэтому строка длинной транзакции
+    может появиться уже позади водяного знака. Инкрементальная загрузка
+    перечитывает последние id_overlap id и time_overlap по created_at;
+    повторно прочитанные строки сливаются с уже загруженными.
+    """
+    def __init__(self, id_overlap=1000, time_overlap=timedelta(minutes=5)):
+        self.id_overlap = id_overlap
+        self.time_overlap = time_overlap
+        self._labels = {}
+        self.address_watermark = 0
+        self.link_watermark = datetime.min
+        self.unified_watermark = 0
+
+    def __len__(self):
+        return len(self._labels)
+
+    def _update(self, key, chain, name=None, label_type=None, tags=None):
+        """Сливает запись с загруженной; False, если ничего не изменилось"""
+        entries = self._labels.get(key, ())
+        for i, entry in enumerate(entries):
+            if entry[0] == chain:
+                merged = (
+                    chain,
+                    name if name is not None else entry[1],
+                    label_type if label_type is not None else entry[2],
+                    tags if tags is not None else entry[3]
+                )
+                if merged == entry:
+                    return False
+                self._labels[key] = entries[:i] + (merged,) + entries[i + 1:]
+                return True
+        self._labels[key] = entries + ((chain, name, label_type, tags or ()),)
+        return True
+
+    def _since(self):
+        """Границы перечитывания с запасом назад от водяных знаков"""
+        address_id = max(0, self.address_watermark - self.id_overlap)
+        unified_id = max(0, self.unified_watermark - self.id_overlap)
+        link_time = self.link_watermark
+        if link_time - datetime.min > self.time_overlap:
+            link_time -= self.time_overlap
+        return address_id, link_time, unified_id
+
+    def load(self, cur):
+        """Дочитывает изменения после водяных знаков; возвращает число измененных записей"""
+        intern = sys.intern
+        updated = 0
+        address_since, link_since, unified_since = self._since()
+
+        cur.execute("SELECT COALESCE(max(id), 0) FROM addresses")
+        address_watermark = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(max(created_at), %s) FROM address_tags", (self.link_watermark,))
+        link_watermark = cur.fetchone()[0]
+        cur.execute(ADDRESSES_QUERY, (address_since, link_since))
+        for _, chain, address, name, tags in cur:
+            key = address_key(address)
+            if key is None:
+                continue
+            updated += self._update(
+                key,
+                intern(chain),
+                name=name,
+                tags=tuple(sorted(intern(tag) for tag in tags))
+            )
+        self.address_watermark = max(self.address_watermark, address_watermark)
+        self.link_watermark = max(self.link_watermark, link_watermark)
+
+        cur.execute(UNIFIED_QUERY, (unified_since,))
+        for row_id, chain, address, label_type, address_name in cur:
+            key = address_key(address)
+            self.unified_watermark = max(self.unified_watermark, row_id)
+            if key is None:
+                continue
+            updated += self._update(key, intern(chain), name=address_name, label_type=intern(label_type))
+        return updated
+
+    def lookup(self, address, chain=None):
+        key = address_key(address)
+        if key is None:
+            return []
+        return [
+            {'chain': entry[0], 'name': entry[1], 'type': entry[2], 'tags': list(entry[3])}
+            for entry in self._labels.get(key, ())
+            if chain is None or entry[0] == chain
+        ]
+
+    def lookup_many(self, addresses, chain=None):
+        return {address: self.lookup(address, chain) for address in addresses}
+
+
+class LabelService:
+    """
+    Держит LabelIndex в памяти и обновляет его в фоне
+
+    Раз в refresh_interval секунд дочитываются новые строки по водяным
+    знакам (id и created_at) с запасом назад (см. LabelIndex). Изменения
+    уже загруженных строк (upsert имени или типа) водяной знак не
+    сдвигают, поэтому раз в full_refresh_interval индекс строится заново
+    и подменяется целиком.
+    """
+    def __init__(self, db, refresh_interval=30, full_refresh_interval=3600, id_overlap=1000, time_overlap=300):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.id_overlap = id_overlap
+        self.time_overlap = timedelta(seconds=time_overlap)
+        self.index = self._new_index()
+        self.logger = logging.getLogger(__name__)
+        self.stats = {'refreshes': 0, 'last_refresh_ms': None, 'last_updated': 0, 'lookups': 0}
+        self._full_at = None
+        self._stopping = threading.Event()
+
+    def refresh(self):
+        full = self._full_at is None or time.monotonic() - self._full_at >= self.full_refresh_interval
+        index = self._new_index() if full else self.index
+        started = time.monotonic()
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                updated = index.load(cur)
+            conn.rollback()
+        if full:
+            self.index = index
+            self._full_at = time.monotonic()
+        self.stats['refreshes'] += 1
+        self.stats['last_refresh_ms'] = round((time.monotonic() - started) * 1000, 1)
+        self.stats['last_updated'] = updated
+        if updated or full:
+            self.logger.info(
+                f"Индекс {'перестроен' if full else 'обновлен'}: записей {updated}, "
+                f"адресов {len(self.index)}, {self.stats['last_refresh_ms']} ms"
+            )
+
+    def _new_index(self):
+        return LabelIndex(id_overlap=self.id_overlap, time_overlap=self.time_overlap)
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self._run, name='label-refresh', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Продолжаем отвечать по последнему загруженному индексу
+                self.logger.error(f"Ошибка обновления индекса: {e}")
+
+    def lookup(self, address, chain=None):
+        self.stats['lookups'] += 1
+        return self.index.lookup(address, chain)
+
+    def lookup_many(self, addresses, chain=None):
+        self.stats['lookups'] += len(addresses)
+        return self.index.lookup_many(addresses, chain)
+
+
+class LabelRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /lookup?address=0x..&chain=ethereum - метки одного адреса
+    POST /lookup {"addresses": [...], "chain": null} - пачка адресов
+    GET  /health - размер индекса и статистика обновлений
+    """
+    service = None
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/lookup' and 'address' in params:
+            address = params['address'][0]
+            chain = params.get('chain', [None])[0]
+            self._send(200, {'address': address, 'labels': self.service.lookup(address, chain)})
+        elif url.path == '/health':
+            self._send(200, {'addresses': len(self.service.index), **self.service.stats})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/lookup':
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            addresses = request['addresses']
+            chain = request.get('chain')
+            # Строка вместо списка искалась бы посимвольно
+            if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+                raise TypeError('addresses must be a list of strings')
+            if chain is not None and not isinstance(chain, str):
+                raise TypeError('chain must be a string')
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send(400, {'error': f'bad request: {e}'})
+            return
+        self._send(200, {'results': self.service.lookup_many(addresses, chain)})
+
+    def log_message(self, format, *args):
+        # Запросы скрининга слишком частые для INFO
+        logging.getLogger(__name__).debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler ждет кортеж адреса клиента
+        return request, ('unix', 0)
+
+
+def serve(service, host='127.0.0.1', port=8085, socket_path=None):
+    handler = type('Handler', (LabelRequestHandler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        logging.info(f"Сервис меток слушает {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        logging.info(f"Сервис меток слушает http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database({
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    })
+    service = LabelService(
+        db,
+        refresh_interval=float(os.getenv('LABELS_REFRESH_INTERVAL', '30')),
+        full_refresh_interval=float(os.getenv('LABELS_FULL_REFRESH_INTERVAL', '3600')),
+        id_overlap=int(os.getenv('LABELS_ID_OVERLAP', '1000')),
+        time_overlap=float(os.getenv('LABELS_TIME_OVERLAP_SECONDS', '300'))
+    ).start()
+    serve(
+        service,
+        host=os.getenv('LABELS_HOST', '127.0.0.1'),
+        port=int(os.getenv('LABELS_PORT', '8085')),
+        socket_path=os.getenv('LABELS_SOCKET') or None
+    )
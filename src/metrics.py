@@ -0,0 +1,278 @@
+import bisect
+from collections import deque
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label_value(value):
+    """Значение метки для текстового формата Prometheus: \\, \" и перевод строки экранируются"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Метрика с произвольными метками: значения хранятся по кортежу (имя, значение) меток"""
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Список (суффикс имени, ключ меток, значение) для /metrics"""
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, function, **labels):
+        """Значение читается вызовом function() в момент сбора"""
+        with self._lock:
+            self._functions[_label_key(labels)] = function
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [('', key, value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Гистограмма по корзинам; с window > 0 хранит и последние window замеров как есть"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, window=0):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._recent = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Счетчики по корзинам (последняя - +Inf), сумма и количество
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+            if self.window:
+                self._recent.setdefault(key, deque(maxlen=self.window)).append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока, в том числе с await внутри"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def recent(self):
+        """Последние замеры всех серий одним списком"""
+        with self._lock:
+            return [value for values in self._recent.values() for value in values]
+
+    def _quantile(self, counts, count, q):
+        """Оценка перцентиля по корзинам: верхняя граница корзины с q-й долей замеров"""
+        if not count:
+            return None
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= q * count:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, series[0][:], series[1], series[2]) for key, series in self._values.items()]
+        result = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                result.append(('_bucket', key + (('le', le),), cumulative))
+            result.append(('_sum', key, total))
+            result.append(('_count', key, count))
+        return result
+
+
+class Registry:
+    """
+    Набор метрик процесса
+
+    render() отдает текстовый формат Prometheus, summary() - одну строку
+    для логов со скоростями счетчиков с прошлого вызова и p50/p95 гистограмм.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_totals = {}
+        self._last_summary = time.monotonic()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS, window=0):
+        return self._register(Histogram(name, documentation, buckets, window))
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        lines = []
+        for metric in self.metrics():
+            # В HELP экранируются только \\ и перевод строки
+            documentation = metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')
+            lines.append(f"# HELP {metric.name} {documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(key)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_summary, 1e-9)
+        self._last_summary = now
+        parts = []
+        for metric in self.metrics():
+            short = metric.name.removeprefix('scraper_').removesuffix('_total')
+            if metric.kind == 'histogram':
+                with metric._lock:
+                    snapshot = [(key, series[0][:], series[2]) for key, series in metric._values.items()]
+                for key, counts, count in sorted(snapshot):
+                    p50 = metric._quantile(counts, count, 0.5)
+                    p95 = metric._quantile(counts, count, 0.95)
+                    parts.append(f"{short}{_format_labels(key)} n={count} p50<={p50:g}s p95<={p95:g}s")
+                continue
+            for _, key, value in sorted(metric.samples()):
+                series = f"{short}{_format_labels(key)}"
+                if metric.kind == 'counter':
+                    rate = (value - self._last_totals.get(series, 0)) / elapsed
+                    self._last_totals[series] = value
+                    parts.append(f"{series}={value:g} ({rate:.2f}/с)")
+                else:
+                    parts.append(f"{series}={value:g}")
+        return '; '.join(parts)
+
+
+REGISTRY = Registry()
+
+PAGES = REGISTRY.counter('scraper_pages_total', 'Обработано страниц')
+ITERATIONS = REGISTRY.counter('scraper_iterations_total', 'Итерации рабочего цикла, включая опросы без новых строк')
+RECORDS = REGISTRY.counter('scraper_records_total', 'Распознано записей с метками')
+TOOLTIPS_HOVERED = REGISTRY.counter('scraper_tooltips_hovered_total', 'Наведений на строки')
+TOOLTIPS_FOUND = REGISTRY.counter('scraper_tooltips_found_total', 'Полученных tooltip-ов')
+PAGE_SECONDS = REGISTRY.histogram('scraper_page_seconds', 'Загрузка и разбор страницы до очереди записи', window=1000)
+STEP_SECONDS = REGISTRY.histogram('scraper_step_seconds', 'Длительность goto, hover и ожиданий')
+DB_BATCH_SECONDS = REGISTRY.histogram('scraper_db_batch_seconds', 'Длительность записи пачки в БД')
+QUEUE_DEPTH = REGISTRY.gauge('scraper_write_queue_depth', 'Записей в очереди записи')
+DEDUP = REGISTRY.counter('scraper_dedup_total', 'Проверки SeenFilter по результату')
+ROWS = REGISTRY.counter('scraper_rows_total', 'Строки tx-list: новые и уже обработанные в прошлых опросах')
+BROWSER_RESTARTS = REGISTRY.counter('scraper_browser_restarts_total', 'Запуски браузера и пересоздания страниц')
+BROWSER_RECYCLES = REGISTRY.counter('scraper_browser_recycles_total', 'Плановые замены страниц и браузера по причине')
+BROWSER_RSS = REGISTRY.gauge('scraper_browser_rss_bytes', 'RSS процессов браузера и драйвера Playwright')
+PAGE_HEAP = REGISTRY.gauge('scraper_page_heap_bytes', 'Куча JS страницы при последней проверке')
+WORKERS_UP = REGISTRY.gauge('scraper_workers_up', 'Запущенные воркеры супервизора')
+WORKER_RESTARTS = REGISTRY.counter('scraper_worker_restarts_total', 'Перезапуски воркеров супервизора по причине')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+
+def serve_metrics(port, host='0.0.0.0', registry=REGISTRY):
+    """Отдает /metrics из фонового потока; возвращает сервер"""
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+def log_summary_every(interval, registry=REGISTRY):
+    """Раз в interval секунд пишет registry.summary() в лог из фонового потока"""
+    def run():
+        while True:
+            time.sleep(interval)
+            logging.getLogger(__name__).info(f"Метрики: {registry.summary()}")
+    threading.Thread(target=run, name='metrics-summary', daemon=True).start()
+
+
+def start_from_env():
+    """METRICS_PORT включает /metrics, METRICS_LOG_INTERVAL - строку сводки в логе"""
+    port = os.getenv('METRICS_PORT')
+    if port:
+        serve_metrics(int(port), host=os.getenv('METRICS_HOST', '0.0.0.0'))
+    interval = float(os.getenv('METRICS_LOG_INTERVAL', '60'))
+    if interval > 0:
+        log_summary_every(interval)
@@ -4,20 +4,33 @@ import json
 import logging
 from pathlib import Path
 import os
-import aiohttp
+import asyncio
 import base64
+import signal
+import sys
 from datetime import datetime
-from db.models import Database, AddressRepository
+from functools import partial
+from db.models import ThreadedDatabase, AddressRepository, TagCache, normalize_address
+from wait_policy import SyncWaitPolicy
+from ethplorer_pool import ADDRESS_SELECTOR, NEXT_PAGE_SELECTOR, TagCrawlPool
+from checkpoints import CheckpointStore
+from icons import IconFetcher
+from browser_factory import AsyncBrowserFactory, SyncBrowserFactory
+from write_behind import WriteBehindQueue
+from jsonl_sink import sink_from_env
+from metrics import BROWSER_RESTARTS, ITERATIONS, PAGE_SECONDS, PAGES, RECORDS, STEP_SECONDS, start_from_env
+from supervisor import in_shard, shard_from_env
 
 class EthplorerParser:
-    def __init__(self):
+    def __init__(self, repository=None):
         self.base_url = os.getenv('BASE_URL', 'https://ethplorer.io')
         self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(
-            headless=os.getenv('PLAYWRIGHT_HEADLESS', 'true').lower() == 'true'
-        )
-        self.context = self.browser.new_context()
-        self.page = self.context.new_page()
+        self.browser_factory = SyncBrowserFactory.from_env()
+        self.browser = self.browser_factory.launch(self.playwright)
+        BROWSER_RESTARTS.inc(kind='browser')
+        self.context = self.browser_factory.new_context(self.browser)
+        self.page, self.traffic = self.browser_factory.new_page(self.context)
+        self.waits = SyncWaitPolicy(defaults={'tag_rows': 10000})
         
         # Настройка логирования
         logging.basicConfig(
@@ -30,17 +43,64 @@ class EthplorerParser:
         )
         self.logger = logging.getLogger(__name__)
 
-        # Инициализация базы данных
-        db_config = {
-            'dbname': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT')
-        }
-        self.logger.info(f"Подключение к БД: {db_config}")
-        self.db = Database(db_config)
-        self.address_repository = AddressRepository(self.db)
+        if repository is None:
+            # Инициализация базы данных
+            db_config = {
+                'dbname': os.getenv('DB_NAME'),
+                'user': os.getenv('DB_USER'),
+                'password': os.getenv('DB_PASSWORD'),
+                'host': os.getenv('DB_HOST'),
+                'port': os.getenv('DB_PORT')
+            }
+            self.logger.info(f"Подключение к БД: {db_config}")
+            # Пул общий для основного потока, очереди записи и загрузчика иконок
+            self.db = ThreadedDatabase(db_config)
+            tag_cache = TagCache(self.db, ttl=int(os.getenv('TAG_CACHE_TTL', '300')))
+            try:
+                tag_cache.listen()
+            except Exception as e:
+                self.logger.warning(f"LISTEN недоступен, TagCache обновляется только по TTL: {e}")
+            self.address_repository = AddressRepository(self.db, tag_cache)
+            self.db.init_tables()
+            icon_repository = AddressRepository(self.db, tag_cache)
+        else:
+            # Готовый репозиторий без Postgres (например, RecordingRepository из benchmark.py)
+            self.db = None
+            self.address_repository = icon_repository = repository
+
+        # Иконки качаются в фоне отдельным пулом соединений,
+        # чтобы обход страниц не ждал загрузок
+        self.icon_fetcher = IconFetcher(
+            icon_repository,
+            concurrency=int(os.getenv('ICON_CONCURRENCY', '8')),
+            max_pending=int(os.getenv('ICON_MAX_PENDING', '1000'))
+        ).start()
+
+        # Чекпоинты и список оставшихся тегов для продолжения после падения
+        data_dir = os.getenv('DATA_DIR', 'data')
+
+        # Страницы пишутся в БД фоновым потоком, при недоступной БД — в spill-файл
+        self.writer = WriteBehindQueue(
+            self.address_repository,
+            os.path.join(data_dir, os.getenv('SPILL_FILE', 'write_spill.jsonl')),
+            max_size=int(os.getenv('WRITE_QUEUE_SIZE', '10000')),
+            batch_size=int(os.getenv('WRITE_BATCH_SIZE', '500')),
+            flush_interval=float(os.getenv('WRITE_FLUSH_INTERVAL', '1')),
+            retry_interval=float(os.getenv('WRITE_RETRY_INTERVAL', '30'))
+        ).start()
+        # Копия собранных страниц в JSONL, если задан JSONL_DIR
+        self.sink = sink_from_env('ethplorer')
+        self.tags_file = os.path.join(data_dir, os.getenv('TAGS_FILE', 'remaining_tags.txt'))
+        self.checkpoints = CheckpointStore(
+            os.path.join(data_dir, os.getenv('CHECKPOINT_FILE', 'crawl_checkpoints.jsonl')),
+            freshness_hours=float(os.getenv('CHECKPOINT_FRESHNESS_HOURS', '24'))
+        )
+        self.page_param = os.getenv('CRAWL_PAGE_PARAM') or None
+
+        # Инкрементальный режим: остановка тега после N страниц из одних известных адресов
+        self.incremental = os.getenv('INCREMENTAL', 'false').lower() == 'true'
+        self.incremental_stop_pages = int(os.getenv('INCREMENTAL_STOP_PAGES', '1'))
+        self.known_addresses = {}
         
 
 
@@ -65,24 +125,81 @@ class EthplorerParser:
             self.logger.error(f"Ошибка при получении тегов: {e}")
             return []
 
+    def _next_page(self):
+        """Переход на следующую страницу тега; False, если это последняя"""
+        next_button = self.page.query_selector(NEXT_PAGE_SELECTOR)
+        if not next_button:
+            return False
+        # Страница готова, когда сменился первый адрес таблицы
+        first_address = self.page.query_selector(ADDRESS_SELECTOR)
+        before = first_address.inner_text().strip() if first_address else ''
+        next_button.click()
+        self.waits.content_change(self.page, 'pagination', ADDRESS_SELECTOR, before)
+        return True
+
+    def _open_tag_page(self, tag, page_number):
+        """Открывает тег сразу на page_number: по URL, если известен параметр, иначе перелистыванием"""
+        url = f"{self.base_url}/tag/{tag}"
+        if self.page_param and page_number > 1:
+            url += f"?{self.page_param}={page_number}"
+        with STEP_SECONDS.time(step='goto'):
+            self.page.goto(url, wait_until='domcontentloaded')
+        self.waits.selector(self.page, 'tag_rows', 'tbody tr')  # Ждем загрузки таблицы
+        if self.page_param:
+            return page_number
+        current_page = 1
+        while current_page < page_number and self._next_page():
+            current_page += 1
+        return current_page
+
+    def load_remaining_tags(self):
+        """Список тегов из TAGS_FILE незавершенного обхода, иначе с сайта"""
+        try:
+            with open(self.tags_file, 'r', encoding='utf-8') as f:
+                tags = [line.strip() for line in f if line.strip()]
+            if tags:
+                self.logger.info(f"Продолжаем обход: {len(tags)} тегов из {self.tags_file}")
+                return tags
+        except FileNotFoundError:
+            pass
+        tags = self.get_tags()
+        if tags:
+            self.save_remaining_tags(tags)
+        return tags
+
+    def save_remaining_tags(self, tags):
+        """Перезаписывает TAGS_FILE списком еще не обойденных тегов"""
+        os.makedirs(os.path.dirname(self.tags_file) or '.', exist_ok=True)
+        tmp_path = f"{self.tags_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(f"{tag}\n" for tag in tags))
+        os.replace(tmp_path, self.tags_file)
+
     def get_tag_data(self, tag):
         """Получение данных по конкретному тегу"""
         processed_addresses = set()
         tag_counter = 0
-        current_page = 1
+        completed = False
+        known = self.known_addresses.get(tag, set())
+        known_pages = 0  # Подряд идущие страницы только с известными адресами
+
+        # Продолжаем с первой необработанной страницы, если тег прерывался
+        current_page = self.checkpoints.resume_page(tag)
+        saved_addresses = self.checkpoints.resume_addresses(tag)
 
         try:
             self.logger.info(f"Начинаем обработку тега: {tag}")
-            self.page.goto(f"{self.base_url}/tag/{tag}")
-            self.page.wait_for_selector('tbody tr', timeout=10000)  # Ждем загрузки таблицы
+            if current_page > 1:
+                self.logger.info(f"Продолжаем тег {tag} со страницы {current_page}")
+            page_started = time.monotonic()
+            current_page = self._open_tag_page(tag, current_page)
             
             while True:
-                # Ожидаем обновления данных после пагинации
-                self.page.wait_for_load_state("networkidle")
-                time.sleep(1)
-
                 # Получаем все блоки адресов
                 address_blocks = self.page.query_selector_all('tbody tr')
+                page_batch = []
+                page_addresses = 0
+                page_known = 0
                 
                 for block in address_blocks:
                     try:
@@ -95,6 +212,12 @@ class EthplorerParser:
                             continue
                         
                         processed_addresses.add(address)
+                        page_addresses += 1
+
+                        # Известный адрес в инкрементальном режиме не разбираем
+                        if normalize_address(address) in known:
+                            page_known += 1
+                            continue
                         
                         # Получаем контейнер тегов
                         tags_container = block.query_selector('span.tags-list')
@@ -148,40 +271,34 @@ class EthplorerParser:
                         name_element = block.query_selector('.tags-table-token a')
                         name = name_element.inner_text().strip() if name_element else ''
                         
-                        # Получаем иконку
-                        icon_data = None
+                        # Получаем иконку: известная сразу ссылается по хешу,
+                        # новая уходит в фоновый загрузчик
                         icon_url = None
+                        icon_sha256 = None
                         icon_element = block.query_selector('.tags-table-token-icon')
                         if icon_element:
                             icon_url = icon_element.get_attribute('src')
                             if icon_url:
                                 if icon_url.startswith('/'):
                                     icon_url = f"{self.base_url}{icon_url}"
-                                try:
-                                    response = self.context.request.get(icon_url)
-                                    if response.ok:
-                                        icon_data = response.body()
-                                        # Проверяем размер данных (например, до 1MB)
-                                        if len(icon_data) > 1_000_000:
-                                            self.logger.warning(f"Иконка слишком большая: {len(icon_data)} bytes")
-                                            icon_data = None
-                                except Exception as e:
-                                    self.logger.error(f"Ошибка при получении иконки {icon_url}: {e}")
+                                icon_sha256 = self.icon_fetcher.known_hash(icon_url)
+                                if not icon_sha256:
+                                    self.icon_fetcher.submit(address, icon_url)
                         
                         # Сохраняем данные в базу
                         data = {
                             'address': address,
                             'name': name,
                             'icon_url': icon_url,
-                            'icon_data': icon_data,
-                            'tags': address_tags
+                            'icon_sha256': icon_sha256,
+                            'tags': address_tags,
+                            'tag': tag  # Тег, по странице которого найден адрес
                         }
                         
-                        # Логируем без icon_data
-                        self.logger.info(f"Сохранен адрес: {address[:20]}... с тегами: {', '.join(address_tags)}")
-                        self.logger.debug(f"Данные адреса (без icon_data): {json.dumps({k:v for k,v in data.items() if k != 'icon_data'}, default=str)}")
+                        self.logger.debug(f"Подготовлен адрес: {address[:20]}... с тегами: {', '.join(address_tags)}")
+                        self.logger.debug(f"Данные адреса: {json.dumps(data, default=str)}")
                         
-                        self.address_repository.save_address(data)
+                        page_batch.append(data)
                         
                         # После сбора тегов для адреса:
                         tag_counter += len(address_tags)
@@ -190,27 +307,51 @@ class EthplorerParser:
                         self.logger.error(f"Ошибка обработки блока: {e}")
                         continue
 
-                # Обработка пагинации
-                next_button = self.page.query_selector(
-                    'li.page-item:not(.disabled) a.page-link:has-text("»")'
+                saved_addresses += len(page_batch)
+                # Страница уходит в очередь записи; полная очередь притормозит обход.
+                # Чекпоинт сдвигается, только когда страница записана в БД или в spill
+                self.writer.put(
+                    page_batch,
+                    source='ethplorer-tags',
+                    on_done=partial(self.checkpoints.page_done, tag, current_page, saved_addresses)
                 )
-                
-                if not next_button:
-                    self.logger.info("Достигнут конец страниц")
-                    break
-                    
+                if self.sink:
+                    self.sink.write_batch(page_batch)
+                PAGES.inc(source='ethplorer')
+                ITERATIONS.inc(source='ethplorer')
+                RECORDS.inc(len(page_batch), source='ethplorer')
+                PAGE_SECONDS.observe(time.monotonic() - page_started, source='ethplorer')
+                self.logger.info(
+                    f"Страница {current_page}: в очередь записи адресов {len(page_batch)}, "
+                    f"трафик {self.traffic.summary()}"
+                )
+
+                if self.incremental:
+                    known_pages = known_pages + 1 if page_addresses and page_known == page_addresses else 0
+                    if known_pages >= self.incremental_stop_pages:
+                        self.logger.info(f"Тег {tag}: {known_pages} стр. подряд без новых адресов, остановка")
+                        completed = True
+                        break
+
+                # Обработка пагинации
                 try:
-                    next_button.click()
+                    page_started = time.monotonic()
+                    if not self._next_page():
+                        self.logger.info("Достигнут конец страниц")
+                        completed = True
+                        break
                     current_page += 1
                     self.logger.info(f"Переход на страницу {current_page}")
-                    self.page.wait_for_load_state("networkidle")
-                    time.sleep(1)  # Даем время на загрузку
                 except Exception as e:
                     self.logger.error(f"Ошибка пагинации: {e}")
                     break
 
+            if completed:
+                self.writer.put([], on_done=partial(self.checkpoints.finish, tag, current_page, saved_addresses))
+
             # Финализируем логирование
             self.logger.info(f"Обработано страниц: {current_page}")
+            self.logger.info(f"Ожидания: {self.waits.summary()}")
             self.logger.info(f"Всего уникальных адресов: {len(processed_addresses)}")
             self.logger.info(f"Всего тегов сохранено: {tag_counter}")
             self.logger.info(f"Среднее тегов на адрес: {tag_counter/len(processed_addresses) if processed_addresses else 0:.2f}")
@@ -218,54 +359,56 @@ class EthplorerParser:
         except Exception as e:
             self.logger.error(f"Критическая ошибка: {e}")
 
-    def append_to_json(self, data, filename='data/ethplorer_data.json'):
-        """Добавление новых данных в JSON файл"""
-        try:
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                existing_data = []
-            
-            existing_data.extend(data)
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=4)
-            
-            self.logger.info(f"Данные успешно сохранены в {filename}")
-                
-        except Exception as e:
-            self.logger.error(f"Ошибка при сохранении данных: {e}")
-
-    def save_to_json(self, data, filename='data/ethplorer_data.json'):
-        """Сохранение данных в JSON для последующей записи в SQL"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-            
     def close(self):
         """Закрытие браузера и playwright"""
+        if self.playwright is None:
+            return
         self.context.close()
         self.browser.close()
         self.playwright.stop()
+        self.playwright = None
+
+    def crawl_parallel(self, tags, concurrency):
+        """Параллельный обход тегов пулом async-контекстов (см. TagCrawlPool)"""
+        # Синхронный браузер нужен только для списка тегов, пул поднимает свой
+        self.close()
+        pool = TagCrawlPool(
+            self.base_url,
+            self.writer,
+            concurrency=concurrency,
+            sink=self.sink,
+            browser_factory=AsyncBrowserFactory.from_env(),
+            page_param=self.page_param,
+            pages_per_chunk=int(os.getenv('CRAWL_PAGES_PER_CHUNK', '0')),
+            checkpoints=self.checkpoints,
+            icon_fetcher=self.icon_fetcher,
+            response_url_pattern=os.getenv('ETHPLORER_RESPONSE_URL_PATTERN') or None,
+            known_addresses=self.known_addresses if self.incremental else None,
+            incremental_stop_pages=self.incremental_stop_pages
+        )
+        progress = asyncio.run(pool.run(tags))
+        for worker_id, stats in sorted(progress.items()):
+            self.logger.info(
+                f"Воркер {worker_id}: тегов {stats['tags']}, страниц {stats['pages']}, адресов {stats['addresses']}"
+            )
 
     async def process_address(self, address):
         try:
             await self.page.goto(f"{self.base_url}/address/{address}")
             await self.page.wait_for_load_state('networkidle')
             
-            # Получаем иконку
-            icon_data = None
+            # Получаем иконку через общий фоновый загрузчик
             icon_url = None
+            icon_sha256 = None
             icon_element = await self.page.query_selector('.tags-table-token-icon')
             if icon_element:
                 icon_url = await icon_element.get_attribute('src')
                 if icon_url:
                     if icon_url.startswith('/'):
                         icon_url = f"{self.base_url}{icon_url}"
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(icon_url) as response:
-                            if response.status == 200:
-                                icon_data = await response.read()  # Теперь сохраняем как bytes
+                    icon_sha256 = self.icon_fetcher.known_hash(icon_url)
+                    if not icon_sha256:
+                        self.icon_fetcher.submit(address, icon_url)
 
             # Получаем название и описание
             name = await self.get_text_content('.address-name-text')
@@ -281,14 +424,14 @@ class EthplorerParser:
                 'address': address,
                 'name': name,
                 'icon_url': icon_url,
-                'icon_data': icon_data,
+                'icon_sha256': icon_sha256,
                 'tags': tags
             }
             
             # Сохраняем в базу данных
             self.address_repository.save_address(data)
             
-            logging.info(f"Successfully processed address: {address}")
+            logging.debug(f"Successfully processed address: {address}")
             return True
             
         except Exception as e:
@@ -296,10 +439,18 @@ class EthplorerParser:
             return False
 
     def run(self):
+        # Ненулевой код выхода супервизор считает падением, а не завершенным обходом
+        exit_code = 0
         try:
             # Получаем тег из переменных окружения
             test_tag = os.getenv('TEST_TAG')
-            tags = [test_tag] if test_tag else self.get_tags()
+            tags = [test_tag] if test_tag else self.load_remaining_tags()
+
+            # Под супервизором процесс обходит только свой раздел тегов (TAG_SHARD=i/N)
+            shard = shard_from_env()
+            if shard and not test_tag:
+                tags = [tag for tag in tags if in_shard(tag, *shard)]
+                self.logger.info(f"Раздел тегов {shard[0] + 1} из {shard[1]}")
             
             self.logger.info(f"Режим работы: {'ТЕСТОВЫЙ' if test_tag else 'ПРОД'}") 
             self.logger.info(f"Найдено тегов: {len(tags)}")
@@ -307,20 +458,54 @@ class EthplorerParser:
             if not tags:
                 self.logger.info("Теги не найдены. Завершение работы.")
                 return
+
+            if self.incremental:
+                self.known_addresses = self.address_repository.get_known_addresses()
+
+            # Теги, обойденные в пределах окна свежести, пропускаем
+            fresh = [tag for tag in tags if self.checkpoints.is_fresh(tag)]
+            tags = [tag for tag in tags if not self.checkpoints.is_fresh(tag)]
+            if fresh:
+                self.logger.info(f"Пропущено свежих тегов: {len(fresh)}, осталось: {len(tags)}")
             
             # Собираем данные по каждому тегу
-            for tag in tags:
-                self.get_tag_data(tag)
-                self.logger.info(f"Обработан тег {tag}")
+            concurrency = int(os.getenv('CRAWL_CONCURRENCY', '1'))
+            if concurrency > 1:
+                self.logger.info(f"Параллельный обход: {concurrency} воркеров")
+                self.crawl_parallel(tags, concurrency)
+            else:
+                for tag in tags:
+                    self.get_tag_data(tag)
+                    self.logger.info(f"Обработан тег {tag}")
+                    if not test_tag:
+                        self.save_remaining_tags([t for t in tags if not self.checkpoints.is_fresh(t)])
             
+            # Чекпоинты двигает поток записи, дожидаемся последних
+            self.writer.flush(timeout=120)
+            if not test_tag and all(self.checkpoints.is_fresh(tag) for tag in tags):
+                # Обход завершен, следующий запуск заново получит список тегов
+                if os.path.exists(self.tags_file):
+                    os.remove(self.tags_file)
             self.logger.info("Все теги обработаны. Завершение работы.")
         
         except Exception as e:
             self.logger.error(f"Критическая ошибка: {e}")
+            exit_code = 1
         finally:
+            # Сначала адреса, потом иконки: ссылки на иконки требуют строк в addresses
+            self.writer.close()
+            if self.sink:
+                self.sink.close()
+            self.icon_fetcher.close()
             self.close()
-            os._exit(0)
+            os._exit(exit_code)
+
+def _terminate(signum, frame):
+    # SystemExit проходит мимо except Exception в run(), а finally дописывает очередь
+    sys.exit(128 + signum)
 
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _terminate)
+    start_from_env()
     parser = EthplorerParser()
     parser.run()
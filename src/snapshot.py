@@ -0,0 +1,342 @@
+import array
+import heapq
+import io
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from address_keys import address_key, key_to_address
+
+# Формат снапшота (little-endian):
+#   заголовок HEADER
+#   записи RECORD, отсортированные по (20-байтовый адрес, сеть)
+#   списки тегов: u32 id строк подряд, запись ссылается на (начало, длину)
+#   таблица строк: u32 смещения (string_count + 1) и UTF-8 данные
+MAGIC = b'LBLSNAP1'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQQ')   # magic, version, record_size, record_count, tags_offset, tags_count, strings_offset, string_count
+RECORD = struct.Struct('<20sIIIIH2x')  # address, chain, name, type, tags_start, tags_count
+NONE_ID = 0xFFFFFFFF
+
+# Строки addresses с тегами и унифицированным типом; EVM-адреса хранятся
+# в нижнем регистре, поэтому порядок COLLATE "C" совпадает с порядком байтов
+EXPORT_QUERY = """
+    SELECT a.chain, a.address, a.name, u.type,
+           COALESCE(array_agg(t.tag_oklink ORDER BY t.tag_oklink) FILTER (WHERE t.id IS NOT NULL), '{}')
+    FROM addresses a
+    LEFT JOIN address_tags at ON at.address_id = a.id
+    LEFT JOIN tags t ON t.id = at.tag_id
+    LEFT JOIN unified_addresses u ON u.chain = a.chain AND u.address = a.address
+    WHERE {condition}
+    GROUP BY a.id, u.type
+"""
+
+# Разделитель тегов в колонке COPY
+TAG_SEPARATOR = '\x1f'
+
+
+class SnapshotWriter:
+    """
+    Пишет снапшот потоком отсортированных записей
+
+    Записи сразу уходят в файл, в памяти остаются только таблица строк
+    и уникальные списки тегов (их на порядки меньше, чем адресов).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self._strings = {}
+        self._tag_lists = {}
+        self._tags = array.array('I')
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.tmp_path, 'wb')
+        self._file.write(b'\0' * HEADER.size)
+        return self
+
+    def _string_id(self, value):
+        if value is None:
+            return NONE_ID
+        string_id = self._strings.get(value)
+        if string_id is None:
+            string_id = self._strings[value] = len(self._strings)
+        return string_id
+
+    def add(self, key, chain, name, label_type, tags):
+        """Записи должны приходить в порядке (key, chain)"""
+        tags = tuple(tags)
+        tags_start = self._tag_lists.get(tags)
+        if tags_start is None:
+            tags_start = self._tag_lists[tags] = len(self._tags)
+            self._tags.extend(self._string_id(tag) for tag in tags)
+        self._file.write(RECORD.pack(
+            key,
+            self._string_id(chain),
+            self._string_id(name),
+            self._string_id(label_type),
+            tags_start,
+            len(tags)
+        ))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._file.close()
+            os.remove(self.tmp_path)
+            return False
+        tags_offset = self._file.tell()
+        self._file.write(self._tags.tobytes())
+
+        strings_offset = self._file.tell()
+        encoded = [value.encode('utf-8') for value in self._strings]
+        offsets = array.array('I', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        self._file.write(offsets.tobytes())
+        self._file.write(b''.join(encoded))
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(
+            MAGIC, VERSION, RECORD.size, self.count,
+            tags_offset, len(self._tags), strings_offset, len(encoded)
+        ))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        return False
+
+
+class LabelSnapshot:
+    """
+    Снапшот, открытый через mmap: открытие не читает файл целиком
+
+    Поиск - бинарный по отсортированному массиву записей фиксированной
+    ширины, строки декодируются лениво при обращении.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, record_size, self.count, tags_offset, tags_count,
+         strings_offset, string_count) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path}: неизвестный формат снапшота")
+        self._view = view = memoryview(self._mm)
+        self._records = view[HEADER.size:HEADER.size + self.count * RECORD.size]
+        self._tags = view[tags_offset:tags_offset + tags_count * 4].cast('I')
+        self._offsets = view[strings_offset:strings_offset + (string_count + 1) * 4].cast('I')
+        self._blob_offset = strings_offset + (string_count + 1) * 4
+        self._cache = {}
+
+    def close(self):
+        self._records.release()
+        self._tags.release()
+        self._offsets.release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, string_id):
+        if string_id == NONE_ID:
+            return None
+        value = self._cache.get(string_id)
+        if value is None:
+            start = self._blob_offset + self._offsets[string_id]
+            end = self._blob_offset + self._offsets[string_id + 1]
+            value = self._cache[string_id] = self._mm[start:end].decode('utf-8')
+        return value
+
+    def _key(self, i):
+        offset = i * RECORD.size
+        return bytes(self._records[offset:offset + 20])
+
+    def _record(self, i):
+        key, chain, name, label_type, tags_start, tags_count = RECORD.unpack_from(self._records, i * RECORD.size)
+        return {
+            'key': key,
+            'chain': self._string(chain),
+            'name': self._string(name),
+            'type': self._string(label_type),
+            'tags': [self._string(tag) for tag in self._tags[tags_start:tags_start + tags_count]]
+        }
+
+    def lookup(self, address, chain=None):
+        key = address_key(address)
+        if key is None:
+            return []
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        result = []
+        while low < self.count and self._key(low) == key:
+            record = self._record(low)
+            if chain is None or record['chain'] == chain:
+                del record['key']
+                result.append(record)
+            low += 1
+        return result
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._record(i)
+
+
+def export_snapshot(db, path, itersize=10000):
+    """
+    Выгружает адреса с метками из Postgres в снапшот потоком
+
+    EVM-адреса читаются серверным курсором уже в нужном порядке, остальные
+    (Tron) сортируются в памяти по 20-байтовому ключу и вливаются через merge.
+    """
+    started = time.monotonic()
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(EXPORT_QUERY.format(condition="a.address NOT LIKE '0x%'"))
+            others = sorted(
+                (key, chain, name, label_type, tags)
+                for chain, address, name, label_type, tags in cur
+                if (key := address_key(address)) is not None
+            )
+
+        def evm_rows():
+            with conn.cursor(name='snapshot_export') as cur:
+                cur.itersize = itersize
+                cur.execute(EXPORT_QUERY.format(condition="a.address LIKE '0x%'") + ' ORDER BY a.address COLLATE "C", a.chain')
+                for chain, address, name, label_type, tags in cur:
+                    key = address_key(address)
+                    if key is not None:
+                        yield key, chain, name, label_type, tags
+
+        with SnapshotWriter(path) as writer:
+            for key, chain, name, label_type, tags in heapq.merge(evm_rows(), others):
+                writer.add(key, chain, name, label_type, tags)
+        conn.rollback()
+    logging.info(f"Снапшот {path}: записей {writer.count}, {time.monotonic() - started:.1f} с")
+    return writer.count
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def import_snapshot(db, path, source='snapshot', chunk_size=50000):
+    """
+    Загружает снапшот в Postgres: COPY во временную таблицу и upsert в
+    addresses, tags, address_tags и unified_addresses одной транзакцией
+
+    Имя в unified_addresses обрезается по ширине колонки, как в unified_row.
+    """
+    from db.models import UNIFIED_NAME_WIDTH
+    started = time.monotonic()
+    with LabelSnapshot(path) as snapshot, db.get_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("""
+                    CREATE TEMP TABLE snapshot_import (
+                        chain VARCHAR(50), address VARCHAR(42), name VARCHAR(255),
+                        type VARCHAR(20), tags TEXT
+                    ) ON COMMIT DROP
+                """)
+                buffer = io.StringIO()
+                for i, record in enumerate(snapshot, 1):
+                    buffer.write('\t'.join((
+                        _copy_value(record['chain']),
+                        _copy_value(key_to_address(record['key'], record['chain'])),
+                        _copy_value(record['name']),
+                        _copy_value(record['type']),
+                        _copy_value(TAG_SEPARATOR.join(record['tags']))
+                    )) + '\n')
+                    if i % chunk_size == 0:
+                        buffer.seek(0)
+                        cur.copy_expert("COPY snapshot_import FROM STDIN", buffer)
+                        buffer = io.StringIO()
+                buffer.seek(0)
+                cur.copy_expert("COPY snapshot_import FROM STDIN", buffer)
+
+                cur.execute("""
+                    INSERT INTO addresses (chain, address, name)
+                    SELECT chain, address, name FROM snapshot_import
+                    ON CONFLICT (chain, address) DO UPDATE SET name = EXCLUDED.name
+                """)
+                cur.execute("""
+                    INSERT INTO tags (tag_oklink)
+                    SELECT DISTINCT unnest(string_to_array(tags, %s)) FROM snapshot_import
+                    ON CONFLICT (tag_oklink) DO NOTHING
+                """, (TAG_SEPARATOR,))
+                cur.execute("""
+                    INSERT INTO address_tags (address_id, tag_id)
+                    SELECT a.id, t.id
+                    FROM snapshot_import s
+                    JOIN addresses a ON a.chain = s.chain AND a.address = s.address
+                    CROSS JOIN LATERAL unnest(string_to_array(s.tags, %s)) AS tag(name)
+                    JOIN tags t ON t.tag_oklink = tag.name
+                    ON CONFLICT (address_id, tag_id) DO NOTHING
+                """, (TAG_SEPARATOR,))
+                cur.execute("""
+                    INSERT INTO unified_addresses (chain, address, type, address_name, labels, source)
+                    SELECT chain, address, type, LEFT(name, %s), '{}', %s
+                    FROM snapshot_import
+                    WHERE type IS NOT NULL
+                    ON CONFLICT (chain, address)
+                    DO UPDATE SET
+                        type = EXCLUDED.type,
+                        address_name = EXCLUDED.address_name
+                """, (UNIFIED_NAME_WIDTH, source))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"Ошибка импорта снапшота {path}: {e}")
+                raise
+    logging.info(f"Снапшот {path} загружен: записей {len(snapshot)}, {time.monotonic() - started:.1f} с")
+    return len(snapshot)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command, path = sys.argv[1], sys.argv[2]
+    if command == 'lookup':
+        started = time.perf_counter()
+        with LabelSnapshot(path) as snapshot:
+            opened = time.perf_counter()
+            for address in sys.argv[3:]:
+                print(address, snapshot.lookup(address))
+        logging.info(f"Открыт за {(opened - started) * 1000:.2f} ms, записей {len(snapshot)}")
+    else:
+        # Читателю снапшота psycopg2 не нужен, поэтому импорт только здесь
+        from db.models import Database
+        db = Database({
+            'dbname': os.getenv('DB_NAME'),
+            'user': os.getenv('DB_USER'),
+            'password': os.getenv('DB_PASSWORD'),
+            'host': os.getenv('DB_HOST'),
+            'port': os.getenv('DB_PORT')
+        })
+        if command == 'export':
+            export_snapshot(db, path)
+        elif command == 'import':
+            import_snapshot(db, path)
+        else:
+            raise SystemExit(f"Неизвестная команда: {command} (export | import | lookup)")
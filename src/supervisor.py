@@ -0,0 +1,374 @@
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from urllib.request import urlopen
+
+from metrics import REGISTRY, WORKER_RESTARTS, WORKERS_UP, escape_label_value, log_summary_every, serve_metrics
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {
+    'oklink': os.path.join(SRC_DIR, 'gpt_parser.py'),
+    'ethplorer': os.path.join(SRC_DIR, 'parser-ethplorer-tag.py'),
+}
+# Каталоги, куда несколько процессов не должны писать одни и те же файлы
+PER_WORKER_DIRS = ('JSONL_DIR', 'TOOLTIP_CORPUS_DIR')
+
+
+def in_shard(key, index, count):
+    """Стабильное разбиение по crc32: в каждом процессе ключ попадает в один и тот же шард"""
+    return zlib.crc32(key.encode('utf-8')) % count == index
+
+
+def shard_from_env(variable='TAG_SHARD'):
+    """(index, count) из переменной вида "1/4" или None"""
+    value = os.getenv(variable)
+    if not value:
+        return None
+    index, count = (int(part) for part in value.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"{variable}={value}: номер шарда вне 0..{count - 1}")
+    return index, count
+
+
+def parse_metrics(text):
+    """
+    Текст /metrics воркера по семействам: {имя: (строки HELP/TYPE, сэмплы)}
+
+    Сэмпл - (имя с суффиксом, метки без фигурных скобок, значение). Метки
+    остаются в экранированном виде: значения могут содержать пробелы,
+    запятые и скобки, поэтому значение сэмпла - после последнего пробела,
+    а метки - от первой '{' до последней '}'.
+    """
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            name = line.split(' ', 3)[2]
+            family = families.setdefault(name, ([], []))
+            if line not in family[0]:
+                family[0].append(line)
+            continue
+        if line.startswith('#') or family is None:
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, brace, labels = series.partition('{')
+        family[1].append((name, labels[:-1] if brace else '', float(value)))
+    return families
+
+
+def metric_total(families, name):
+    """Сумма сэмплов метрики по всем меткам"""
+    family = families.get(name)
+    return sum(value for _, _, value in family[1]) if family else 0
+
+
+class Worker:
+    """Процесс парсера одного шарда: запуск, остановка и опрос его /metrics"""
+    def __init__(self, name, kind, env, metrics_port):
+        self.name = name
+        self.kind = kind
+        self.env = env
+        self.metrics_port = metrics_port
+        self.process = None
+        self.started_at = 0
+        self.restart_at = None
+        self.failures = 0
+        self.health_failures = 0
+        self.iterations = None
+        self.progress_at = 0
+        self.metrics = {}
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        env = dict(self.env, PYTHONUNBUFFERED='1')
+        # Своя группа процессов, чтобы при остановке не осталось Chromium
+        self.process = subprocess.Popen(
+            [sys.executable, SCRIPTS[self.kind]],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors='replace',
+            start_new_session=True
+        )
+        threading.Thread(target=self._forward_output, args=(self.process,), name=f"worker-{self.name}", daemon=True).start()
+        self.started_at = self.progress_at = time.monotonic()
+        self.restart_at = None
+        self.health_failures = 0
+        self.iterations = None
+        self.metrics = {}
+        self.logger.info(f"Воркер {self.name} запущен, pid {self.process.pid}")
+
+    def _forward_output(self, process):
+        # Вывод воркера с его именем в начале строки
+        for line in process.stdout:
+            sys.stdout.write(f"[{self.name}] {line}")
+        process.stdout.close()
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=30):
+        """SIGTERM группе процессов воркера, через timeout секунд - SIGKILL"""
+        if not self.running():
+            return
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.process.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                self.process.wait(timeout)
+                return
+            except subprocess.TimeoutExpired:
+                self.logger.warning(f"Воркер {self.name} не завершился за {timeout} с")
+
+    def scrape(self, timeout):
+        """Метрики воркера или None, если /metrics не ответил"""
+        try:
+            with urlopen(f"http://127.0.0.1:{self.metrics_port}/metrics", timeout=timeout) as response:
+                self.metrics = parse_metrics(response.read().decode('utf-8'))
+            return self.metrics
+        except Exception as e:
+            self.logger.debug(f"Воркер {self.name}: /metrics недоступен: {e}")
+            return None
+
+
+class Supervisor:
+    """
+    Запускает воркеры-процессы по шардам и следит за ними
+
+    Раз в health_interval опрашивает /metrics каждого воркера. Воркер
+    перезапускается, если процесс завершился, если /metrics не отвечает
+    health_failures раз подряд (после start_grace секунд на запуск) или
+    если scraper_iterations_total не растет stall_seconds. Перезапуск после
+    падения - с экспоненциальной задержкой backoff_base..backoff_max и
+    случайным множителем 0.5-1.5, чтобы воркеры не стартовали разом;
+    проработавший healthy_seconds воркер сбрасывает счетчик падений.
+    Штатно завершившийся воркер (обход тегов Ethplorer закончен)
+    запускается снова через completed_delay.
+    """
+    def __init__(self, workers, health_interval=15, health_timeout=5, health_failures=3, start_grace=60,
+                 stall_seconds=600, backoff_base=5, backoff_max=300, healthy_seconds=300,
+                 completed_delay=3600, stop_timeout=30):
+        self.workers = workers
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health_failures = health_failures
+        self.start_grace = start_grace
+        self.stall_seconds = stall_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.healthy_seconds = healthy_seconds
+        self.completed_delay = completed_delay
+        self.stop_timeout = stop_timeout
+        self.logger = logging.getLogger(__name__)
+        self._stop = threading.Event()
+        self._last_totals = {}
+        self._last_summary = time.monotonic()
+
+    def _schedule_restart(self, worker, reason, returncode=None):
+        now = time.monotonic()
+        if returncode == 0:
+            delay = self.completed_delay
+        else:
+            if now - worker.started_at >= self.healthy_seconds:
+                worker.failures = 0
+            delay = min(self.backoff_max, self.backoff_base * 2 ** worker.failures)
+            worker.failures += 1
+        delay *= random.uniform(0.5, 1.5)
+        worker.restart_at = now + delay
+        WORKER_RESTARTS.inc(shard=worker.name, reason=reason)
+        self.logger.warning(f"Воркер {worker.name}: {reason}, перезапуск через {delay:.0f} с")
+
+    def check(self, worker):
+        now = time.monotonic()
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                worker.start()
+            return
+        if not worker.running():
+            returncode = worker.process.returncode
+            if returncode != 0:
+                self.logger.error(f"Воркер {worker.name} упал с кодом {returncode}")
+            self._schedule_restart(worker, 'completed' if returncode == 0 else 'crash', returncode)
+            return
+        metrics = worker.scrape(self.health_timeout)
+        if metrics is None:
+            if now - worker.started_at < self.start_grace:
+                return
+            worker.health_failures += 1
+            if worker.health_failures >= self.health_failures:
+                worker.stop(self.stop_timeout)
+                self._schedule_restart(worker, 'health')
+            return
+        worker.health_failures = 0
+        # Не страницы: в live-режиме опрос без новых строк страницу не добавляет
+        iterations = metric_total(metrics, 'scraper_iterations_total')
+        if worker.iterations is None or iterations > worker.iterations:
+            worker.iterations = iterations
+            worker.progress_at = now
+        elif self.stall_seconds and now - worker.progress_at >= self.stall_seconds:
+            worker.stop(self.stop_timeout)
+            self._schedule_restart(worker, 'stall')
+
+    def render(self):
+        """Свои метрики и метрики всех воркеров с меткой shard"""
+        # Семейства с одним именем сливаются: HELP/TYPE в выводе должны быть по разу
+        merged = {}
+        sources = [(None, parse_metrics(REGISTRY.render()))]
+        sources += [(worker.name, worker.metrics) for worker in self.workers]
+        for shard, families in sources:
+            for name, (headers, samples) in families.items():
+                family = merged.setdefault(name, (headers, []))
+                for sample_name, labels, value in samples:
+                    if shard is not None:
+                        shard_label = f'shard="{escape_label_value(shard)}"'
+                        labels = f'{labels},{shard_label}' if labels else shard_label
+                    series = f"{sample_name}{{{labels}}}" if labels else sample_name
+                    family[1].append(f"{series} {value:g}")
+        lines = []
+        for headers, samples in merged.values():
+            lines.extend(headers)
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Строка для лога: воркеры и суммарные скорости страниц и записей"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_summary, 1e-9)
+        self._last_summary = now
+        parts = [f"воркеров {sum(worker.running() for worker in self.workers)}/{len(self.workers)}"]
+        for name in ('scraper_pages_total', 'scraper_records_total'):
+            total = sum(metric_total(worker.metrics, name) for worker in self.workers)
+            # После перезапуска воркера его счетчики начинаются с нуля
+            rate = max(0.0, total - self._last_totals.get(name, 0)) / elapsed
+            self._last_totals[name] = total
+            short = name.removeprefix('scraper_').removesuffix('_total')
+            parts.append(f"{short}={total:g} ({rate:.2f}/с)")
+        return '; '.join(parts)
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        WORKERS_UP.set_function(lambda: sum(worker.running() for worker in self.workers))
+        for worker in self.workers:
+            worker.start()
+        try:
+            while not self._stop.wait(self.health_interval):
+                for worker in self.workers:
+                    try:
+                        self.check(worker)
+                    except Exception as e:
+                        self.logger.error(f"Ошибка проверки воркера {worker.name}: {e}")
+        finally:
+            self.logger.info("Останавливаем воркеры")
+            threads = [threading.Thread(target=worker.stop, args=(self.stop_timeout,)) for worker in self.workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    @classmethod
+    def from_env(cls, workers):
+        return cls(
+            workers,
+            health_interval=float(os.getenv('SUPERVISOR_HEALTH_INTERVAL', '15')),
+            health_timeout=float(os.getenv('SUPERVISOR_HEALTH_TIMEOUT', '5')),
+            health_failures=int(os.getenv('SUPERVISOR_HEALTH_FAILURES', '3')),
+            start_grace=float(os.getenv('SUPERVISOR_START_GRACE', '60')),
+            stall_seconds=float(os.getenv('SUPERVISOR_STALL_SECONDS', '600')),
+            backoff_base=float(os.getenv('SUPERVISOR_BACKOFF_BASE', '5')),
+            backoff_max=float(os.getenv('SUPERVISOR_BACKOFF_MAX', '300')),
+            healthy_seconds=float(os.getenv('SUPERVISOR_HEALTHY_SECONDS', '300')),
+            completed_delay=float(os.getenv('SUPERVISOR_COMPLETED_DELAY', '3600')),
+            stop_timeout=float(os.getenv('SUPERVISOR_STOP_TIMEOUT', '30'))
+        )
+
+
+def worker_env(name, metrics_port, **overrides):
+    """Окружение воркера: свои порт метрик, spill-файл и каталоги JSONL"""
+    env = dict(os.environ)
+    env.update({
+        'SCRAPER_SHARD': name,
+        'METRICS_PORT': str(metrics_port),
+        'METRICS_HOST': '127.0.0.1',
+        'SPILL_FILE': f"write_spill-{name}.jsonl",
+    })
+    for variable in PER_WORKER_DIRS:
+        if env.get(variable):
+            env[variable] = os.path.join(env[variable], name)
+    env.update(overrides)
+    return env
+
+
+def plan_from_env():
+    """
+    Воркеры по SUPERVISOR_SHARDS: шарды через ';', каждый "oklink:<страницы через запятую>"
+    (страница - сеть или сеть/путь, например ethereum/token-list) или
+    "ethplorer:<число разделов тегов>". Без SUPERVISOR_SHARDS страницы из
+    BLOCKCHAINS делятся по кругу между SUPERVISOR_WORKERS процессами
+    (по умолчанию по числу ядер).
+    """
+    shards = []
+    spec = os.getenv('SUPERVISOR_SHARDS')
+    if spec:
+        for shard in spec.split(';'):
+            kind, _, value = shard.strip().partition(':')
+            if kind == 'oklink':
+                shards.append(('oklink', value))
+            elif kind == 'ethplorer':
+                shards.append(('ethplorer', int(value or '1')))
+            elif kind:
+                raise ValueError(f"Неизвестный шард: {shard} (oklink:<сети> | ethplorer:<разделов>)")
+    else:
+        pages = [page.strip() for page in os.getenv('BLOCKCHAINS', os.getenv('BLOCKCHAIN', 'ethereum')).split(',') if page.strip()]
+        count = min(len(pages), int(os.getenv('SUPERVISOR_WORKERS') or os.cpu_count() or 1))
+        shards.extend(('oklink', ','.join(pages[i::count])) for i in range(count))
+
+    port = int(os.getenv('SUPERVISOR_WORKER_PORT_BASE', '9101'))
+    workers = []
+    oklink_index = 0
+    for kind, value in shards:
+        if kind == 'oklink':
+            name = f"oklink-{oklink_index}"
+            oklink_index += 1
+            workers.append(Worker(name, kind, worker_env(name, port, BLOCKCHAINS=value), port))
+            port += 1
+            continue
+        for index in range(value):
+            name = f"ethplorer-{index}-of-{value}"
+            # Свои файлы тегов и чекпоинтов: CheckpointStore сжимает журнал перезаписью
+            env = worker_env(
+                name, port,
+                TAG_SHARD=f"{index}/{value}",
+                TAGS_FILE=f"remaining_tags-{index}-of-{value}.txt",
+                CHECKPOINT_FILE=f"crawl_checkpoints-{index}-of-{value}.jsonl"
+            )
+            workers.append(Worker(name, kind, env, port))
+            port += 1
+    return workers
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    supervisor = Supervisor.from_env(plan_from_env())
+    logging.info(f"Воркеры: {', '.join(f'{worker.name} ({worker.kind})' for worker in supervisor.workers)}")
+    # Общий /metrics супервизора с метриками всех воркеров
+    if os.getenv('METRICS_PORT'):
+        serve_metrics(int(os.getenv('METRICS_PORT')), host=os.getenv('METRICS_HOST', '0.0.0.0'), registry=supervisor)
+    interval = float(os.getenv('METRICS_LOG_INTERVAL', '60'))
+    if interval > 0:
+        log_summary_every(interval, registry=supervisor)
+    supervisor.run()
@@ -1,4 +1,6 @@
 from playwright.sync_api import sync_playwright
+from browser_factory import SyncBrowserFactory
+from tooltip_parser import OBSERVER_PARSER
 import time
 import logging
 import json
@@ -15,12 +17,11 @@ def parse_addresses():
     addresses = {}
     
     with sync_playwright() as p:
-        # Запускаем браузер в headless режиме
-        browser = p.chromium.launch(
-            headless=True,
-            args=['--no-sandbox', '--disable-setuid-sandbox']
-        )
-        page = browser.new_page()
+        # Запускаем облегченный браузер в headless режиме
+        factory = SyncBrowserFactory.from_env()
+        browser = factory.launch(p)
+        context = factory.new_context(browser)
+        page, traffic = factory.new_page(context)
         
         try:
             # Загружаем страницу
@@ -44,23 +45,9 @@ def parse_addresses():
                 const observer = new MutationObserver((mutationsList) => {
                     for (const mutation of mutationsList) {
                         mutation.addedNodes.forEach(node => {
+                            // Разбор текста - в tooltip_parser.ObserverTooltipParser
                             if (node.nodeType === 1 && node.classList.contains('okui-tooltip')) {
-                                const text = node.innerText.trim();
-                                const lines = text.split('\\n');
-                
-                                if (lines.length === 2 && /^0x[a-f0-9]{40}$/i.test(lines[1])) {
-                                    window.tooltipData.push({
-                                        label: lines[0],
-                                        address: lines[1],
-                                    });
-                                    console.log('Parsed:', window.tooltipData[window.tooltipData.length - 1]);
-                                } else if (/^0x[a-f0-9]{40}$/i.test(text)) {
-                                    window.tooltipData.push({
-                                        label: null,
-                                        address: text,
-                                    });
-                                    console.log('Parsed:', window.tooltipData[window.tooltipData.length - 1]);
-                                }
+                                window.tooltipData.push(node.innerText.trim());
                             }
                         });
                     }
@@ -128,23 +115,19 @@ def parse_addresses():
             logger.info(f"Собрано tooltips: {len(tooltips)}")
             
             # Обрабатываем собранные tooltips
-            for tooltip in tooltips:
-                try:
-                    # Сохраняем только если есть имя
-                    if tooltip['label']:
-                        addresses[tooltip['address']] = tooltip['label']
-                        print(f"\nАдрес: {tooltip['address']}")
-                        print(f"Имя: {tooltip['label']}")
-                        print("-" * 50)
-                    else:
-                        logger.debug(f"Пропущен адрес без имени: {tooltip['address']}")
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке tooltip: {e}")
-                    logger.error(f"Содержимое tooltip: {tooltip}")
-                    continue
+            for record in OBSERVER_PARSER.parse_batch(tooltips):
+                # Сохраняем только если есть имя
+                if record.name:
+                    addresses[record.address] = record.name
+                    print(f"\nАдрес: {record.address}")
+                    print(f"Имя: {record.name}")
+                    print("-" * 50)
+                else:
+                    logger.debug(f"Пропущен адрес без имени: {record.address}")
             
             # Выводим итоговую статистику
             print(f"\nВсего найдено уникальных адресов с именами: {len(addresses)}")
+            logger.info(f"Трафик страницы: {traffic.summary()}")
             
         except Exception as e:
             logger.error(f"Произошла ошибка: {e}")
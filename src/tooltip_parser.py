@@ -0,0 +1,203 @@
+from abc import ABC, abstractmethod
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import NamedTuple, Optional
+
+# EVM: "Type: Name 0x..." или просто "Name 0x..."
+EVM_TOOLTIP_RE = re.compile(r"(?:(?P<type>\w+):\s+)?(?P<name>.+?)\s+(?P<address>0x[a-fA-F0-9]{40})")
+# Полный EVM-адрес в tooltip'е observer-а из test_parser.py
+OBSERVER_ADDRESS_RE = re.compile(r"0x[a-f0-9]{40}", re.IGNORECASE)
+RISK_MARKER = "reported as"
+RISK_SUFFIX = " address"
+
+
+class TooltipRecord(NamedTuple):
+    """Разобранный tooltip; kind: risk, name или observer"""
+    kind: str
+    type: Optional[str]
+    name: Optional[str]
+    address: Optional[str]
+
+    def as_dict(self):
+        """Запись в виде, который ждут poll_chain и save_addresses_bulk"""
+        return {'type': self.type, 'name': self.name, 'address': self.address}
+
+
+class TooltipParser(ABC):
+    """
+    Разбор текстов tooltip'ов без браузера
+
+    parse возвращает TooltipRecord или None, если текст не подходит;
+    parse_batch разбирает список и пропускает неподходящие тексты.
+    """
+    kind = 'name'
+
+    @abstractmethod
+    def parse(self, text):
+        """TooltipRecord или None"""
+
+    def parse_batch(self, texts):
+        parse = self.parse
+        return [record for record in map(parse, texts) if record is not None]
+
+
+class EvmTooltipParser(TooltipParser):
+    def parse(self, text):
+        # Без "0x" регулярка заведомо не совпадет, а неудачный поиск с .+? дорогой
+        if '0x' not in text:
+            return None
+        match = EVM_TOOLTIP_RE.match(text)
+        if match is None:
+            return None
+        label_type, name, address = match.groups()
+        # Если тип не найден, используем "other"
+        return TooltipRecord('name', label_type or 'other', name, address)
+
+
+class TronTooltipParser(TooltipParser):
+    """Tron: "Type: Name\\nAddress" ровно в две строки"""
+
+    def parse(self, text):
+        lines = text.split('\n')
+        if len(lines) != 2:
+            return None
+        label_type, separator, name = lines[0].partition(': ')
+        if not separator:
+            return None
+        return TooltipRecord('name', label_type, name, lines[1].strip())
+
+
+class RiskTooltipParser(TooltipParser):
+    """
+    Тултип риска: имя - текст после "reported as" без " address" в конце
+
+    Адреса в тексте нет, его подставляет вызывающий по строке таблицы.
+    """
+    kind = 'risk'
+
+    def parse(self, text, address=None):
+        _, marker, rest = text.partition(RISK_MARKER)
+        if not marker:
+            return None
+        # Как и раньше, берем только текст до следующего "reported as"
+        name = rest.partition(RISK_MARKER)[0].strip()
+        if name.endswith(RISK_SUFFIX):
+            name = name[:-len(RISK_SUFFIX)]
+        # Имя риска служит и типом
+        return TooltipRecord('risk', name, name, address)
+
+
+class ObserverTooltipParser(TooltipParser):
+    """Тексты .okui-tooltip из observer-а test_parser.py: "Label\\n0x..." или только адрес"""
+    kind = 'observer'
+
+    def parse(self, text):
+        lines = text.split('\n')
+        if len(lines) == 2 and OBSERVER_ADDRESS_RE.fullmatch(lines[1]):
+            return TooltipRecord('observer', None, lines[0], lines[1])
+        if OBSERVER_ADDRESS_RE.fullmatch(text):
+            return TooltipRecord('observer', None, None, text)
+        return None
+
+
+EVM_PARSER = EvmTooltipParser()
+RISK_PARSER = RiskTooltipParser()
+OBSERVER_PARSER = ObserverTooltipParser()
+CHAIN_PARSERS = {'tron': TronTooltipParser()}
+
+
+def parser_for(chain):
+    """Парсер именных tooltip'ов сети: у Tron свой формат, остальные сети EVM"""
+    return CHAIN_PARSERS.get(chain.lower(), EVM_PARSER)
+
+
+def parse_risk_name(risk_text):
+    """Имя из тултипа риска или None, если текст не про риск"""
+    record = RISK_PARSER.parse(risk_text)
+    return record.name if record else None
+
+
+def parse_tooltips(tooltips, chain):
+    """Разбирает тексты tooltip'ов в записи type/name/address"""
+    return [record.as_dict() for record in parser_for(chain).parse_batch(tooltips)]
+
+
+def synthetic_corpus(size, seed=1):
+    """Корпус вида записей read_records('tooltips'), если собранного нет"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        evm = '0x' + '%040x' % rng.getrandbits(160)
+        tron = 'T' + ''.join(rng.choice('123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz') for _ in range(33))
+        roll = rng.random()
+        if roll < 0.4:
+            corpus.append({'chain': 'ethereum', 'kind': 'name', 'text': f"Exchange: Binance {i} {evm}"})
+        elif roll < 0.5:
+            corpus.append({'chain': 'ethereum', 'kind': 'name', 'text': f"Uniswap V3 Router {i} {evm}"})
+        elif roll < 0.7:
+            corpus.append({'chain': 'tron', 'kind': 'name', 'text': f"Exchange: OKX {i}\n{tron}"})
+        elif roll < 0.8:
+            corpus.append({'chain': 'ethereum', 'kind': 'risk', 'text': f"This address is reported as Phishing {i} address"})
+        elif roll < 0.9:
+            corpus.append({'chain': 'ethereum', 'kind': 'observer', 'text': f"Coinbase {i}\n{evm}"})
+        else:
+            # Мусор: tooltip без адреса
+            corpus.append({'chain': 'ethereum', 'kind': 'name', 'text': f"Transfer {i} tokens"})
+    return corpus
+
+
+def benchmark(corpus, repeat=5, target_seconds=0.2):
+    """
+    Стоимость разбора по группам (kind, chain) корпуса
+
+    Каждая группа разбирается parse_batch столько раз, чтобы прогон длился
+    около target_seconds; из repeat прогонов берется лучший.
+    """
+    groups = {}
+    for entry in corpus:
+        groups.setdefault((entry.get('kind', 'name'), entry.get('chain', 'ethereum')), []).append(entry['text'])
+    results = []
+    for (kind, chain), texts in sorted(groups.items()):
+        if kind == 'risk':
+            parser = RISK_PARSER
+        elif kind == 'observer':
+            parser = OBSERVER_PARSER
+        else:
+            parser = parser_for(chain)
+        parsed = len(parser.parse_batch(texts))
+        started = time.perf_counter()
+        parser.parse_batch(texts)
+        loops = max(1, int(target_seconds / max(time.perf_counter() - started, 1e-9)))
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                parser.parse_batch(texts)
+            best = min(best, (time.perf_counter() - started) / loops)
+        per_tooltip = best / len(texts)
+        results.append({
+            'kind': kind,
+            'chain': chain,
+            'parser': type(parser).__name__,
+            'tooltips': len(texts),
+            'parsed': parsed,
+            'ns_per_tooltip': round(per_tooltip * 1e9, 1),
+            'seconds_per_million': round(per_tooltip * 1e6, 3)
+        })
+    return results
+
+
+if __name__ == "__main__":
+    # Корпус: каталог TOOLTIP_CORPUS_DIR, куда gpt_parser пишет тексты tooltip'ов
+    corpus_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv('TOOLTIP_CORPUS_DIR')
+    if corpus_dir:
+        from jsonl_sink import read_records
+        corpus = list(read_records(corpus_dir, 'tooltips'))
+    else:
+        corpus = synthetic_corpus(int(os.getenv('TOOLTIP_BENCH_SIZE', '10000')))
+    for result in benchmark(corpus, repeat=int(os.getenv('TOOLTIP_BENCH_REPEAT', '5'))):
+        print(json.dumps(result, ensure_ascii=False))
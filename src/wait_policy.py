@@ -0,0 +1,153 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import time
+from metrics import STEP_SECONDS
+
+
+# Сравнение текста первого элемента с тем, что было до действия
+CONTENT_CHANGED_SCRIPT = """
+([selector, before]) => {
+    const el = document.querySelector(selector);
+    return !!el && el.innerText.trim() !== before;
+}
+"""
+
+# Сравнение числа элементов с тем, что было до действия
+ROW_COUNT_CHANGED_SCRIPT = """
+([selector, before]) => document.querySelectorAll(selector).length !== before
+"""
+
+
+class WaitPolicy:
+    """
+    Ожидание конкретных сигналов готовности вместо фиксированных пауз
+
+    Для каждого именованного ожидания хранится окно последних успешных
+    длительностей. Пока замеров меньше min_samples, используется
+    defaults[name] или default_timeout, потом таймаут = percentile окна
+    * margin в пределах [min_timeout, max_timeout]. Все таймауты в мс.
+
+    Ожидание, исчерпавшее таймаут, пишется в окно как замер, равный
+    таймауту, чтобы окно могло расти. После reset_failures неудач подряд
+    окно сбрасывается и снова действует таймаут по умолчанию.
+    """
+    def __init__(self, default_timeout=10000, min_timeout=500, max_timeout=30000,
+                 percentile=0.99, margin=2.0, window=200, min_samples=20, defaults=None,
+                 reset_failures=3):
+        self.default_timeout = default_timeout
+        self.defaults = defaults or {}
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.reset_failures = reset_failures
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.failures = defaultdict(int)
+        self.consecutive_failures = defaultdict(int)
+
+    def observed(self, name, q):
+        """Перцентиль q наблюдаемых длительностей ожидания name в мс"""
+        samples = sorted(self.durations[name])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self, name):
+        if len(self.durations[name]) < self.min_samples:
+            return self.defaults.get(name, self.default_timeout)
+        tuned = self.observed(name, self.percentile) * self.margin
+        return int(min(self.max_timeout, max(self.min_timeout, tuned)))
+
+    @contextmanager
+    def measure(self, name):
+        """Замеряет ожидание name; внутрь отдает текущий таймаут"""
+        started = time.monotonic()
+        timeout = self.timeout(name)
+        try:
+            yield timeout
+        except Exception:
+            self.failures[name] += 1
+            self.consecutive_failures[name] += 1
+            if self.consecutive_failures[name] >= self.reset_failures:
+                # Страница стала медленнее окна: заново с таймаута по умолчанию
+                self.durations[name].clear()
+                self.consecutive_failures[name] = 0
+            elif (time.monotonic() - started) * 1000 >= timeout:
+                # Быстрые ошибки (элемента нет) в окно не пишем, а исчерпанный
+                # таймаут - нижняя оценка настоящей длительности
+                self.durations[name].append(timeout)
+            raise
+        self.consecutive_failures[name] = 0
+        elapsed = time.monotonic() - started
+        self.durations[name].append(elapsed * 1000)
+        STEP_SECONDS.observe(elapsed, step=name)
+
+    def summary(self):
+        """Строка p50/p95/таймаут по каждому ожиданию для логов"""
+        parts = []
+        for name in sorted(set(self.durations) | set(self.failures)):
+            p50 = self.observed(name, 0.5)
+            p95 = self.observed(name, 0.95)
+            if p50 is None:
+                parts.append(f"{name}: нет замеров, ошибок {self.failures[name]}")
+                continue
+            parts.append(
+                f"{name}: p50={p50:.0f}ms p95={p95:.0f}ms "
+                f"timeout={self.timeout(name)}ms ошибок {self.failures[name]}"
+            )
+        return '; '.join(parts)
+
+
+class AsyncWaitPolicy(WaitPolicy):
+    """WaitPolicy для playwright.async_api"""
+
+    async def selector(self, page, name, selector, state='visible'):
+        with self.measure(name) as timeout:
+            return await page.wait_for_selector(selector, state=state, timeout=timeout)
+
+    async def function(self, page, name, script, arg=None):
+        with self.measure(name) as timeout:
+            return await page.wait_for_function(script, arg=arg, timeout=timeout)
+
+    async def content_change(self, page, name, selector, before):
+        with self.measure(name) as timeout:
+            return await page.wait_for_function(CONTENT_CHANGED_SCRIPT, arg=[selector, before], timeout=timeout)
+
+    async def row_count_change(self, page, name, selector, before):
+        with self.measure(name) as timeout:
+            return await page.wait_for_function(ROW_COUNT_CHANGED_SCRIPT, arg=[selector, before], timeout=timeout)
+
+    async def response(self, page, name, predicate, action):
+        """Выполняет action() и ждет ответ, подходящий под predicate"""
+        with self.measure(name) as timeout:
+            async with page.expect_response(predicate, timeout=timeout) as response_info:
+                await action()
+            return await response_info.value
+
+
+class SyncWaitPolicy(WaitPolicy):
+    """WaitPolicy для playwright.sync_api"""
+
+    def selector(self, page, name, selector, state='visible'):
+        with self.measure(name) as timeout:
+            return page.wait_for_selector(selector, state=state, timeout=timeout)
+
+    def function(self, page, name, script, arg=None):
+        with self.measure(name) as timeout:
+            return page.wait_for_function(script, arg=arg, timeout=timeout)
+
+    def content_change(self, page, name, selector, before):
+        with self.measure(name) as timeout:
+            return page.wait_for_function(CONTENT_CHANGED_SCRIPT, arg=[selector, before], timeout=timeout)
+
+    def row_count_change(self, page, name, selector, before):
+        with self.measure(name) as timeout:
+            return page.wait_for_function(ROW_COUNT_CHANGED_SCRIPT, arg=[selector, before], timeout=timeout)
+
+    def response(self, page, name, predicate, action):
+        """Выполняет action() и ждет ответ, подходящий под predicate"""
+        with self.measure(name) as timeout:
+            with page.expect_response(predicate, timeout=timeout) as response_info:
+                action()
+            return response_info.value
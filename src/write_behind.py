@@ -0,0 +1,446 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from metrics import DB_BATCH_SECONDS, QUEUE_DEPTH
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+# Ошибки, после которых БД считается недоступной: сеть и соединение.
+# Остальные (например, значение шире колонки) - ошибки данных конкретных записей
+OUTAGE_ERRORS = (OSError,)
+if psycopg2 is not None:
+    OUTAGE_ERRORS += (psycopg2.OperationalError, psycopg2.InterfaceError)
+if asyncpg is not None:
+    OUTAGE_ERRORS += (
+        asyncpg.exceptions.PostgresConnectionError,
+        asyncpg.exceptions.OperatorInterventionError,
+        asyncpg.exceptions.InterfaceError,
+    )
+
+
+class BaseWriteBehindQueue:
+    """
+    Общее для синхронной и asyncio-очереди: spill-файл, карантин и статистика
+
+    Запуск, остановка и сама запись у каждой очереди свои: close()
+    синхронной очереди ждет поток, у asyncio-очереди это корутина.
+    """
+    def __init__(self, repository, spill_path, batch_size=500, flush_interval=1.0,
+                 retry_interval=30, quarantine_path=None):
+        self.repository = repository
+        self.spill_path = spill_path
+        self.quarantine_path = quarantine_path or f"{os.path.splitext(spill_path)[0]}-quarantine.jsonl"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._db_down = False
+        self._last_retry = 0
+        self.stats = {'queued': 0, 'saved': 0, 'batches': 0, 'spilled': 0, 'replayed': 0, 'quarantined': 0, 'waits': 0}
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _entries(self, items, source, on_done):
+        """Записи для очереди; on_done идет за ними отметкой с source=None"""
+        entries = [(source, item) for item in items]
+        if on_done is not None:
+            entries.append((None, on_done))
+        return entries
+
+    def _split_done(self, batch):
+        """Отделяет отметки on_done от записей пачки"""
+        entries = [entry for entry in batch if entry[0] is not None]
+        callbacks = [entry[1] for entry in batch if entry[0] is None]
+        return entries, callbacks
+
+    def _done(self, callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"Ошибка в on_done очереди записи: {e}")
+
+    def _groups(self, batch):
+        groups = {}
+        for source, item in batch:
+            groups.setdefault(source, []).append(item)
+        return groups
+
+    def _outage(self, batch, error):
+        self.logger.error(f"БД недоступна, пачка из {len(batch)} записей уходит в {self.spill_path}: {error}")
+        self._db_down = True
+        self._last_retry = time.monotonic()
+        # Повторная запись уже сохраненных групп безопасна: upsert идемпотентен
+        self._spill(batch)
+
+    def _append(self, path, entries):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill(self, batch):
+        self._append(self.spill_path, ({'source': source, 'item': item} for source, item in batch))
+        self.stats['spilled'] += len(batch)
+
+    def _quarantine(self, batch, error):
+        """Записи, которые БД отвергла, с текстом ошибки; разбираются вручную"""
+        self.logger.error(f"Запись отвергнута БД и отправлена в {self.quarantine_path}: {error}")
+        self._append(self.quarantine_path, (
+            {'source': source, 'item': item, 'error': str(error)} for source, item in batch
+        ))
+        self.stats['quarantined'] += len(batch)
+
+    def _read_spill(self):
+        """Записи из spill-файла; None, если файла нет"""
+        try:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        batch = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная последняя строка после падения
+                self.logger.warning(f"Пропущена битая строка spill-файла: {line[:80]!r}")
+                continue
+            batch.append((entry['source'], entry['item']))
+        return batch
+
+    def _replay_failed(self, batch, start, error):
+        self.logger.warning(f"БД все еще недоступна, в {self.spill_path} осталось {len(batch) - start} записей: {error}")
+        self._db_down = True
+        self._rewrite_spill(batch[start:])
+
+    def _replay_done(self, batch):
+        os.remove(self.spill_path)
+        if batch:
+            self.logger.info(f"Из {self.spill_path} записано в БД: {len(batch)}")
+        self._db_down = False
+
+    def _rewrite_spill(self, batch):
+        tmp_path = f"{self.spill_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for source, item in batch:
+                f.write(json.dumps({'source': source, 'item': item}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spill_path)
+
+
+class WriteBehindQueue(BaseWriteBehindQueue):
+    """
+    Отложенная запись адресов в БД из фонового потока
+
+    Парсеры кладут записи в ограниченную очередь и сразу продолжают обход,
+    поток пишет их через save_addresses_bulk пачками по batch_size или раз
+    в flush_interval секунд. Полная очередь притормаживает парсер
+    (back-pressure). Если БД недоступна, пачки дописываются в spill_path
+    (JSONL с fsync) и повторяются раз в retry_interval секунд, а также при
+    следующем запуске. Пачка с ошибкой данных делится пополам, пока плохие
+    записи не останутся по одной; они уходят в quarantine_path, остальные
+    пишутся как обычно. close() дописывает все, что осталось в очереди.
+
+    on_done в put() вызывается из потока записи, когда все поставленные до
+    него записи сохранены в БД, в spill или в карантин, - например, чтобы
+    двигать чекпоинт обхода только после записи страницы.
+    """
+    def __init__(self, repository, spill_path, max_size=10000, batch_size=500,
+                 flush_interval=1.0, retry_interval=30, quarantine_path=None):
+        super().__init__(repository, spill_path, batch_size=batch_size, flush_interval=flush_interval,
+                         retry_interval=retry_interval, quarantine_path=quarantine_path)
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        QUEUE_DEPTH.set_function(self.pending)
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, items, source='oklink-txs', on_done=None):
+        """Ставит записи в очередь; при полной очереди блокирует вызывающего"""
+        for entry in self._entries(items, source, on_done):
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                self.stats['waits'] += 1
+                self._queue.put(entry)
+            if entry[0] is not None:
+                self.stats['queued'] += 1
+
+    async def put_async(self, items, source='oklink-txs', on_done=None):
+        """put() для event loop: при полной очереди ждет, не блокируя loop"""
+        for entry in self._entries(items, source, on_done):
+            while True:
+                try:
+                    self._queue.put_nowait(entry)
+                    break
+                except queue.Full:
+                    self.stats['waits'] += 1
+                    await asyncio.sleep(self.flush_interval / 10)
+            if entry[0] is not None:
+                self.stats['queued'] += 1
+
+    def flush(self, timeout=None):
+        """Ждет, пока записи, поставленные до вызова, будут записаны; False по таймауту"""
+        done = threading.Event()
+        self.put([], on_done=done.set)
+        return done.wait(timeout)
+
+    def close(self, timeout=120):
+        """Дописывает очередь в БД (или в spill) и останавливает поток"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.logger.info(f"Очередь записи остановлена: {self.stats}")
+
+    def _run(self):
+        self._replay()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch, callbacks = self._split_done(self._collect())
+            if batch:
+                self._write(batch)
+            self._done(callbacks)
+            if self._db_down and time.monotonic() - self._last_retry >= self.retry_interval:
+                self._replay()
+
+    def _collect(self):
+        """Пачка до batch_size записей или то, что пришло за flush_interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _save(self, batch):
+        for source, items in self._groups(batch).items():
+            self.repository.save_addresses_bulk(items, source=source)
+
+    def _save_split(self, batch):
+        """
+        Пишет пачку с ошибкой данных частями, плохие записи - в карантин
+
+        Возвращает (сохранено, остаток, ошибка): остаток не пуст, если
+        по дороге БД стала недоступна.
+        """
+        saved = 0
+        parts = [batch]
+        while parts:
+            part = parts.pop()
+            try:
+                self._save(part)
+                saved += len(part)
+            except OUTAGE_ERRORS as e:
+                return saved, [entry for rest in [part] + parts[::-1] for entry in rest], e
+            except Exception as e:
+                if len(part) == 1:
+                    self._quarantine(part, e)
+                else:
+                    middle = len(part) // 2
+                    parts.extend((part[middle:], part[:middle]))
+        return saved, [], None
+
+    def _write(self, batch):
+        if self._db_down:
+            self._spill(batch)
+            return
+        try:
+            with DB_BATCH_SECONDS.time():
+                self._save(batch)
+            saved = len(batch)
+        except OUTAGE_ERRORS as e:
+            self._outage(batch, e)
+            return
+        except Exception as e:
+            self.logger.error(f"Ошибка данных в пачке из {len(batch)} записей, пишем ее частями: {e}")
+            saved, rest, error = self._save_split(batch)
+            if rest:
+                self._outage(rest, error)
+        self.stats['saved'] += saved
+        self.stats['batches'] += 1
+
+    def _replay(self):
+        """Переносит записи из spill-файла в БД; неудачный остаток остается в файле"""
+        self._last_retry = time.monotonic()
+        batch = self._read_spill()
+        if batch is None:
+            self._db_down = False
+            return
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                self._save(chunk)
+                saved = len(chunk)
+            except OUTAGE_ERRORS as e:
+                self._replay_failed(batch, start, e)
+                return
+            except Exception:
+                # Плохие записи уходят в карантин, а не блокируют spill-файл навсегда
+                saved, rest, error = self._save_split(chunk)
+                if rest:
+                    self._replay_failed(rest + batch[start + len(chunk):], 0, error)
+                    return
+            self.stats['replayed'] += saved
+        self._replay_done(batch)
+
+
+class AsyncWriteBehindQueue(BaseWriteBehindQueue):
+    """
+    WriteBehindQueue для asyncio и AsyncAddressRepository
+
+    Пишет задачей в том же event loop вместо потока: save_addresses_bulk
+    репозитория — корутина, а работа со spill-файлом уходит в пул потоков.
+    start() вызывается из работающего loop, записи ставятся через put_async.
+    """
+    def __init__(self, repository, spill_path, max_size=10000, batch_size=500,
+                 flush_interval=1.0, retry_interval=30, quarantine_path=None):
+        super().__init__(repository, spill_path, batch_size=batch_size, flush_interval=flush_interval,
+                         retry_interval=retry_interval, quarantine_path=quarantine_path)
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._stopping = None
+        self._task = None
+
+    def start(self):
+        QUEUE_DEPTH.set_function(self.pending)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def put_async(self, items, source='oklink-txs', on_done=None):
+        """Ставит записи в очередь; при полной очереди ждет writer"""
+        for entry in self._entries(items, source, on_done):
+            if self._queue.full():
+                self.stats['waits'] += 1
+            await self._queue.put(entry)
+            if entry[0] is not None:
+                self.stats['queued'] += 1
+
+    async def close(self, timeout=120):
+        """Дописывает очередь в БД (или в spill) и останавливает задачу"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"Очередь записи не успела дописаться, осталось: {self.pending()}")
+        self._task = None
+        self.logger.info(f"Очередь записи остановлена: {self.stats}")
+
+    async def _run(self):
+        await self._replay()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch, callbacks = self._split_done(await self._collect())
+            if batch:
+                await self._write(batch)
+            # on_done может писать на диск, как чекпоинты
+            if callbacks:
+                await asyncio.to_thread(self._done, callbacks)
+            if self._db_down and time.monotonic() - self._last_retry >= self.retry_interval:
+                await self._replay()
+
+    async def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _save(self, batch):
+        for source, items in self._groups(batch).items():
+            await self.repository.save_addresses_bulk(items, source=source)
+
+    async def _save_split(self, batch):
+        saved = 0
+        parts = [batch]
+        while parts:
+            part = parts.pop()
+            try:
+                await self._save(part)
+                saved += len(part)
+            except OUTAGE_ERRORS as e:
+                return saved, [entry for rest in [part] + parts[::-1] for entry in rest], e
+            except Exception as e:
+                if len(part) == 1:
+                    await asyncio.to_thread(self._quarantine, part, e)
+                else:
+                    middle = len(part) // 2
+                    parts.extend((part[middle:], part[:middle]))
+        return saved, [], None
+
+    async def _write(self, batch):
+        if self._db_down:
+            await asyncio.to_thread(self._spill, batch)
+            return
+        try:
+            with DB_BATCH_SECONDS.time():
+                await self._save(batch)
+            saved = len(batch)
+        except OUTAGE_ERRORS as e:
+            await asyncio.to_thread(self._outage, batch, e)
+            return
+        except Exception as e:
+            self.logger.error(f"Ошибка данных в пачке из {len(batch)} записей, пишем ее частями: {e}")
+            saved, rest, error = await self._save_split(batch)
+            if rest:
+                await asyncio.to_thread(self._outage, rest, error)
+        self.stats['saved'] += saved
+        self.stats['batches'] += 1
+
+    async def _replay(self):
+        self._last_retry = time.monotonic()
+        batch = await asyncio.to_thread(self._read_spill)
+        if batch is None:
+            self._db_down = False
+            return
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                await self._save(chunk)
+                saved = len(chunk)
+            except OUTAGE_ERRORS as e:
+                await asyncio.to_thread(self._replay_failed, batch, start, e)
+                return
+            except Exception:
+                saved, rest, error = await self._save_split(chunk)
+                if rest:
+                    await asyncio.to_thread(self._replay_failed, rest + batch[start + len(chunk):], 0, error)
+                    return
+            self.stats['replayed'] += saved
+        await asyncio.to_thread(self._replay_done, batch)